@@ -0,0 +1,186 @@
+from __future__ import annotations
+from typing import Dict, Any, List
+from collections import OrderedDict
+import threading
+import time
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """Chuẩn hóa câu hỏi cho so khớp chính xác: lowercase, gộp khoảng trắng."""
+    return " ".join(query.lower().split())
+
+
+class AnswerCache:
+    """Cache câu trả lời theo câu hỏi (LRU + TTL).
+
+    - Đường nhanh: khớp chính xác câu hỏi đã chuẩn hóa.
+    - Khớp ngữ nghĩa: cosine giữa embedding câu hỏi mới và các câu hỏi đã cache,
+      lấy khi >= threshold.
+    Toàn bộ cache bị xóa khi hash nội dung KB (index["kb_hash"]) thay đổi.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        max_size: int = 1000,
+        ttl_seconds: float | None = 24 * 3600,
+    ) -> None:
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.kb_hash: str | None = None
+        self.hits = 0
+        self.misses = 0
+
+        # key (câu hỏi chuẩn hóa) -> {"answer", "vec", "time"}
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Ma trận embedding cập nhật tăng dần: mỗi key có vector giữ một dòng (slot),
+        # dòng của key bị xóa được đánh dấu trống và dùng lại cho key sau
+        self._mat: np.ndarray | None = None
+        self._valid = np.zeros(0, dtype=bool)
+        self._slot_keys: List[str | None] = []
+        self._slots: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _reset(self) -> None:
+        self._entries.clear()
+        self._mat = None
+        self._valid = np.zeros(0, dtype=bool)
+        self._slot_keys = []
+        self._slots = {}
+        self._free = []
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def _check_kb(self, kb_hash: str | None) -> None:
+        if kb_hash != self.kb_hash:
+            self._reset()
+            self.kb_hash = kb_hash
+
+    def _expired(self, entry: Dict[str, Any], now: float) -> bool:
+        return self.ttl_seconds is not None and now - entry["time"] > self.ttl_seconds
+
+    def _release_slot(self, key: str) -> None:
+        slot = self._slots.pop(key, None)
+        if slot is not None:
+            self._valid[slot] = False
+            self._slot_keys[slot] = None
+            self._free.append(slot)
+
+    def _set_vector(self, key: str, vec: np.ndarray) -> None:
+        slot = self._slots.get(key)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = len(self._slot_keys)
+                if self._mat is None or slot >= self._mat.shape[0]:
+                    # Tăng gấp đôi dung lượng: chi phí chép trung bình O(d) mỗi lần thêm
+                    cap = max(16, 2 * slot)
+                    mat = np.zeros((cap, vec.shape[0]), dtype=np.float32)
+                    valid = np.zeros(cap, dtype=bool)
+                    if self._mat is not None:
+                        mat[:slot] = self._mat[:slot]
+                        valid[:slot] = self._valid[:slot]
+                    self._mat, self._valid = mat, valid
+                self._slot_keys.append(None)
+            self._slots[key] = slot
+            self._slot_keys[slot] = key
+        self._mat[slot] = vec
+        self._valid[slot] = True
+
+    def _drop(self, key: str) -> None:
+        self._entries.pop(key, None)
+        self._release_slot(key)
+
+    def get_exact(self, query: str, kb_hash: str | None = None) -> str | None:
+        """Chỉ tra theo câu hỏi chuẩn hóa (không cần embedding)."""
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            self._check_kb(kb_hash)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry, now):
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["answer"]
+
+    def get(
+        self,
+        query: str,
+        q_vec: np.ndarray | None = None,
+        kb_hash: str | None = None,
+        exact: bool = True,
+    ) -> str | None:
+        """Tra chính xác trước (exact=False nếu caller đã gọi get_exact), sau đó tra ngữ nghĩa
+        nếu có q_vec. Miss thì trả None."""
+        if exact:
+            ans = self.get_exact(query, kb_hash)
+            if ans is not None:
+                return ans
+        if q_vec is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        q = np.asarray(q_vec, dtype=np.float32)
+        q = q / max(float(np.linalg.norm(q)), 1e-9)
+        now = time.time()
+        with self._lock:
+            self._check_kb(kb_hash)
+            if self._mat is not None and self._slots:
+                n = len(self._slot_keys)
+                sims = self._mat[:n] @ q
+                sims[~self._valid[:n]] = -np.inf
+                cand = np.flatnonzero(sims >= self.threshold)
+                # Ứng viên tốt nhất đã hết hạn thì bỏ và thử ứng viên kế tiếp
+                for slot in cand[np.argsort(-sims[cand], kind="stable")].tolist():
+                    key = self._slot_keys[slot]
+                    entry = self._entries[key]
+                    if self._expired(entry, now):
+                        self._drop(key)
+                        continue
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry["answer"]
+            self.misses += 1
+            return None
+
+    def put(
+        self,
+        query: str,
+        answer: str,
+        q_vec: np.ndarray | None = None,
+        kb_hash: str | None = None,
+    ) -> None:
+        key = normalize_query(query)
+        vec = None
+        if q_vec is not None:
+            vec = np.asarray(q_vec, dtype=np.float32)
+            vec = vec / max(float(np.linalg.norm(vec)), 1e-9)
+        with self._lock:
+            self._check_kb(kb_hash)
+            self._entries[key] = {"answer": answer, "vec": vec, "time": time.time()}
+            self._entries.move_to_end(key)
+            if vec is not None:
+                self._set_vector(key, vec)
+            else:
+                self._release_slot(key)
+            while len(self._entries) > self.max_size:
+                old_key, _ = self._entries.popitem(last=False)
+                self._release_slot(old_key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,285 @@
+"""Trả lời hàng loạt câu hỏi từ file (đánh giá offline, chạy số lượng lớn).
+
+    python batch_qa.py questions.jsonl answers.jsonl
+    python batch_qa.py questions.csv answers.jsonl --concurrency 8
+
+Đầu vào:
+- JSONL: mỗi dòng {"id": ..., "question": ...} (hoặc "query"), hay chỉ một chuỗi JSON
+- CSV: có cột "question" (hoặc "query"), cột "id" tùy chọn; không có thì lấy cột đầu tiên
+Không có id thì dùng số dòng của câu hỏi trong file (JSONL từ 1; CSV tính cả dòng header).
+
+Mỗi lô BATCH_QA_CHUNK câu: embed câu hỏi theo batch, chấm điểm vector cả lô bằng một phép nhân
+ma trận, so khớp triệu chứng dạng ma trận; sau đó sinh câu trả lời song song (tối đa
+BATCH_QA_CONCURRENCY lời gọi cùng lúc) trong khi lô kế tiếp được chuẩn bị.
+
+Đầu ra là JSONL, mỗi câu trả lời được ghi + flush ngay khi xong (thứ tự có thể khác đầu vào).
+File đầu ra cũng là checkpoint: chạy lại cùng lệnh sẽ bỏ qua các id đã có câu trả lời
+(--restart để làm lại từ đầu). Câu gọi model lỗi không được ghi, lần chạy sau sẽ thử lại.
+Không dùng cache câu trả lời: mỗi câu hỏi đều được model trả lời thật.
+"""
+from __future__ import annotations
+from typing import Dict, Any, List, Iterator, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from config import EXCEL_PATH, BATCH_QA_CHUNK, BATCH_QA_CONCURRENCY, RETRIEVAL_MODE, init_genai
+import metrics
+from chat_rag import (
+    ChatEngine,
+    build_user_prompt,
+    RETRIEVE_K,
+    SYMPTOM_MIN_SCORE,
+    SYMPTOM_MAX_RESULTS,
+)
+from kb_snapshot import load_or_build_kb
+from rag_index import embed_queries, retrieve_batch
+from symptoms import find_symptom_matches_batch
+
+_QUESTION_FIELDS = ("question", "query")
+
+
+def _jsonl_rows(f: Any, path: str) -> Iterator[Tuple[int, Any]]:
+    # Dòng JSON hỏng chỉ bị bỏ qua (kèm cảnh báo), không làm dừng cả lần chạy
+    for line_no, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except json.JSONDecodeError as e:
+            print(f"⚠️ Bỏ qua dòng {line_no} của '{path}': JSON không hợp lệ ({e.msg})")
+
+
+def _csv_rows(f: Any) -> Iterator[Tuple[int, Any]]:
+    reader = csv.DictReader(f)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_questions(path: str) -> Iterator[Tuple[str, str]]:
+    """Đọc lần lượt (id, câu hỏi) từ file JSONL hoặc CSV (theo đuôi file), bỏ câu rỗng và dòng hỏng.
+
+    Không có id thì dùng số dòng trong file (header CSV là dòng 1): id không đổi khi dòng khác
+    bị bỏ qua hay được sửa, nên checkpoint vẫn khớp.
+    """
+    is_csv = path.lower().endswith(".csv")
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        rows = _csv_rows(f) if is_csv else _jsonl_rows(f, path)
+        for line_no, row in rows:
+            if not isinstance(row, (str, dict)):
+                print(f"⚠️ Bỏ qua dòng {line_no} của '{path}': cần chuỗi hoặc object JSON")
+                continue
+            if isinstance(row, str):
+                qid, question = None, row
+            else:
+                field = next((k for k in _QUESTION_FIELDS if k in row), None)
+                if field is None and is_csv and row:
+                    field = next(iter(row))  # CSV không có cột question/query: lấy cột đầu tiên
+                qid, question = row.get("id"), row.get(field) if field else None
+            question = (question or "").strip()
+            if question:
+                yield (str(qid) if qid not in (None, "") else str(line_no)), question
+
+
+def load_checkpoint(path: str) -> Set[str]:
+    """Các id đã có câu trả lời trong file đầu ra; dòng ghi dở (bị ngắt giữa chừng) bị bỏ qua."""
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(rec, dict) and "id" in rec:
+                done.add(str(rec["id"]))
+    return done
+
+
+def _truncate_partial_line(path: str) -> None:
+    # Bỏ dòng cuối ghi dở để bản ghi tiếp theo bắt đầu trên dòng mới
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+def _chunks(items: Iterator[Tuple[str, str]], size: int) -> Iterator[List[Tuple[str, str]]]:
+    batch: List[Tuple[str, str]] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prepare_prompts(
+    batch: List[Tuple[str, str]],
+    index: Dict[str, Any],
+    disease_name: Dict[int, str],
+    symptom_dict: Dict[int, Dict[str, str]],
+) -> List[Dict[str, Any]]:
+    """Retrieve + so khớp triệu chứng cho cả lô, trả về bản ghi kèm prompt cho từng câu."""
+    queries = [q for _, q in batch]
+    q_mat = None
+    if RETRIEVAL_MODE != "lexical":
+        try:
+            q_mat = embed_queries(queries)
+        except Exception as e:
+            print(f"⚠️ Lỗi embedding lô câu hỏi ({e!r}), lô này chỉ dùng tìm kiếm từ khóa.")
+    retrieved = retrieve_batch(queries, index, k=RETRIEVE_K, q_mat=q_mat)
+    matches = find_symptom_matches_batch(
+        queries, disease_name, symptom_dict, min_score=SYMPTOM_MIN_SCORE, max_results=SYMPTOM_MAX_RESULTS
+    )
+    out = []
+    for (qid, query), docs, m in zip(batch, retrieved, matches):
+        prompt = build_user_prompt(
+            query, index, disease_name, symptom_dict, matches=m, retrieved=docs
+        )
+        out.append({
+            "id": qid,
+            "question": query,
+            "prompt": prompt,
+            "retrieved": [d.get("key", d.get("id")) for d in docs],
+            "symptom_matches": [x["disease_id"] for x in m],
+        })
+    return out
+
+
+def _generate(engine: ChatEngine, item: Dict[str, Any]) -> Dict[str, Any]:
+    start = time.perf_counter()
+    answer = engine.generate(item["prompt"])
+    return {
+        "id": item["id"],
+        "question": item["question"],
+        "answer": answer,
+        "retrieved": item["retrieved"],
+        "symptom_matches": item["symptom_matches"],
+        "generate_seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def run_batch(
+    input_path: str,
+    output_path: str,
+    index: Dict[str, Any],
+    disease_name: Dict[int, str],
+    symptom_dict: Dict[int, Dict[str, str]],
+    engine: ChatEngine | None = None,
+    chunk_size: int = BATCH_QA_CHUNK,
+    concurrency: int = BATCH_QA_CONCURRENCY,
+    restart: bool = False,
+) -> Dict[str, int]:
+    """Trả lời mọi câu hỏi chưa có trong output_path, ghi dần ra output_path (JSONL)."""
+    engine = engine or ChatEngine()
+    if restart and os.path.exists(output_path):
+        os.remove(output_path)
+    done = load_checkpoint(output_path)
+    _truncate_partial_line(output_path)
+    if done:
+        print(f"↩️ Tiếp tục từ checkpoint: bỏ qua {len(done)} câu đã trả lời.")
+
+    stats = {"answered": 0, "skipped": 0, "failed": 0}
+
+    def pending() -> Iterator[Tuple[str, str]]:
+        for qid, question in read_questions(input_path):
+            if qid in done:
+                stats["skipped"] += 1
+            else:
+                yield qid, question
+
+    concurrency = max(1, concurrency)
+    # Giữ tối đa 2 x concurrency việc chờ để không dồn cả file vào hàng đợi
+    max_in_flight = 2 * concurrency
+    in_flight: Dict[Future, str] = {}
+    start = time.perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as out:
+
+        def write_finished(finished: Set[Future]) -> None:
+            for fut in finished:
+                qid = in_flight.pop(fut)
+                try:
+                    rec = fut.result()
+                except Exception as e:
+                    stats["failed"] += 1
+                    print(f"⚠️ Lỗi khi trả lời câu {qid}: {e!r} (sẽ thử lại ở lần chạy sau)")
+                    continue
+                out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                out.flush()
+                stats["answered"] += 1
+
+        pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-qa")
+        try:
+            for batch in _chunks(pending(), max(1, chunk_size)):
+                with metrics.stage("batch_prepare"):
+                    items = prepare_prompts(batch, index, disease_name, symptom_dict)
+                for item in items:
+                    while len(in_flight) >= max_in_flight:
+                        finished, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                        write_finished(finished)
+                    in_flight[pool.submit(_generate, engine, item)] = item["id"]
+                print(f"… đã trả lời {stats['answered']} câu, đang chạy {len(in_flight)}")
+            while in_flight:
+                finished, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                write_finished(finished)
+        finally:
+            # Ctrl+C: không chờ các lời gọi còn lại, chúng sẽ được làm lại ở lần chạy sau
+            pool.shutdown(wait=not in_flight, cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    rate = stats["answered"] / elapsed if elapsed > 0 else 0.0
+    print(
+        f"✅ Xong: {stats['answered']} câu trả lời mới, bỏ qua {stats['skipped']}, lỗi {stats['failed']} "
+        f"({elapsed:.1f}s, {rate:.2f} câu/s) -> {output_path}"
+    )
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Trả lời hàng loạt câu hỏi từ file JSONL/CSV.")
+    parser.add_argument("input", help="File câu hỏi (.jsonl hoặc .csv)")
+    parser.add_argument("output", help="File kết quả JSONL (cũng là checkpoint để chạy tiếp)")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_QA_CHUNK)
+    parser.add_argument("--concurrency", type=int, default=BATCH_QA_CONCURRENCY)
+    parser.add_argument("--restart", action="store_true", help="Bỏ kết quả cũ, làm lại từ đầu")
+    args = parser.parse_args()
+
+    try:
+        init_genai()
+    except Exception as e:
+        print("❌ Lỗi cấu hình GenAI:", e)
+        sys.exit(1)
+
+    try:
+        index, disease_name, symptom_dict = load_or_build_kb(EXCEL_PATH)
+    except Exception as e:
+        print("❌ Lỗi build KB:", e)
+        sys.exit(1)
+
+    try:
+        run_batch(
+            args.input,
+            args.output,
+            index,
+            disease_name,
+            symptom_dict,
+            chunk_size=args.chunk_size,
+            concurrency=args.concurrency,
+            restart=args.restart,
+        )
+    except KeyboardInterrupt:
+        print("\nDừng. Chạy lại cùng lệnh để tiếp tục từ checkpoint.")
+
+
+if __name__ == "__main__":
+    main()
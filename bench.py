@@ -0,0 +1,377 @@
+"""Benchmark end-to-end: build KB, build index, retrieve, so khớp triệu chứng.
+
+    python bench.py                          # scale 1, 10, 100
+    python bench.py --scales 1 10 --out bench_result.json
+    python bench.py --backends exact ivf int8 fp16 --modes vector hybrid --min-score 0.5
+
+Workbook tổng hợp được sinh từ datasjet.xlsx: cùng tên sheet và bố cục cột mà kb_builder đọc,
+mỗi dòng được nhân thành `scale` bản với id dịch đi (mọi cột id cùng dịch một khoảng nên liên kết
+bệnh/thuốc/thảo dược vẫn đúng) và text gắn hậu tố bản sao (để dedupe/gộp tài liệu không gộp mất).
+Embedding dùng embedder "hashing" của providers.py (không gọi mạng, không dùng cache trên đĩa).
+
+Retrieve được đo qua retrieve() từng câu và retrieve_batch() theo lô (--batch-size), cho mỗi
+backend (--backends) x mỗi mode (--modes, "lexical" không phụ thuộc backend nên đo một lần), kèm
+recall@k của backend so với tìm kiếm chính xác. Backend int8/fp16 re-rank từ embeddings memory-map.
+
+Mỗi scale chạy trong một process riêng (spawn) để peak RSS là của riêng scale đó.
+Kết quả JSON: với mỗi giai đoạn p50/p95/p99 (giây), throughput và peak RSS (MB).
+"""
+from __future__ import annotations
+from typing import Dict, Any, List, Callable, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import EXCEL_PATH, INDEX_BACKEND, CHUNK_SECTIONS, BATCH_QA_CHUNK
+from chat_rag import RETRIEVE_K, SYMPTOM_MIN_SCORE
+from kb_builder import KB_SHEETS
+from vector_backends import BACKENDS
+
+BENCH_DIR = ".bench"
+# Khoảng dịch id giữa hai bản sao, lớn hơn mọi id trong workbook gốc
+ID_STRIDE = 100_000
+MODES = ("vector", "hybrid", "lexical")
+
+# Cột chứa id (bệnh/nhóm/thuốc/thảo dược, số nguyên hoặc mã "1.2") của từng sheet
+_ID_COLUMNS: Dict[str, tuple] = {
+    "dim_benh": (0,),
+    "trieu_chung": (0,),
+    "nhombenh": (0,),
+    "map_nhombenh_benh": (0, 1),
+    "dim_thuoctay": (0,),
+    "thuoctay_cochetacdong": (0, 1),
+    "thuoctay_duocluchoc": (0, 1),
+    "thuoctay_thoigiantacdung": (0, 1),
+    "thuoctay_duocdonghoc": (0,),
+    "thuoctay_dacdiemhoahoc": (0,),
+    "thuoctay_dacdiemnguongoc": (0,),
+    "thuoctay_doctinh": (0,),
+    "thuoctay_tinhchatlyhoa": (0,),
+    "dim_thaoduoc": (0,),
+    "thaoduoc_cochetacdong": (0, 1),
+    "thaoduoc_duocluchoc": (0, 1),
+    "thaoduoc_thoigiantacdung": (0, 1),
+    "thaoduoc_duocdonghoc": (0,),
+    "thaoduoc_dacdiemhoahoc": (0,),
+    "thaoduoc_dacdiemnguongoc": (0,),
+    "thaoduoc_doctinh": (0,),
+    "thaoduoc_tinhchatlyhoa": (0,),
+    "map_benh_thuoctay": (0, 1),
+    "map_benh_thaoduoc_survey": (0, 1),
+}
+
+
+def _shift_id(value: Any, offset: int) -> Any:
+    if isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+        return int(value) + offset
+    if isinstance(value, float) and value.is_integer():
+        return int(value) + offset
+    if isinstance(value, str):
+        head, sep, tail = value.strip().partition(".")
+        if head.isdigit():
+            return f"{int(head) + offset}{sep}{tail}"
+    return value
+
+
+def _tag_text(value: Any, copy: int) -> Any:
+    if not isinstance(value, str) or not value.strip():
+        return value
+    if value.startswith("http"):
+        return f"{value}#v{copy}"
+    return f"{value} ({copy})"
+
+
+def scale_sheet(df: pd.DataFrame, sheet: str, scale: int) -> pd.DataFrame:
+    """Nhân sheet thành `scale` bản; bản 0 giữ nguyên, bản c dịch id c * ID_STRIDE."""
+    id_cols = set(_ID_COLUMNS.get(sheet, (0,)))
+    parts = [df]
+    for copy in range(1, scale):
+        part = df.copy()
+        for col in part.columns:
+            if col in id_cols:
+                part[col] = part[col].map(lambda v: _shift_id(v, copy * ID_STRIDE))
+            elif not pd.api.types.is_numeric_dtype(part[col]):
+                part[col] = part[col].map(lambda v: _tag_text(v, copy))
+        parts.append(part)
+    return pd.concat(parts, ignore_index=True)
+
+
+def make_workbook(scale: int, template: str = EXCEL_PATH, out_dir: str = BENCH_DIR) -> str:
+    """Sinh (hoặc dùng lại) workbook tổng hợp cho scale; trả về đường dẫn file."""
+    path = os.path.join(out_dir, f"bench_x{scale}.xlsx")
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(template):
+        return path
+    os.makedirs(out_dir, exist_ok=True)
+    book = pd.ExcelFile(template)
+    tmp = path + ".tmp.xlsx"
+    with pd.ExcelWriter(tmp, engine="openpyxl") as writer:
+        for sheet in book.sheet_names:
+            df = book.parse(sheet, header=None)
+            if sheet in KB_SHEETS:
+                df = scale_sheet(df, sheet, scale)
+            df.to_excel(writer, sheet_name=sheet, header=False, index=False)
+    os.replace(tmp, path)
+    return path
+
+
+def _summary(samples: List[float], units: float = 1) -> Dict[str, Any]:
+    """p50/p95/p99 (giây) + throughput (units / giây) trên các lần đo."""
+    arr = np.asarray(samples, dtype=np.float64)
+    total = float(arr.sum())
+    return {
+        "runs": len(samples),
+        "p50": float(np.percentile(arr, 50)),
+        "p95": float(np.percentile(arr, 95)),
+        "p99": float(np.percentile(arr, 99)),
+        "mean": float(arr.mean()),
+        "throughput_per_s": units * len(samples) / total if total > 0 else None,
+    }
+
+
+def _time(fn: Callable[[], Any], repeat: int) -> tuple:
+    samples: List[float] = []
+    out = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        samples.append(time.perf_counter() - start)
+    return samples, out
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux: KB, macOS: byte
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _queries(disease_name: Dict[int, str], symptom_dict: Dict[int, Dict[str, str]], n: int, seed: int) -> tuple:  # noqa: E501
+    """Câu hỏi retrieve (tên bệnh + mẫu câu) và câu mô tả triệu chứng (một phần triệu chứng của bệnh)."""  # noqa: E501
+    rng = random.Random(seed)
+    names = list(disease_name.values())
+    templates = [
+        "{} nên dùng thuốc gì?",
+        "Thảo dược nào hỗ trợ {}?",
+        "Cơ chế tác dụng của thuốc điều trị {}",
+        "{} có triệu chứng gì?",
+    ]
+    ask = [rng.choice(templates).format(rng.choice(names)) for _ in range(n)]
+    symptom_texts = [v["symptoms"] for v in symptom_dict.values() if v.get("symptoms")]
+    symptom_queries = []
+    for _ in range(n):
+        parts = [p.strip() for p in rng.choice(symptom_texts).split(",") if p.strip()]
+        picked = rng.sample(parts, max(1, len(parts) * 2 // 3)) if parts else []
+        symptom_queries.append("Tôi bị " + ", ".join(picked))
+    return ask, symptom_queries
+
+
+def run_scale(
+    scale: int,
+    n_queries: int = 200,
+    repeat: int = 3,
+    seed: int = 0,
+    backends: Sequence[str] = (INDEX_BACKEND,),
+    modes: Sequence[str] = MODES,
+    min_score: float = SYMPTOM_MIN_SCORE,
+    batch_size: int = BATCH_QA_CHUNK,
+) -> Dict[str, Any]:
+    """Đo một scale (chạy trong process con); log của pipeline chuyển sang stderr để stdout chỉ có JSON."""  # noqa: E501
+    with redirect_stdout(sys.stderr):
+        return _run_scale(scale, n_queries, repeat, seed, backends, modes, min_score, batch_size)
+
+
+def _time_each(fn: Callable[[Any], Any], items: Sequence[Any]) -> List[float]:
+    samples: List[float] = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _bench_retrieval(
+    index: Dict[str, Any],
+    ask: List[str],
+    q_mat: np.ndarray,
+    modes: Sequence[str],
+    batch_size: int,
+) -> Dict[str, Any]:
+    """Thời gian retrieve() từng câu và retrieve_batch() theo lô cho mỗi mode, trên backend của index."""  # noqa: E501
+    from rag_index import retrieve, retrieve_batch
+
+    out: Dict[str, Any] = {}
+    batches = [range(i, min(i + batch_size, len(ask))) for i in range(0, len(ask), batch_size)]
+    for mode in modes:
+        retrieve(ask[0], index, k=RETRIEVE_K, q_vec=q_mat[0], mode=mode)  # khởi động
+        samples = _time_each(
+            lambda i: retrieve(ask[i], index, k=RETRIEVE_K, q_vec=q_mat[i], mode=mode), range(len(ask))
+        )
+        out[mode] = _summary(samples)
+        samples = _time_each(
+            lambda r: retrieve_batch(
+                [ask[i] for i in r], index, k=RETRIEVE_K, q_mat=q_mat[r.start:r.stop], mode=mode
+            ),
+            batches,
+        )
+        # throughput theo số câu hỏi, không theo số lô
+        out[f"{mode}_batch"] = _summary(samples, len(ask) / len(batches))
+        out[f"{mode}_batch"]["batch_size"] = batch_size
+    return out
+
+
+def _recall_at_k(exact_idx: np.ndarray, idx: np.ndarray) -> float:
+    hits = sum(len(set(a.tolist()) & set(b.tolist())) for a, b in zip(exact_idx, idx))
+    return hits / max(1, exact_idx.size)
+
+
+def _run_scale(
+    scale: int,
+    n_queries: int,
+    repeat: int,
+    seed: int,
+    backends: Sequence[str],
+    modes: Sequence[str],
+    min_score: float,
+    batch_size: int,
+) -> Dict[str, Any]:
+    from chunking import chunk_docs
+    from doc_store import DocStore
+    from kb_builder import build_kb_from_excel
+    from providers import hashing_embed, hashing_embed_content
+    from rag_index import build_index
+    from symptoms import find_symptom_matches, get_symptom_index
+    from vector_backends import make_backend, normalize_rows, top_k_indices
+
+    path = make_workbook(scale)
+    result: Dict[str, Any] = {"scale": scale, "workbook": path}
+    rss_start = _peak_rss_mb()
+
+    samples, (docs, disease_name, symptom_dict) = _time(lambda: build_kb_from_excel(path), repeat)
+    result["build_kb_from_excel"] = _summary(samples, len(docs))
+    result["n_docs"] = len(docs)
+    result["n_diseases"] = len(disease_name)
+
+    if CHUNK_SECTIONS:
+        samples, docs = _time(lambda: chunk_docs(docs), 1)
+        result["chunk_docs"] = _summary(samples, len(docs))
+    result["n_indexed"] = len(docs)
+
+    samples, index = _time(
+        lambda: build_index(docs, cache_dir=None, embed_content=hashing_embed_content), 1
+    )
+    result["build_index"] = _summary(samples, len(docs))
+    result["build_index"]["embeddings_mb"] = index["embeddings"].nbytes / (1024 * 1024)
+    result["build_index"]["doc_store_mb"] = DocStore.from_docs(index["docs"]).nbytes() / (1024 * 1024)
+
+    ask, symptom_queries = _queries(disease_name, symptom_dict, n_queries, seed)
+    # embed câu hỏi không tính vào thời gian retrieve
+    q_mat = np.vstack([hashing_embed(q) for q in ask])
+
+    # Như snapshot: backend nén re-rank từ embeddings float32 memory-map trên đĩa
+    emb_path = os.path.join(BENCH_DIR, f"embeddings_x{scale}.npy")
+    np.save(emb_path, np.asarray(index["embeddings"], dtype=np.float32))
+    mmap_mat = np.load(emb_path, mmap_mode="r")
+    q_norm = normalize_rows(q_mat)
+    exact_idx = top_k_indices(q_norm @ np.asarray(index["embeddings"]).T, RETRIEVE_K)
+
+    vector_modes = [m for m in modes if m != "lexical"]
+    result["backends"] = {}
+    for kind in backends:
+        backend = make_backend(kind)
+        mat = mmap_mat if getattr(backend, "mmap_embeddings", False) else index["embeddings"]
+        try:
+            samples, _ = _time(lambda: backend.build(mat), 1)
+        except RuntimeError as e:  # hnsw thiếu hnswlib (HNSWBackend._hnswlib)
+            result["backends"][kind] = {"error": repr(e)}
+            continue
+        entry: Dict[str, Any] = {"build": _summary(samples, len(docs))}
+        entry["recall_at_k_vs_exact"] = _recall_at_k(
+            exact_idx, backend.search(q_norm, RETRIEVE_K)[1]
+        )
+        entry.update(_bench_retrieval(dict(index, backend=backend), ask, q_mat, vector_modes, batch_size))
+        result["backends"][kind] = entry
+    if "lexical" in modes:
+        # BM25 không phụ thuộc backend vector
+        result["lexical"] = _bench_retrieval(index, ask, q_mat, ["lexical"], batch_size)
+
+    start = time.perf_counter()
+    get_symptom_index(symptom_dict)
+    result["symptom_index_build_s"] = time.perf_counter() - start
+    samples = []
+    n_matched = 0
+    for q in symptom_queries:
+        start = time.perf_counter()
+        matches = find_symptom_matches(q, disease_name, symptom_dict, min_score=min_score)
+        samples.append(time.perf_counter() - start)
+        n_matched += bool(matches)
+    result["find_symptom_matches"] = _summary(samples)
+    result["find_symptom_matches"]["min_score"] = min_score
+    result["find_symptom_matches"]["hit_rate"] = n_matched / max(1, len(symptom_queries))
+
+    result["peak_rss_mb"] = _peak_rss_mb()
+    result["peak_rss_before_mb"] = rss_start
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark KB build / index / retrieve / symptom matching.")  # noqa: E501
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--queries", type=int, default=200, help="Số câu hỏi cho retrieve/symptom")
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần đo build_kb_from_excel")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--backends", nargs="+", choices=sorted(BACKENDS), default=[INDEX_BACKEND],
+        help="Backend vector cần đo (vd: exact ivf hnsw int8 fp16)",
+    )
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES), help="Chế độ retrieve cần đo")
+    parser.add_argument(
+        "--min-score", type=float, default=SYMPTOM_MIN_SCORE, help="Ngưỡng find_symptom_matches"
+    )
+    parser.add_argument("--batch-size", type=int, default=BATCH_QA_CHUNK, help="Số câu mỗi lô retrieve_batch")
+    parser.add_argument("--out", default=None, help="Ghi kết quả JSON ra file (mặc định chỉ in)")
+    args = parser.parse_args()
+
+    report: Dict[str, Any] = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "backends": args.backends,
+        "modes": args.modes,
+        "min_score": args.min_score,
+        "batch_size": args.batch_size,
+        "chunk_sections": CHUNK_SECTIONS,
+        "results": [],
+    }
+    ctx = multiprocessing.get_context("spawn")
+    for scale in args.scales:
+        print(f"⏱️ Benchmark scale x{scale}...", file=sys.stderr)
+        # Mỗi scale một process mới -> peak RSS không bị scale trước đẩy lên
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            result = pool.submit(
+                run_scale, scale, args.queries, args.repeat, args.seed,
+                args.backends, args.modes, args.min_score, max(1, args.batch_size),
+            ).result()
+        report["results"].append(result)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"✅ Đã ghi kết quả vào {args.out}", file=sys.stderr)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
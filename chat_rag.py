@@ -1,37 +1,77 @@
 from __future__ import annotations
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Iterator, Tuple
+import time
 
-import google.generativeai as genai
+import numpy as np
 
-from config import CHAT_MODEL_NAME
-from rag_index import retrieve_top_k, build_context_snippet
+from config import (
+    CHAT_MODEL_NAME,
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_MAX_SIZE,
+    ANSWER_CACHE_TTL,
+)
+import metrics
+from answer_cache import AnswerCache
+from providers import make_chat_model
+from rag_index import embed_query_with_timeout, retrieve
+from context_builder import build_context, estimate_tokens
 from symptoms import find_symptom_matches, build_symptom_match_block
 from prompts import SYSTEM_PROMPT
 
+# Tham số retrieve / gợi ý triệu chứng cho prompt (dùng chung với batch_qa)
+RETRIEVE_K = 4
+SYMPTOM_MIN_SCORE = 0.9
+SYMPTOM_MAX_RESULTS = 5
 
-def answer_with_rag(
+
+def build_user_prompt(
     query: str,
     index: Dict[str, Any],
     disease_name: Dict[int, str],
     symptom_dict: Dict[int, Dict[str, str]],
+    q_vec: np.ndarray | None = None,
+    matches: List[Dict[str, Any]] | None = None,
+    retrieved: List[Dict[str, Any]] | None = None,
+    embed_attempted: bool = False,
 ) -> str:
+    """Gợi ý triệu chứng + retrieve tài liệu, ghép thành prompt cho LLM.
+
+    matches / retrieved: kết quả đã tính sẵn (vd theo batch trong batch_qa) thì không tính lại.
+    embed_attempted: đã thử embed câu hỏi (q_vec None = lỗi/quá timeout), retrieve không thử lại.
+    """
     # 1) Gợi ý bệnh theo triệu chứng
-    matches = find_symptom_matches(
-        user_text=query,
-        disease_name=disease_name,
-        symptom_dict=symptom_dict,
-        min_score=0.9,
-        max_results=5,
-    )
-    symptom_block = build_symptom_match_block(matches)
+    with metrics.stage("symptom_match"):
+        if matches is None:
+            matches = find_symptom_matches(
+                user_text=query,
+                disease_name=disease_name,
+                symptom_dict=symptom_dict,
+                min_score=SYMPTOM_MIN_SCORE,
+                max_results=SYMPTOM_MAX_RESULTS,
+            )
+        symptom_block = build_symptom_match_block(matches)
 
     # 2) RAG: retrieve tài liệu
-    retrieved = retrieve_top_k(query, index, k=4)
-    context_docs = build_context_snippet(retrieved)
+    if retrieved is None:
+        with metrics.stage("retrieve"):
+            retrieved = retrieve(
+                query, index, k=RETRIEVE_K, q_vec=q_vec, embed_attempted=embed_attempted
+            )
+    with metrics.stage("context"):
+        context_docs = build_context(query, retrieved, index)
 
     full_context = symptom_block + context_docs
+    if metrics.enabled():
+        metrics.observe("prompt_chars", len(full_context))
+        metrics.observe("prompt_tokens", estimate_tokens(full_context))
+        metrics.annotate(
+            symptom_matches=len(matches),
+            retrieved=[d.get("key", d.get("id")) for d in retrieved],
+            prompt_tokens=estimate_tokens(full_context),
+        )
 
-    user_prompt = f"""CÂU HỎI CỦA NGƯỜI DÙNG:
+    return f"""CÂU HỎI CỦA NGƯỜI DÙNG:
 {query}
 
 NGỮ CẢNH (CONTEXT – TRÍCH TỪ CƠ SỞ DỮ LIỆU EXCEL VÀ GỢI Ý TRIỆU CHỨNG NẾU CÓ):
@@ -47,9 +87,9 @@ YÊU CẦU:
 - Trả lời bằng tiếng Việt, giọng điệu thân thiện, dễ hiểu.
 """  # noqa: E501
 
-    model = genai.GenerativeModel(CHAT_MODEL_NAME)
-    resp = model.generate_content([SYSTEM_PROMPT, user_prompt])
 
+def _response_text(resp: Any) -> str:
+    """Lấy text từ response (hoặc một chunk khi stream) của generate_content."""
     chunks: List[str] = []
     if resp.candidates:
         for c in resp.candidates:
@@ -58,4 +98,148 @@ YÊU CẦU:
             for p in c.content.parts:
                 if hasattr(p, "text"):
                     chunks.append(p.text)
-    return "\n".join(chunks).strip()
+    return "\n".join(chunks)
+
+
+class ChatEngine:
+    """Giữ một model (GenerativeModel hoặc stand-in theo config.CHAT_PROVIDER) dùng lại cho mọi câu hỏi.
+
+    Nếu có answer_cache, câu hỏi trùng/gần trùng được trả lời từ cache, không gọi LLM.
+    """
+
+    def __init__(
+        self,
+        model_name: str = CHAT_MODEL_NAME,
+        answer_cache: AnswerCache | None = None,
+    ) -> None:
+        self.model_name = model_name
+        self.model = make_chat_model(model_name)
+        self.answer_cache = answer_cache
+
+    def _cached(self, query: str, index: Dict[str, Any]) -> Tuple[str | None, np.ndarray | None]:
+        """Tra cache; trả về (câu trả lời nếu hit, embedding câu hỏi để dùng lại khi miss).
+
+        Có answer_cache thì khi miss câu hỏi đã được thử embed: q_vec None nghĩa là lỗi/quá timeout.
+        """
+        if self.answer_cache is None:
+            return None, None
+        kb_hash = index.get("kb_hash")
+        ans = self.answer_cache.get_exact(query, kb_hash)
+        if ans is not None:
+            metrics.incr("answer_cache_hits")
+            return ans, None
+        q_vec = embed_query_with_timeout(query)
+        ans = self.answer_cache.get(query, q_vec, kb_hash, exact=False)
+        metrics.incr("answer_cache_hits" if ans is not None else "answer_cache_misses")
+        return ans, q_vec
+
+    def _store(self, query: str, answer: str, q_vec: np.ndarray | None, index: Dict[str, Any]) -> None:  # noqa: E501
+        if self.answer_cache is not None and answer:
+            self.answer_cache.put(query, answer, q_vec, index.get("kb_hash"))
+
+    def generate(self, user_prompt: str) -> str:
+        """Một lần gọi model (không qua cache), trả về text câu trả lời."""
+        with metrics.stage("generate"):
+            resp = self.model.generate_content([SYSTEM_PROMPT, user_prompt])
+        ans = _response_text(resp).strip()
+        metrics.observe("answer_chars", len(ans))
+        return ans
+
+    def answer(
+        self,
+        query: str,
+        index: Dict[str, Any],
+        disease_name: Dict[int, str],
+        symptom_dict: Dict[int, Dict[str, str]],
+    ) -> str:
+        with metrics.trace("answer", query_chars=len(query)):
+            cached, q_vec = self._cached(query, index)
+            if cached is not None:
+                metrics.annotate(cached=True)
+                return cached
+            user_prompt = build_user_prompt(
+                query, index, disease_name, symptom_dict,
+                q_vec=q_vec, embed_attempted=self.answer_cache is not None,
+            )
+            ans = self.generate(user_prompt)
+            self._store(query, ans, q_vec, index)
+            return ans
+
+    def answer_stream(
+        self,
+        query: str,
+        index: Dict[str, Any],
+        disease_name: Dict[int, str],
+        symptom_dict: Dict[int, Dict[str, str]],
+    ) -> Iterator[str]:
+        """Như answer() nhưng yield từng đoạn text ngay khi model trả về.
+
+        Trace chỉ được gắn vào context quanh các đoạn không yield; nó được đóng trong finally
+        kể cả khi người dùng dừng đọc giữa chừng.
+        """
+        tr = metrics.start_trace("answer_stream", query_chars=len(query))
+        error: BaseException | None = None
+        gen_start: float | None = None
+        try:
+            with metrics.activate(tr):
+                cached, q_vec = self._cached(query, index)
+                if cached is not None:
+                    metrics.annotate(cached=True)
+                else:
+                    user_prompt = build_user_prompt(
+                        query, index, disease_name, symptom_dict,
+                        q_vec=q_vec, embed_attempted=self.answer_cache is not None,
+                    )
+            if cached is not None:
+                yield cached
+                return
+            parts: List[str] = []
+            gen_start = time.perf_counter()
+            resp = self.model.generate_content([SYSTEM_PROMPT, user_prompt], stream=True)
+            for chunk in resp:
+                text = _response_text(chunk)
+                if text:
+                    if not parts:
+                        metrics.observe(
+                            "first_chunk_seconds", time.perf_counter() - gen_start, metrics.TIME_BUCKETS
+                        )
+                    parts.append(text)
+                    yield text
+            metrics.record_stage("generate", time.perf_counter() - gen_start, tr)
+            gen_start = None
+            with metrics.activate(tr):
+                self._store(query, "".join(parts).strip(), q_vec, index)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if gen_start is not None:
+                metrics.record_stage("generate", time.perf_counter() - gen_start, tr)
+            metrics.finish_trace(tr, error)
+
+
+_DEFAULT_ENGINE: ChatEngine | None = None
+
+
+def get_chat_engine() -> ChatEngine:
+    """ChatEngine dùng chung trong process (tạo ở lần gọi đầu, sau init_genai)."""
+    global _DEFAULT_ENGINE
+    if _DEFAULT_ENGINE is None:
+        answer_cache = None
+        if ANSWER_CACHE_ENABLED:
+            answer_cache = AnswerCache(
+                threshold=ANSWER_CACHE_THRESHOLD,
+                max_size=ANSWER_CACHE_MAX_SIZE,
+                ttl_seconds=ANSWER_CACHE_TTL,
+            )
+        _DEFAULT_ENGINE = ChatEngine(answer_cache=answer_cache)
+    return _DEFAULT_ENGINE
+
+
+def answer_with_rag(
+    query: str,
+    index: Dict[str, Any],
+    disease_name: Dict[int, str],
+    symptom_dict: Dict[int, Dict[str, str]],
+) -> str:
+    return get_chat_engine().answer(query, index, disease_name, symptom_dict)
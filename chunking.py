@@ -0,0 +1,98 @@
+from __future__ import annotations
+from typing import Dict, Any, List
+import re
+
+from context_builder import SECTION_HEADER, split_sections
+from doc_store import DocStore
+from kb_builder import stable_doc_id
+
+# Các khóa riêng của document không chép sang chunk (chunk có id/key/title/text của riêng nó)
+_OWN_KEYS = ("id", "key", "title", "text")
+_HEADER_RE = re.compile(r"^" + re.escape(SECTION_HEADER), re.MULTILINE)
+
+
+def _section_title(chunk: str) -> str:
+    header = chunk.split("\n", 1)[0][len(SECTION_HEADER):].strip()
+    return header.rstrip(":").strip()
+
+
+def chunk_docs(docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Tách document nhiều mục ("— ...", vd thuốc tây/thảo dược) thành một chunk mỗi mục.
+
+    Chạy giữa build_kb_from_excel và build_index. Mỗi chunk là một document riêng với:
+    - key = "<key cha>/s<số thứ tự header>", id ổn định theo key
+    - title = "<title cha> — <tên mục>" (phần đầu giữ nguyên title cha)
+    - parent / parent_title / section: trỏ về document gốc để gộp lại khi cần
+    - type và các id thực thể (disease_id/drug_id/herb_id) chép từ document cha
+    Document chỉ có một mục được giữ nguyên. Chunk trùng text với chunk của document khác vẫn
+    được giữ: mỗi document cha phải còn đủ mục để gộp lại và để lọc theo id thực thể.
+    """
+    out: List[Dict[str, Any]] = []
+    for d in docs:
+        text = d["text"]
+        spans = split_sections(text)
+        if len(spans) <= 1:
+            out.append(d)
+            continue
+        parent_key = d.get("key", str(d.get("id")))
+        inherited = {k: v for k, v in d.items() if k not in _OWN_KEYS}
+        for start, end in spans:
+            chunk = text[start:end].strip()
+            # Đánh số theo vị trí header trong text gốc (kể cả mục rỗng) để key ổn định
+            section = len(_HEADER_RE.findall(text, 0, start + len(SECTION_HEADER))) if start > 0 else 0
+            title = d["title"] if section == 0 else f"{d['title']} — {_section_title(chunk)}"
+            key = f"{parent_key}/s{section}"
+            chunk_doc = {"id": stable_doc_id(key), "key": key, "title": title, "text": chunk}
+            chunk_doc.update(inherited)
+            chunk_doc.update({"parent": parent_key, "parent_title": d["title"], "section": section})
+            out.append(chunk_doc)
+    return out
+
+
+def get_parent_index(index: Dict[str, Any]) -> Dict[str, List[int]]:
+    """key cha -> các dòng chunk theo thứ tự mục, tính một lần rồi giữ trong index["parents"]."""
+    parents = index.get("parents")
+    if parents is None:
+        parents = {}
+        for row, d in enumerate(index["docs"]):
+            parent = d.get("parent")
+            if parent:
+                parents.setdefault(parent, []).append(row)
+        store = DocStore.from_docs(index["docs"])
+        for rows in parents.values():
+            rows.sort(key=lambda r: store[r]["section"])
+        index["parents"] = parents
+    return parents
+
+
+def collapse_to_parents(
+    results: List[Dict[str, Any]],
+    index: Dict[str, Any],
+    k: int | None = None,
+) -> List[Dict[str, Any]]:
+    """Gộp các chunk cùng document cha thành một kết quả (điểm = điểm chunk cao nhất).
+
+    Document cha được dựng lại từ mọi chunk của nó theo thứ tự mục; kết quả không phải chunk giữ nguyên.
+    """
+    parents = get_parent_index(index)
+    store = DocStore.from_docs(index["docs"])
+    out: List[Dict[str, Any]] = []
+    seen = set()
+    for r in results:
+        parent = r.get("parent")
+        if not parent:
+            out.append(r)
+        elif parent not in seen:
+            seen.add(parent)
+            merged = {k2: v for k2, v in r.items() if k2 not in ("parent", "parent_title", "section")}
+            merged.update({
+                "id": stable_doc_id(parent),
+                "key": parent,
+                "title": r["parent_title"],
+                "text": "\n\n".join(store[row]["text"] for row in parents.get(parent, [])),
+                "score": r.get("score"),
+            })
+            out.append(merged)
+        if k is not None and len(out) >= k:
+            break
+    return out
@@ -6,12 +6,95 @@ API_KEY = os.getenv("GEMINI_API_KEY", "")  # hoặc điền thẳng API key vào
 CHAT_MODEL_NAME = "models/gemma-3-12b-it"
 EMBED_MODEL_NAME = "models/text-embedding-004"
 
+# Nơi tạo embedding / sinh câu trả lời (xem providers.py):
+# EMBED_PROVIDER: "gemini" hoặc "hashing" (local, tất định, không cần mạng)
+# CHAT_PROVIDER: "gemini" hoặc "echo" (local, trả lại prompt sau độ trễ giả lập)
+# Đặt cả hai là local để benchmark/load test không cần API key
+EMBED_PROVIDER = os.getenv("EMBED_PROVIDER", "gemini")
+CHAT_PROVIDER = os.getenv("CHAT_PROVIDER", "gemini")
+HASH_EMBED_DIM = 768  # số chiều vector của embedder "hashing"
+ECHO_DELAY = 0.5  # giây tới chunk đầu tiên của generator "echo"
+ECHO_JITTER = 0.2  # ± giây, phân phối đều
+ECHO_CHUNK_DELAY = 0.02  # giây giữa các chunk khi stream
+ECHO_STREAM_CHUNKS = 8
+ECHO_MAX_CHARS = 400  # số ký tự cuối của prompt được trả lại
+
 # File Excel
 EXCEL_PATH = "datasjet.xlsx"
 
+# Snapshot KB đã build (docs + embeddings), dùng lại khi Excel không đổi (None để tắt)
+KB_SNAPSHOT_DIR = ".kb_snapshot"
+
+# Backend tìm kiếm vector: "exact" (NumPy, chính xác), "ivf" (ANN k-means, NumPy thuần),
+# "hnsw" (ANN đồ thị, cần pip install hnswlib), "int8" / "fp16" (chấm điểm trên embeddings nén
+# 4x / 2x, embeddings float32 trong snapshot được memory-map thay vì nạp vào RAM)
+INDEX_BACKEND = "exact"
+IVF_NLIST = None  # số cụm; None = tự chọn ~4*sqrt(N)
+IVF_NPROBE = 8  # số cụm quét mỗi truy vấn (tăng -> recall cao hơn, chậm hơn)
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64  # tăng -> recall cao hơn, chậm hơn
+QUANT_RERANK = 200  # int8/fp16: số ứng viên chấm lại chính xác bằng float32 (0 = không re-rank)
+
+# Thư mục cache embedding document (None để tắt)
+EMBED_CACHE_DIR = ".embed_cache"
+
+# Embedding theo batch: số văn bản mỗi request, số request chạy song song, số lần retry khi bị 429
+EMBED_BATCH_SIZE = 100
+EMBED_MAX_WORKERS = 4
+EMBED_MAX_RETRIES = 5
+
+# Cache câu trả lời: khớp chính xác câu hỏi hoặc cosine embedding câu hỏi >= ngưỡng
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE_MAX_SIZE = 1000
+ANSWER_CACHE_TTL = 24 * 3600  # giây; None = không hết hạn
+
+# Cách retrieve: "hybrid" (BM25 + vector, gộp bằng RRF), "vector" hoặc "lexical" (chỉ BM25, không gọi API)
+RETRIEVAL_MODE = "hybrid"
+HYBRID_CANDIDATES = 50  # số ứng viên lấy từ mỗi nguồn trước khi gộp
+RRF_K = 60
+QUERY_EMBED_TIMEOUT = 3.0  # giây; quá thời gian thì chỉ dùng BM25
+QUERY_EMBED_MAX_PENDING = 8  # số lời gọi embed câu hỏi chờ/chạy tối đa; vượt thì chỉ dùng BM25
+# Tách document thuốc tây/thảo dược thành chunk theo từng mục ("— ...") trước khi embed
+CHUNK_SECTIONS = True
+# Ngân sách token cho phần context tài liệu trong prompt (ước lượng theo số ký tự)
+CONTEXT_TOKEN_BUDGET = 1500
+CHARS_PER_TOKEN = 3.0
+# Số document tối đa mỗi type trong top-k đưa vào prompt (type không có trong dict = không giới hạn)
+RETRIEVAL_TYPE_QUOTAS = {"literature": 1}
+
+# Cache embedding câu hỏi (LRU trong process, 0 để tắt)
+QUERY_CACHE_SIZE = 2048
+# Đường dẫn file SQLite để nhiều process dùng chung cache câu hỏi (None = chỉ trong process)
+QUERY_CACHE_DB = None
+
+# Đo thời gian từng giai đoạn + counter/histogram (metrics.py); tắt thì gần như không tốn gì
+METRICS_ENABLED = False
+# File JSONL ghi trace từng request khi bật metrics (None = chỉ giữ trong bộ nhớ)
+METRICS_TRACE_FILE = None
+
+# HTTP server (serve.py)
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8000
+SERVER_WORKERS = 8  # số request xử lý song song (thread)
+SERVER_MAX_PENDING = 64  # vượt quá -> trả 503
+SERVER_REQUEST_TIMEOUT = 60.0  # giây; vượt quá -> trả 504
+SERVER_MAX_BODY = 64 * 1024  # byte
+# Số process phục vụ (>1: các process gắn read-only vào index memory-map trong SHARED_INDEX_DIR)
+SERVER_PROCESSES = 1
+SHARED_INDEX_DIR = ".kb_shared"
+
+# Chạy câu hỏi theo lô (batch_qa.py): số câu mỗi lô (embed/chấm điểm/so khớp triệu chứng cùng lúc)
+# và số lời gọi sinh câu trả lời chạy song song
+BATCH_QA_CHUNK = 64
+BATCH_QA_CONCURRENCY = 4
+
 
 def init_genai() -> None:
-    """Khởi tạo cấu hình cho thư viện google-generativeai."""
+    """Khởi tạo cấu hình cho thư viện google-generativeai (bỏ qua nếu không provider nào dùng Gemini)."""  # noqa: E501
+    if EMBED_PROVIDER != "gemini" and CHAT_PROVIDER != "gemini":
+        return
     if not API_KEY:
         raise RuntimeError(
             "Chưa cấu hình API_KEY. Hãy set biến môi trường GEMINI_API_KEY "
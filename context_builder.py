@@ -0,0 +1,144 @@
+from __future__ import annotations
+from typing import Dict, Any, List, Tuple
+import hashlib
+import math
+import re
+
+from config import CONTEXT_TOKEN_BUDGET, CHARS_PER_TOKEN
+from lexical_index import tokenize, fold_diacritics
+
+# Header mục trong text document: dòng bắt đầu bằng "— " (xem kb_builder phần thuốc tây/thảo dược)
+SECTION_HEADER = "— "
+_HEADER_RE = re.compile(r"^" + SECTION_HEADER, re.MULTILINE)
+
+
+def split_sections(text: str) -> List[Tuple[int, int]]:
+    """Chia text thành các mục theo header "— ...", trả về (start, end) theo ký tự.
+
+    Phần đầu trước header đầu tiên (tên, hoạt chất, cảnh báo…) là mục 0.
+    Mục chỉ có header mà không có nội dung bị bỏ.
+    """
+    starts = [0] + [m.start() for m in _HEADER_RE.finditer(text) if m.start() > 0]
+    spans: List[Tuple[int, int]] = []
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else len(text)
+        chunk = text[start:end]
+        if chunk.startswith(SECTION_HEADER):
+            body = chunk.split("\n", 1)[1] if "\n" in chunk else ""
+            if not body.strip():
+                continue
+        elif not chunk.strip():
+            continue
+        spans.append((start, end))
+    return spans
+
+
+def get_section_index(index: Dict[str, Any]) -> List[List[Tuple[int, int]]]:
+    """Các mục (start, end) của từng document, tính một lần rồi giữ trong index["sections"]."""
+    sections = index.get("sections")
+    if sections is None:
+        sections = [split_sections(d["text"]) for d in index["docs"]]
+        index["sections"] = sections
+    return sections
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token (không cần tokenizer của model): số ký tự / CHARS_PER_TOKEN."""
+    return int(math.ceil(len(text) / CHARS_PER_TOKEN))
+
+
+def _chunk_key(text: str) -> str:
+    # Bỏ khác biệt khoảng trắng khi so trùng lặp giữa các document
+    return hashlib.sha1(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+def _truncate_lines(text: str, max_tokens: int) -> str:
+    """Cắt text theo ranh giới dòng để không quá max_tokens (giữ ít nhất dòng đầu)."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    kept: List[str] = []
+    used = 0
+    for line in text.split("\n"):
+        cost = estimate_tokens(line + "\n")
+        if kept and used + cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept) + "\n…"
+
+
+def _section_name(chunk: str) -> str:
+    first = chunk.split("\n", 1)[0]
+    if first.startswith(SECTION_HEADER):
+        return first[len(SECTION_HEADER):].strip().rstrip(":").strip()
+    return "phần đầu"
+
+
+def _query_terms(query: str) -> set:
+    return {fold_diacritics(t) for t in tokenize(query)}
+
+
+def _overlap(q_terms: set, text: str) -> float:
+    if not q_terms:
+        return 0.0
+    terms = {fold_diacritics(t) for t in tokenize(text)}
+    return len(q_terms & terms) / len(q_terms)
+
+
+def build_context(
+    query: str,
+    retrieved: List[Dict[str, Any]],
+    index: Dict[str, Any],
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+) -> str:
+    """Ghép context từ các document đã retrieve, giới hạn trong token_budget.
+
+    - Mỗi document được chia thành các mục (header "— ..."); mục trùng nội dung với mục đã lấy
+      của document khác chỉ ghi một dòng trỏ "(giống mục X của <title>)", nên document nào
+      cũng vẫn mang đủ thông tin của mình.
+    - Phần đầu (mục 0) của mọi document được ưu tiên trước theo thứ hạng, mỗi phần đầu tối đa
+      token_budget / số document để không mất tài liệu nào; sau đó là các mục còn lại
+      theo điểm = thứ hạng document x độ khớp với câu hỏi.
+    - Kết quả giữ thứ tự document và thứ tự mục gốc, giống build_context_snippet.
+    """
+    sections = get_section_index(index)
+    q_terms = _query_terms(query)
+
+    # (ưu tiên, điểm, thứ tự doc, thứ tự mục, text)
+    candidates: List[Tuple[int, float, int, int, str]] = []
+    for rank, d in enumerate(retrieved):
+        row = getattr(d, "row", None)
+        text = d["text"]
+        spans = sections[row] if row is not None else split_sections(text)
+        doc_weight = 1.0 / (rank + 1)
+        for j, (start, end) in enumerate(spans):
+            chunk = text[start:end].strip()
+            score = doc_weight * (0.5 + _overlap(q_terms, chunk))
+            candidates.append((0 if j == 0 else 1, -score, rank, j, chunk))
+    candidates.sort()
+
+    lead_budget = token_budget // max(len(retrieved), 1)
+    # khóa mục đã lấy -> (tên mục, title document chứa nó)
+    seen: Dict[str, Tuple[str, str]] = {}
+    selected: Dict[int, List[Tuple[int, str]]] = {}
+    used = 0
+    for priority, _, rank, j, chunk in candidates:
+        key = _chunk_key(chunk)
+        if key in seen:
+            name, title = seen[key]
+            chunk = f"(giống mục {name} của {title})"
+        elif priority == 0:
+            chunk = _truncate_lines(chunk, lead_budget)
+        cost = estimate_tokens(chunk)
+        if used + cost > token_budget:
+            continue
+        if key not in seen:
+            seen[key] = (_section_name(chunk), retrieved[rank]["title"])
+        used += cost
+        selected.setdefault(rank, []).append((j, chunk))
+
+    parts = []
+    for rank in sorted(selected):
+        chunks = "\n\n".join(chunk for _, chunk in sorted(selected[rank]))
+        parts.append(f"[{retrieved[rank]['title']}]\n{chunks}\n")
+    return "\n".join(parts)
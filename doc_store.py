@@ -0,0 +1,271 @@
+from __future__ import annotations
+from typing import Dict, Any, List, Iterable, Iterator, Tuple
+from collections.abc import Mapping
+import json
+import os
+
+import numpy as np
+
+# Trường chuỗi lưu trong buffer UTF-8 nối liền; các khóa khác của doc gom vào "meta" (JSON)
+_STR_FIELDS = ("key", "title", "text", "meta")
+# Id thực thể document nói tới, lưu thành cột int64 (-1 = không có) để lọc nhanh.
+# Document liên kết nhiều thực thể (vd tài liệu đã gộp) có thêm danh sách "<field>s" (disease_ids...),
+# lưu thành cặp mảng (dòng, id) để lọc cũng khớp các liên kết này.
+ENTITY_FIELDS = ("disease_id", "drug_id", "herb_id")
+_CORE_KEYS = ("id", "type", "key", "title", "text") + ENTITY_FIELDS
+
+
+def _pack(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Nối các chuỗi thành một buffer UTF-8 + mảng offsets (len = n + 1)."""
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+def _save_npy(path: str, arr: np.ndarray) -> None:
+    # Ghi file tạm rồi đổi tên: process đang memory-map file cũ vẫn đọc được bình thường
+    tmp = path + ".tmp.npy"
+    np.save(tmp, arr)
+    os.replace(tmp, path)
+
+
+class DocView(Mapping):
+    """View nhẹ trỏ vào một dòng của DocStore, đọc như dict (d["title"], d.get("text")...).
+
+    Chỉ giữ (store, row, score); các trường chuỗi được decode khi truy cập.
+    """
+
+    __slots__ = ("store", "row", "score")
+
+    def __init__(self, store: "DocStore", row: int, score: float | None = None) -> None:
+        self.store = store
+        self.row = row
+        self.score = score
+
+    def _meta(self) -> Dict[str, Any]:
+        meta = self.store.field("meta", self.row)
+        return json.loads(meta) if meta else {}
+
+    def __getitem__(self, name: str) -> Any:
+        store, row = self.store, self.row
+        if name == "id":
+            return int(store.ids[row])
+        if name == "type":
+            return store.type_names[store.type_codes[row]]
+        if name in ("title", "text"):
+            return store.field(name, row)
+        if name == "key":
+            key = store.field("key", row)
+            if key:
+                return key
+            raise KeyError(name)
+        if name in ENTITY_FIELDS:
+            value = int(store.entity_ids[name][row])
+            if value >= 0:
+                return value
+            raise KeyError(name)
+        if name == "score" and self.score is not None:
+            return self.score
+        return self._meta()[name]
+
+    def _keys(self) -> List[str]:
+        keys = ["id", "title", "type", "text"]
+        if self.store.field("key", self.row):
+            keys.append("key")
+        keys.extend(f for f in ENTITY_FIELDS if self.store.entity_ids[f][self.row] >= 0)
+        keys.extend(self._meta())
+        if self.score is not None:
+            keys.append("score")
+        return keys
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys())
+
+    def __len__(self) -> int:
+        return len(self._keys())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: self[k] for k in self._keys()}
+
+    def __repr__(self) -> str:
+        return f"DocView(row={self.row}, id={self['id']}, title={self['title']!r})"
+
+
+class DocStore:
+    """Kho documents dạng cột thay cho list các dict, có thể memory-map để nhiều process đọc chung.
+
+    - ids: mảng int64
+    - type_codes: mã phân loại (uint8) trỏ vào type_names
+    - key/title/text/meta: một buffer UTF-8 nối liền + mảng offsets cho mỗi trường
+    - entity_ids: disease_id/drug_id/herb_id dạng int64 (-1 = không có)
+    store[i] trả về DocView (đọc như dict); duyệt store cũng cho ra các DocView.
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        type_codes: np.ndarray,
+        type_names: List[str],
+        blobs: Dict[str, np.ndarray],
+        offsets: Dict[str, np.ndarray],
+        entity_ids: Dict[str, np.ndarray],
+        entity_links: Dict[str, Tuple[np.ndarray, np.ndarray]] | None = None,
+    ) -> None:
+        self.ids = ids
+        self.type_codes = type_codes
+        self.type_names = type_names
+        self.blobs = blobs
+        self.offsets = offsets
+        self.entity_ids = entity_ids
+        empty = np.empty(0, dtype=np.int64)
+        self.entity_links = entity_links or {f: (empty, empty) for f in ENTITY_FIELDS}
+        # Danh sách dòng theo từng mã type, tính một lần khi cần lọc
+        self._type_rows: List[np.ndarray] | None = None
+
+    @classmethod
+    def from_docs(cls, docs: Iterable[Mapping]) -> "DocStore":
+        if isinstance(docs, DocStore):
+            return docs
+        docs = list(docs)
+        type_names: List[str] = []
+        type_index: Dict[str, int] = {}
+        codes = np.zeros(len(docs), dtype=np.uint8)
+        columns: Dict[str, List[str]] = {name: [] for name in _STR_FIELDS}
+        for i, d in enumerate(docs):
+            t = d.get("type", "")
+            if t not in type_index:
+                type_index[t] = len(type_names)
+                type_names.append(t)
+            codes[i] = type_index[t]
+            columns["key"].append(str(d.get("key", "")))
+            columns["title"].append(d.get("title", ""))
+            columns["text"].append(d.get("text", ""))
+            extra = {k: v for k, v in d.items() if k not in _CORE_KEYS and k != "score"}
+            columns["meta"].append(json.dumps(extra, ensure_ascii=False) if extra else "")
+        ids = np.array([d.get("id", i) for i, d in enumerate(docs)], dtype=np.int64)
+        entity_ids = {
+            f: np.array([d.get(f, -1) for d in docs], dtype=np.int64) for f in ENTITY_FIELDS
+        }
+        entity_links: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for f in ENTITY_FIELDS:
+            pairs = [(i, v) for i, d in enumerate(docs) for v in (d.get(f + "s") or [])]
+            entity_links[f] = (
+                np.array([i for i, _ in pairs], dtype=np.int64),
+                np.array([v for _, v in pairs], dtype=np.int64),
+            )
+
+        blobs: Dict[str, np.ndarray] = {}
+        offsets: Dict[str, np.ndarray] = {}
+        for name in _STR_FIELDS:
+            blobs[name], offsets[name] = _pack(columns[name])
+        return cls(ids, codes, type_names, blobs, offsets, entity_ids, entity_links)
+
+    def __len__(self) -> int:
+        return int(self.ids.shape[0])
+
+    def field(self, name: str, i: int) -> str:
+        off = self.offsets[name]
+        return bytes(self.blobs[name][off[i]:off[i + 1]]).decode("utf-8")
+
+    def __getitem__(self, i: int) -> DocView:
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError(i)
+        return DocView(self, int(i))
+
+    def __iter__(self) -> Iterator[DocView]:
+        for i in range(len(self)):
+            yield DocView(self, i)
+
+    def view(self, row: int, score: float | None = None) -> DocView:
+        return DocView(self, int(row), score)
+
+    def rows_of_type(self, types: Iterable[str]) -> np.ndarray:
+        """Chỉ số dòng (tăng dần) có type thuộc types, ghép từ danh sách dòng tính sẵn theo type."""
+        if self._type_rows is None:
+            order = np.argsort(self.type_codes, kind="stable")
+            bounds = np.searchsorted(
+                self.type_codes[order], np.arange(len(self.type_names) + 1), side="left"
+            )
+            self._type_rows = [order[bounds[c]:bounds[c + 1]] for c in range(len(self.type_names))]
+        wanted = set(types)
+        parts = [self._type_rows[c] for c, t in enumerate(self.type_names) if t in wanted]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(parts)) if len(parts) > 1 else parts[0]
+
+    def filter_rows(
+        self,
+        types: Iterable[str] | None = None,
+        disease_id: int | None = None,
+        drug_id: int | None = None,
+        herb_id: int | None = None,
+    ) -> np.ndarray | None:
+        """Chỉ số dòng thỏa mọi điều kiện (AND); None nếu không có điều kiện nào (= toàn bộ).
+
+        Điều kiện id khớp cả cột id đơn lẫn danh sách liên kết (disease_ids...).
+        """
+        rows = self.rows_of_type(types) if types is not None else None
+        for name, value in (("disease_id", disease_id), ("drug_id", drug_id), ("herb_id", herb_id)):
+            if value is None:
+                continue
+            link_rows, link_ids = self.entity_links[name]
+            match = np.union1d(
+                np.flatnonzero(self.entity_ids[name] == value), link_rows[link_ids == value]
+            )
+            rows = match if rows is None else np.intersect1d(rows, match)
+        return rows
+
+    def nbytes(self) -> int:
+        """Tổng số byte của các mảng cột (buffer text, offsets, id, liên kết)."""
+        arrays = [
+            self.ids,
+            self.type_codes,
+            *self.blobs.values(),
+            *self.offsets.values(),
+            *self.entity_ids.values(),
+            *(a for pair in self.entity_links.values() for a in pair),
+        ]
+        return int(sum(a.nbytes for a in arrays))
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        _save_npy(os.path.join(directory, "doc_ids.npy"), self.ids)
+        _save_npy(os.path.join(directory, "doc_types.npy"), self.type_codes)
+        for name in _STR_FIELDS:
+            _save_npy(os.path.join(directory, f"doc_{name}.npy"), self.blobs[name])
+            _save_npy(os.path.join(directory, f"doc_{name}_offsets.npy"), self.offsets[name])
+        for name in ENTITY_FIELDS:
+            _save_npy(os.path.join(directory, f"doc_{name}.npy"), self.entity_ids[name])
+            link_rows, link_ids = self.entity_links[name]
+            _save_npy(os.path.join(directory, f"doc_{name}_link_rows.npy"), link_rows)
+            _save_npy(os.path.join(directory, f"doc_{name}_link_ids.npy"), link_ids)
+        tmp = os.path.join(directory, "doc_types.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.type_names, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(directory, "doc_types.json"))
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "DocStore":
+        """Đọc DocStore; mmap=True để các mảng được map read-only, dùng chung page cache."""
+        mode = "r" if mmap else None
+
+        def arr(name: str) -> np.ndarray:
+            return np.load(os.path.join(directory, name), mmap_mode=mode)
+
+        with open(os.path.join(directory, "doc_types.json"), "r", encoding="utf-8") as f:
+            type_names = json.load(f)
+        blobs = {name: arr(f"doc_{name}.npy") for name in _STR_FIELDS}
+        offsets = {name: arr(f"doc_{name}_offsets.npy") for name in _STR_FIELDS}
+        entity_ids = {name: arr(f"doc_{name}.npy") for name in ENTITY_FIELDS}
+        entity_links = {
+            name: (arr(f"doc_{name}_link_rows.npy"), arr(f"doc_{name}_link_ids.npy"))
+            for name in ENTITY_FIELDS
+        }
+        return cls(
+            arr("doc_ids.npy"), arr("doc_types.npy"), type_names, blobs, offsets, entity_ids, entity_links
+        )
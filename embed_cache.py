@@ -0,0 +1,193 @@
+from __future__ import annotations
+from typing import Dict, List, Tuple
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+
+from answer_cache import normalize_query
+
+
+def text_hash(text: str) -> str:
+    """sha256 của nội dung document, dùng làm key cache."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Kho embedding lưu trên đĩa, key = (tên model, sha256 nội dung).
+
+    Mỗi model có một thư mục riêng gồm:
+        - vectors.npy: ma trận float32 (n, dim), đọc bằng memory-map
+        - manifest.json: model, dim và danh sách hash theo thứ tự dòng
+    """
+
+    def __init__(self, cache_dir: str, model_name: str) -> None:
+        self.model_name = model_name
+        safe_model = re.sub(r"[^0-9A-Za-z_.-]", "_", model_name)
+        self.dir = os.path.join(cache_dir, safe_model)
+        self.vectors_path = os.path.join(self.dir, "vectors.npy")
+        self.manifest_path = os.path.join(self.dir, "manifest.json")
+
+        self._rows: Dict[str, int] = {}
+        self._mat: np.ndarray | None = None
+        # Vector mới chưa ghi, key -> vector (mỗi key một lần, giữ thứ tự thêm vào)
+        self._pending: Dict[str, np.ndarray] = {}
+        self._load()
+
+    def _load(self) -> None:
+        if not (os.path.exists(self.manifest_path) and os.path.exists(self.vectors_path)):
+            return
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            mat = np.load(self.vectors_path, mmap_mode="r")
+        except Exception as e:
+            print(f"⚠️ Bỏ qua cache embedding hỏng tại '{self.dir}': {e}")
+            return
+        keys = manifest.get("keys", [])
+        if manifest.get("model") != self.model_name or len(keys) != mat.shape[0]:
+            print(f"⚠️ Manifest cache embedding không khớp tại '{self.dir}', bỏ qua.")
+            return
+        self._mat = mat
+        self._rows = {k: i for i, k in enumerate(keys)}
+
+    def __len__(self) -> int:
+        return len(self._rows) + len(self._pending)
+
+    def lookup(self, keys: List[str]) -> Tuple[List[np.ndarray | None], List[int]]:
+        """Trả về (vector hoặc None cho từng key, vị trí các key chưa có trong cache)."""
+        out: List[np.ndarray | None] = [None] * len(keys)
+        hit_pos: List[int] = []
+        hit_rows: List[int] = []
+        missing: List[int] = []
+        for i, k in enumerate(keys):
+            row = self._rows.get(k)
+            if row is not None and self._mat is not None:
+                hit_pos.append(i)
+                hit_rows.append(row)
+            elif k in self._pending:
+                out[i] = self._pending[k]
+            else:
+                missing.append(i)
+        if hit_rows:
+            # Gom một lần từ memory-map thay vì đọc từng dòng
+            hits = np.asarray(self._mat[np.asarray(hit_rows)], dtype=np.float32)
+            for j, i in enumerate(hit_pos):
+                out[i] = hits[j]
+        return out, missing
+
+    def add(self, keys: List[str], vecs: List[np.ndarray]) -> None:
+        for k, v in zip(keys, vecs):
+            # Trùng key (kể cả trong cùng một lần add) chỉ giữ một dòng, để manifest khớp ma trận
+            if k in self._rows or k in self._pending:
+                continue
+            self._pending[k] = np.asarray(v, dtype=np.float32)
+
+    def save(self) -> None:
+        """Ghi các vector mới xuống đĩa (ghi file tạm rồi os.replace)."""
+        if not self._pending:
+            return
+        os.makedirs(self.dir, exist_ok=True)
+
+        new_mat = np.vstack(list(self._pending.values())).astype(np.float32)
+        if self._mat is not None and self._mat.shape[0] > 0:
+            if self._mat.shape[1] != new_mat.shape[1]:
+                raise ValueError(
+                    f"Số chiều embedding mới ({new_mat.shape[1]}) khác cache ({self._mat.shape[1]})."
+                )
+            mat = np.vstack([np.asarray(self._mat), new_mat])
+        else:
+            mat = new_mat
+        # Cùng thứ tự với các dòng được vstack: dòng cũ theo chỉ số, rồi vector mới theo thứ tự thêm
+        keys = [k for k, _ in sorted(self._rows.items(), key=lambda kv: kv[1])]
+        keys.extend(self._pending)
+
+        tmp_vectors = self.vectors_path + ".tmp.npy"
+        tmp_manifest = self.manifest_path + ".tmp"
+        np.save(tmp_vectors, mat)
+        with open(tmp_manifest, "w", encoding="utf-8") as f:
+            json.dump(
+                {"model": self.model_name, "dim": int(mat.shape[1]), "keys": keys},
+                f,
+            )
+        # Bỏ memory-map cũ trước khi thay file (Windows không cho replace file đang map)
+        self._mat = None
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_manifest, self.manifest_path)
+
+        self._pending = {}
+        self._load()
+
+
+class QueryEmbeddingCache:
+    """LRU trong process cho embedding câu hỏi, key = (tên model, câu hỏi chuẩn hóa).
+
+    Nếu có db_path, cache được ghi thêm vào SQLite để nhiều process dùng chung.
+    """
+
+    def __init__(self, model_name: str, max_size: int = 2048, db_path: str | None = None) -> None:
+        self.model_name = model_name
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5.0)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "model TEXT NOT NULL, query TEXT NOT NULL, vec BLOB NOT NULL, "
+                "PRIMARY KEY (model, query))"
+            )
+            self._db.commit()
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def get(self, query: str) -> np.ndarray | None:
+        key = normalize_query(query)
+        with self._lock:
+            vec = self._lru.get(key)
+            if vec is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return vec
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vec FROM query_embeddings WHERE model = ? AND query = ?",
+                    (self.model_name, key),
+                ).fetchone()
+                if row is not None:
+                    vec = np.frombuffer(row[0], dtype=np.float32)
+                    self._put_lru(key, vec)
+                    self.hits += 1
+                    return vec
+            self.misses += 1
+            return None
+
+    def put(self, query: str, vec: np.ndarray) -> None:
+        key = normalize_query(query)
+        vec = np.asarray(vec, dtype=np.float32)
+        with self._lock:
+            self._put_lru(key, vec)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (model, query, vec) VALUES (?, ?, ?)",
+                    (self.model_name, key, vec.tobytes()),
+                )
+                self._db.commit()
+
+    def _put_lru(self, key: str, vec: np.ndarray) -> None:
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._lru), "hits": self.hits, "misses": self.misses}
@@ -1,54 +1,56 @@
 from __future__ import annotations
-from typing import Any
+from typing import Any, Dict, List
 
+import numpy as np
 import pandas as pd
 
 
-def safe_read_sheet(
+def _resolve_sheet_name(sheet_name: str, all_sheets: List[str]) -> str | None:
+    """Tìm tên sheet thật trong workbook: khớp chính xác trước, sau đó khớp lowercase."""
+    if sheet_name in all_sheets:
+        return sheet_name
+    target = sheet_name.lower().strip()
+    for s in all_sheets:
+        if s.lower().strip() == target:
+            return s
+    return None
+
+
+def load_workbook_sheets(
     xlsx_path: str,
-    sheet_name: str,
+    sheet_names: List[str],
     header: int | None = None
-) -> pd.DataFrame | None:
-    """Đọc một sheet từ Excel an toàn, thử khớp lowercase nếu tên gốc lỗi."""
-    import openpyxl
+) -> Dict[str, pd.DataFrame | None]:
+    """Mở workbook MỘT lần và đọc tất cả sheet cần thiết.
 
-    try:
-        df = pd.read_excel(xlsx_path, sheet_name=sheet_name, header=header)
-        return df
-    except Exception as e:
-        print(f"⚠️ Lỗi đọc sheet '{sheet_name}' (thử trực tiếp): {e}")
+    Danh sách sheet được lấy một lần từ workbook rồi khớp tên (kể cả lowercase).
+    Trả về dict tên sheet yêu cầu -> DataFrame (None nếu thiếu/lỗi).
+    """
+    frames: Dict[str, pd.DataFrame | None] = {name: None for name in sheet_names}
 
     try:
-        book = openpyxl.load_workbook(xlsx_path, read_only=True)
-        all_sheets = book.sheetnames
-        print(f"ℹ️ Các sheet tìm thấy trong file '{xlsx_path}': {all_sheets}")
-
-        target = sheet_name.lower().strip()
-        matched_name = None
-        for s in all_sheets:
-            if s.lower().strip() == target:
-                matched_name = s
-                break
-
-        if matched_name is not None:
-            print(
-                f"✅ Tìm thấy sheet khớp lowercase: '{matched_name}' (thay cho '{sheet_name}'). Thử đọc lại..."
-            )
-            try:
-                df = pd.read_excel(xlsx_path, sheet_name=matched_name, header=header)
-                return df
-            except Exception as e2:
-                print(f"⚠️ Vẫn lỗi khi đọc sheet '{matched_name}': {e2}")
-                return None
-        else:
-            print(
-                f"❌ Không tìm thấy sheet nào khớp với '{sheet_name}' (kể cả so sánh lowercase)."
-            )
-            return None
-
+        book = pd.ExcelFile(xlsx_path)
     except Exception as e:
         print(f"⚠️ Lỗi khi mở workbook '{xlsx_path}': {e}")
-        return None
+        return frames
+
+    with book:
+        all_sheets = list(book.sheet_names)
+        for name in sheet_names:
+            matched_name = _resolve_sheet_name(name, all_sheets)
+            if matched_name is None:
+                print(
+                    f"❌ Không tìm thấy sheet nào khớp với '{name}' (kể cả so sánh lowercase)."
+                )
+                continue
+            if matched_name != name:
+                print(f"✅ Tìm thấy sheet khớp lowercase: '{matched_name}' (thay cho '{name}').")
+            try:
+                frames[name] = book.parse(matched_name, header=header)
+            except Exception as e:
+                print(f"⚠️ Lỗi đọc sheet '{matched_name}': {e}")
+
+    return frames
 
 
 def _str(x: Any) -> str:
@@ -88,8 +90,44 @@ def _id_from_code_prefix(code: Any) -> int | None:
     return _safe_int(parts[0])
 
 
-def safe_get_col(r: pd.Series, idx: int) -> Any:
-    """Lấy giá trị cột theo index, nếu không có thì trả về None."""
-    if idx in r.index:
-        return r[idx]
-    return None
+# ------------------------------------------------------------
+# Phiên bản theo cột (vectorized) của các helper ở trên
+# ------------------------------------------------------------
+def get_col(df: pd.DataFrame, idx: int) -> pd.Series:
+    """Lấy cả cột theo index, nếu không có thì trả về cột toàn None."""
+    if idx in df.columns:
+        return df[idx]
+    return pd.Series([None] * len(df), index=df.index, dtype=object)
+
+
+def str_col(s: pd.Series) -> pd.Series:
+    """Như _str nhưng cho cả cột: NaN/None -> "", còn lại str(x).strip()."""
+    mask = s.isna()
+    out = s.astype(object).astype(str).str.strip()
+    out[mask] = ""
+    return out
+
+
+def int_col(s: pd.Series) -> pd.Series:
+    """Như _safe_int nhưng cho cả cột, trả về cột Int64 (lỗi -> <NA>)."""
+    num = pd.to_numeric(s, errors="coerce")
+    vals = num.to_numpy(dtype="float64", na_value=np.nan)
+    # Ngoài khoảng int64 (vd ô ID nhập nhầm số rất lớn) coi như không hợp lệ -> <NA>
+    with np.errstate(invalid="ignore"):
+        ok = np.isfinite(vals) & (np.abs(vals) < 2.0 ** 63)
+    out = pd.Series(pd.array(np.where(ok, np.trunc(vals), 0), dtype="Int64"), index=s.index)
+    out[~ok] = pd.NA
+    # Giá trị to_numeric không hiểu nhưng int() của Python vẫn đọc được (vd '1_000')
+    fallback = num.isna() & s.notna()
+    if fallback.any():
+        parsed = s[fallback].map(_safe_int)
+        parsed = parsed.where(parsed.map(lambda v: v is not None and -(2 ** 63) <= v < 2 ** 63), None)
+        out[fallback] = parsed.astype("Int64")
+    return out
+
+
+def id_col_from_code_prefix(s: pd.Series) -> pd.Series:
+    """Như _id_from_code_prefix cho cả cột: '1.1' -> 1."""
+    prefix = str_col(s).str.split(".", n=1).str[0]
+    prefix[prefix == ""] = None
+    return int_col(prefix)
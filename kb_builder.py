@@ -1,17 +1,230 @@
 from __future__ import annotations
 from typing import List, Dict, Any, Tuple
+import hashlib
+import re
 
 import pandas as pd
 
+import metrics
 from excel_utils import (
-    safe_read_sheet,
-    _str,
-    _safe_int,
-    _id_from_code_prefix,
-    safe_get_col,
+    load_workbook_sheets,
+    get_col,
+    str_col,
+    int_col,
+    id_col_from_code_prefix,
 )
 
 
+# Tất cả sheet mà build_kb_from_excel cần đọc từ workbook
+KB_SHEETS: List[str] = [
+    "dim_benh",
+    "trieu_chung",
+    "nhombenh",
+    "map_nhombenh_benh",
+    "dim_thuoctay",
+    "thuoctay_cochetacdong",
+    "thuoctay_duocluchoc",
+    "thuoctay_thoigiantacdung",
+    "thuoctay_duocdonghoc",
+    "thuoctay_dacdiemhoahoc",
+    "thuoctay_dacdiemnguongoc",
+    "thuoctay_doctinh",
+    "thuoctay_tinhchatlyhoa",
+    "dim_thaoduoc",
+    "thaoduoc_cochetacdong",
+    "thaoduoc_duocluchoc",
+    "thaoduoc_thoigiantacdung",
+    "thaoduoc_duocdonghoc",
+    "thaoduoc_dacdiemhoahoc",
+    "thaoduoc_dacdiemnguongoc",
+    "thaoduoc_doctinh",
+    "thaoduoc_tinhchatlyhoa",
+    "map_benh_thuoctay",
+    "map_benh_thaoduoc_survey",
+]
+
+
+class _StrCols:
+    """Truy cập cột của sheet dưới dạng chuỗi đã làm sạch (str_col), tính một lần mỗi cột."""
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        self.df = df
+        self._cache: Dict[int, pd.Series] = {}
+
+    def __getitem__(self, idx: int) -> pd.Series:
+        if idx not in self._cache:
+            self._cache[idx] = str_col(get_col(self.df, idx))
+        return self._cache[idx]
+
+
+def _join_nonempty(cols: List[pd.Series], sep: str) -> pd.Series:
+    """Nối các cột chuỗi theo từng dòng, bỏ qua ô rỗng (như sep.join([x for x in row if x]))."""
+    out = cols[0]
+    for col in cols[1:]:
+        out = out.where(col == "", out.where(out == "", out + sep) + col)
+    return out
+
+
+def _group_texts(target: Dict[int, List[str]], ids: pd.Series, texts: pd.Series) -> None:
+    """Gom texts theo id (giữ thứ tự dòng), nối thêm vào target[id]. Bỏ qua dòng id rỗng."""
+    keep = ids.notna()
+    if not keep.any():
+        return
+    grouped = texts[keep].groupby(ids[keep].astype("int64").to_numpy(), sort=False).agg(list)
+    for key, items in grouped.items():
+        target.setdefault(int(key), []).extend(items)
+
+
+def stable_doc_id(key: str) -> int:
+    """ID số ổn định (63 bit) suy ra từ khóa thực thể của document, không phụ thuộc thứ tự dòng."""
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big") >> 1
+
+
+def _append_doc(
+    docs: List[Dict[str, Any]],
+    key_counts: Dict[str, int],
+    key: str,
+    title: str,
+    doc_type: str,
+    text: str,
+    **entity_ids: int,
+) -> None:
+    """Thêm document với key thực thể (vd 'drug:12', 'disease_drug:3:12').
+
+    Cùng một key xuất hiện nhiều lần (nhiều dòng map cho cùng cặp) thì thêm hậu tố '#2', '#3'...
+    entity_ids: disease_id / drug_id / herb_id mà document nói tới (dùng để lọc khi retrieve).
+    """
+    n = key_counts.get(key, 0) + 1
+    key_counts[key] = n
+    if n > 1:
+        key = f"{key}#{n}"
+    doc = {
+        "id": stable_doc_id(key),
+        "key": key,
+        "title": title,
+        "type": doc_type,
+        "text": text,
+    }
+    doc.update(entity_ids)
+    docs.append(doc)
+
+
+def _norm_title(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def _merge_literature(
+    entries: List[Dict[str, Any]],
+) -> List[Tuple[str, str, str, Dict[str, Any]]]:
+    """Gộp các dòng tài liệu cùng tiêu đề (chuẩn hóa) hoặc cùng link http(s) thành một document.
+
+    Trả về (key, title, text, entity_ids) theo thứ tự xuất hiện đầu tiên. entity_ids gồm
+    disease_ids/drug_ids/herb_ids (danh sách) và disease_id/drug_id/herb_id khi chỉ có một.
+    """
+    # Union-find nhỏ trên các khóa "t:<tiêu đề>" / "u:<link>"
+    parent: Dict[str, str] = {}
+
+    def find(x: str) -> str:
+        while parent.setdefault(x, x) != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    entry_keys: List[List[str]] = []
+    skipped = 0
+    for e in entries:
+        keys = []
+        if _norm_title(e["title"]):
+            keys.append("t:" + _norm_title(e["title"]))
+        if e["url"].lower().startswith(("http://", "https://")):
+            keys.append("u:" + e["url"].strip())
+        if not keys and _norm_title(e["author"]):
+            keys.append("a:" + _norm_title(e["author"]))
+        if not keys and e["url"].strip():
+            keys.append("u:" + e["url"].strip())
+        if not keys:
+            # Không tiêu đề/link/tác giả: không có gì để nhận diện, không gộp chung với nhau
+            skipped += 1
+        for k in keys[1:]:
+            parent[find(k)] = find(keys[0])
+        entry_keys.append(keys)
+    if skipped:
+        print(f"ℹ️ Bỏ {skipped} dòng tài liệu không có tiêu đề, link và tác giả.")
+
+    groups: Dict[str, List[int]] = {}
+    for i, keys in enumerate(entry_keys):
+        if keys:
+            groups.setdefault(find(keys[0]), []).append(i)
+
+    merged: List[Tuple[str, str, str, Dict[str, Any]]] = []
+    for root, idxs in groups.items():
+        items = [entries[i] for i in idxs]
+        first = items[0]
+
+        def uniq(field: str) -> List[Any]:
+            return list(dict.fromkeys(e[field] for e in items if e.get(field) not in (None, "")))
+
+        disease_ids = uniq("disease_id")
+        drug_ids = uniq("drug_id")
+        herb_ids = uniq("herb_id")
+        if drug_ids and herb_ids:
+            kind, title_prefix = "thuốc tây và thảo dược", "Tài liệu tham khảo"
+        elif herb_ids:
+            kind, title_prefix = "thảo dược", "Tài liệu thảo dược"
+        else:
+            kind, title_prefix = "thuốc tây", "Tài liệu thuốc tây"
+
+        links: Dict[Any, List[str]] = {}
+        for e in items:
+            target = (
+                f"thuốc tây {e['drug']} (ID {e['drug_id']})"
+                if "drug_id" in e
+                else f"thảo dược {e['herb']} (ID {e['herb_id']})"
+            )
+            targets = links.setdefault((e["disease_id"], e["disease"]), [])
+            if target not in targets:
+                targets.append(target)
+        link_lines = "".join(
+            f"- Bệnh {dname} (ID {did}): {', '.join(targets)}\n"
+            for (did, dname), targets in links.items()
+        )
+        diseases = ", ".join(dict.fromkeys(e["disease"] for e in items))
+        text = (
+            f"Tài liệu tham khảo về {kind} trong bối cảnh bệnh {diseases}.\n"
+            f"Tác giả/nguồn: {'; '.join(uniq('author'))}\n"
+            f"Tiêu đề: {first['title']}\n"
+            f"Link: {' ; '.join(uniq('url'))}\n"
+            f"Được dẫn cho:\n{link_lines}"
+        )
+        entity_ids: Dict[str, Any] = {
+            "disease_ids": disease_ids,
+            "drug_ids": drug_ids,
+            "herb_ids": herb_ids,
+        }
+        for name, ids in (("disease_id", disease_ids), ("drug_id", drug_ids), ("herb_id", herb_ids)):
+            if len(ids) == 1:
+                entity_ids[name] = ids[0]
+        key = "literature:" + hashlib.sha1(root.encode("utf-8")).hexdigest()[:12]
+        merged.append((key, f"{title_prefix}: {first['title']}", text, entity_ids))
+    return merged
+
+
+def dedupe_docs(docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Bỏ document trùng nội dung y hệt (theo hash của text), giữ bản xuất hiện đầu tiên."""
+    seen = set()
+    out: List[Dict[str, Any]] = []
+    for d in docs:
+        h = hashlib.sha256(d["text"].encode("utf-8")).digest()
+        if h in seen:
+            continue
+        seen.add(h)
+        out.append(d)
+    if len(out) < len(docs):
+        print(f"ℹ️ Bỏ {len(docs) - len(out)} documents trùng nội dung.")
+    return out
+
+
+@metrics.timed("build_kb")
 def build_kb_from_excel(
     xlsx_path: str
 ) -> Tuple[List[Dict[str, Any]], Dict[int, str], Dict[int, Dict[str, str]]]:
@@ -23,15 +236,18 @@ def build_kb_from_excel(
         - symptom_dict: dict id_benh -> {symptoms, link}
     """
     docs: List[Dict[str, Any]] = []
-    doc_id = 1
+    key_counts: Dict[str, int] = {}
+
+    # Mở workbook một lần, đọc toàn bộ sheet cần thiết
+    sheets = load_workbook_sheets(xlsx_path, KB_SHEETS, header=None)
 
     # --------------------------------------------------------
     # 3.1. BỆNH, TRIỆU CHỨNG, NHÓM BỆNH
     # --------------------------------------------------------
-    dim_benh = safe_read_sheet(xlsx_path, "dim_benh", header=None)
-    trieu_chung = safe_read_sheet(xlsx_path, "trieu_chung", header=None)
-    nhombenh = safe_read_sheet(xlsx_path, "nhombenh", header=None)
-    map_nhombenh_benh = safe_read_sheet(xlsx_path, "map_nhombenh_benh", header=None)
+    dim_benh = sheets["dim_benh"]
+    trieu_chung = sheets["trieu_chung"]
+    nhombenh = sheets["nhombenh"]
+    map_nhombenh_benh = sheets["map_nhombenh_benh"]
 
     if dim_benh is None:
         raise RuntimeError("❌ Thiếu sheet dim_benh trong Excel.")
@@ -39,25 +255,25 @@ def build_kb_from_excel(
     # disease_id -> name
     dim_benh = dim_benh.iloc[:, :2]
     dim_benh.columns = [0, 1]
-    disease_name: Dict[int, str] = {}
-    for _, r in dim_benh.iterrows():
-        did = _safe_int(r[0])
-        if did is None:
-            continue
-        disease_name[did] = _str(r[1])
+    ids = int_col(dim_benh[0])
+    keep = ids.notna()
+    disease_name: Dict[int, str] = dict(zip(ids[keep].tolist(), str_col(dim_benh[1])[keep].tolist()))
 
     # disease_id -> {symptoms, link}
     symptom_dict: Dict[int, Dict[str, str]] = {}
     if trieu_chung is not None:
         trieu_chung = trieu_chung.iloc[:, :3]
         trieu_chung.columns = [0, 1, 2]
-        for _, r in trieu_chung.iterrows():
-            did = _safe_int(r[0])
-            if did is None:
-                continue
+        ids = int_col(trieu_chung[0])
+        keep = ids.notna()
+        for did, symptoms, link in zip(
+            ids[keep].tolist(),
+            str_col(trieu_chung[1])[keep].tolist(),
+            str_col(trieu_chung[2])[keep].tolist(),
+        ):
             symptom_dict[did] = {
-                "symptoms": _str(r[1]),
-                "link": _str(r[2]),
+                "symptoms": symptoms,
+                "link": link,
             }
 
     # group_id -> group_name
@@ -65,22 +281,19 @@ def build_kb_from_excel(
     if nhombenh is not None:
         nhombenh = nhombenh.iloc[:, :2]
         nhombenh.columns = [0, 1]
-        for _, r in nhombenh.iterrows():
-            gid = _safe_int(r[0])
-            if gid is None:
-                continue
-            group_name[gid] = _str(r[1])
+        ids = int_col(nhombenh[0])
+        keep = ids.notna()
+        group_name = dict(zip(ids[keep].tolist(), str_col(nhombenh[1])[keep].tolist()))
 
     # disease_groups: disease_id -> [group_name...]
     disease_groups: Dict[int, List[str]] = {did: [] for did in disease_name.keys()}
     if map_nhombenh_benh is not None:
         map_nhombenh_benh = map_nhombenh_benh.iloc[:, :2]
         map_nhombenh_benh.columns = [0, 1]
-        for _, r in map_nhombenh_benh.iterrows():
-            gid = _safe_int(r[0])
-            did = _safe_int(r[1])
-            if gid is None or did is None:
-                continue
+        gids = int_col(map_nhombenh_benh[0])
+        dids = int_col(map_nhombenh_benh[1])
+        keep = gids.notna() & dids.notna()
+        for gid, did in zip(gids[keep].tolist(), dids[keep].tolist()):
             gname = group_name.get(gid, f"Nhóm {gid}")
             if did in disease_groups:
                 disease_groups[did].append(gname)
@@ -88,15 +301,15 @@ def build_kb_from_excel(
     # --------------------------------------------------------
     # 3.2. THUỐC TÂY: CORE + DƯỢC LỰC + DƯỢC ĐỘNG + TÍNH CHẤT
     # --------------------------------------------------------
-    dim_thuoctay = safe_read_sheet(xlsx_path, "dim_thuoctay", header=None)
-    tht_cochetacdong = safe_read_sheet(xlsx_path, "thuoctay_cochetacdong", header=None)
-    tht_duocluchoc = safe_read_sheet(xlsx_path, "thuoctay_duocluchoc", header=None)
-    tht_thoigiantacdung = safe_read_sheet(xlsx_path, "thuoctay_thoigiantacdung", header=None)
-    tht_duocdonghoc = safe_read_sheet(xlsx_path, "thuoctay_duocdonghoc", header=None)
-    tht_dacdiemhoahoc = safe_read_sheet(xlsx_path, "thuoctay_dacdiemhoahoc", header=None)
-    tht_dacdiemnguongoc = safe_read_sheet(xlsx_path, "thuoctay_dacdiemnguongoc", header=None)
-    tht_doctinh = safe_read_sheet(xlsx_path, "thuoctay_doctinh", header=None)
-    tht_tinhchatlyhoa = safe_read_sheet(xlsx_path, "thuoctay_tinhchatlyhoa", header=None)
+    dim_thuoctay = sheets["dim_thuoctay"]
+    tht_cochetacdong = sheets["thuoctay_cochetacdong"]
+    tht_duocluchoc = sheets["thuoctay_duocluchoc"]
+    tht_thoigiantacdung = sheets["thuoctay_thoigiantacdung"]
+    tht_duocdonghoc = sheets["thuoctay_duocdonghoc"]
+    tht_dacdiemhoahoc = sheets["thuoctay_dacdiemhoahoc"]
+    tht_dacdiemnguongoc = sheets["thuoctay_dacdiemnguongoc"]
+    tht_doctinh = sheets["thuoctay_doctinh"]
+    tht_tinhchatlyhoa = sheets["thuoctay_tinhchatlyhoa"]
 
     drug_core: Dict[int, Dict[str, Any]] = {}
     drug_mech: Dict[int, List[str]] = {}
@@ -111,150 +324,111 @@ def build_kb_from_excel(
     if dim_thuoctay is not None:
         dim_thuoctay = dim_thuoctay.iloc[:, :6]
         dim_thuoctay.columns = [0, 1, 2, 3, 4, 5]
-        for _, r in dim_thuoctay.iterrows():
-            did = _safe_int(r[0])
-            if did is None:
-                continue
+        ids = int_col(dim_thuoctay[0])
+        keep = ids.notna()
+        cols = [str_col(dim_thuoctay[i])[keep].tolist() for i in range(1, 6)]
+        for did, name, active, brands, active_short, warnings in zip(ids[keep].tolist(), *cols):
             drug_core[did] = {
-                "drug_name": _str(r[1]),
-                "active": _str(r[2]),
-                "brands": _str(r[3]),
-                "active_short": _str(r[4]),
-                "warnings": _str(r[5]),
+                "drug_name": name,
+                "active": active,
+                "brands": brands,
+                "active_short": active_short,
+                "warnings": warnings,
             }
 
     # Cơ chế tác động (PD): thuoctay_cochetacdong
     if tht_cochetacdong is not None:
         tht_cochetacdong.columns = list(range(tht_cochetacdong.shape[1]))
-        for _, r in tht_cochetacdong.iterrows():
-            drug_id = _safe_int(safe_get_col(r, 1))
-            if drug_id is None:
-                continue
-            mech_code = _str(safe_get_col(r, 2))
-            action = _str(safe_get_col(r, 3))
-            mech = _str(safe_get_col(r, 4))
-            text = f"- Cơ chế {mech_code}: {action}. Giải thích: {mech}"
-            drug_mech.setdefault(drug_id, []).append(text)
+        c = _StrCols(tht_cochetacdong)
+        text = "- Cơ chế " + c[2] + ": " + c[3] + ". Giải thích: " + c[4]
+        _group_texts(drug_mech, int_col(get_col(tht_cochetacdong, 1)), text)
 
     # Dược lực học lâm sàng + cảnh báo (không dùng cột liều): thuoctay_duocluchoc
     if tht_duocluchoc is not None:
         tht_duocluchoc.columns = list(range(tht_duocluchoc.shape[1]))
-        for _, r in tht_duocluchoc.iterrows():
-            code = safe_get_col(r, 1)
-            drug_id = _id_from_code_prefix(code)
-            if drug_id is None:
-                continue
-            effect = _str(safe_get_col(r, 2))
-            note = _str(safe_get_col(r, 4))
-            if effect or note:
-                text = f"- Tác dụng lâm sàng: {effect}. Ghi chú an toàn/đặc điểm: {note}"
-                drug_mech.setdefault(drug_id, []).append(text)
+        c = _StrCols(tht_duocluchoc)
+        effect, note = c[2], c[4]
+        text = "- Tác dụng lâm sàng: " + effect + ". Ghi chú an toàn/đặc điểm: " + note
+        has_info = (effect != "") | (note != "")
+        ids = id_col_from_code_prefix(get_col(tht_duocluchoc, 1))
+        _group_texts(drug_mech, ids[has_info], text[has_info])
 
     # Thời gian tác dụng: thuoctay_thoigiantacdung
     if tht_thoigiantacdung is not None:
         tht_thoigiantacdung.columns = list(range(tht_thoigiantacdung.shape[1]))
-        for _, r in tht_thoigiantacdung.iterrows():
-            code = safe_get_col(r, 1)
-            drug_id = _id_from_code_prefix(code)
-            if drug_id is None:
-                continue
-            onset = _str(safe_get_col(r, 2))
-            duration = _str(safe_get_col(r, 3))
-            text = f"- Thời gian khởi phát tác dụng: {onset}. Thời gian duy trì tác dụng: {duration}"  # noqa: E501
-            drug_time.setdefault(drug_id, []).append(text)
+        c = _StrCols(tht_thoigiantacdung)
+        text = "- Thời gian khởi phát tác dụng: " + c[2] + ". Thời gian duy trì tác dụng: " + c[3]  # noqa: E501
+        _group_texts(drug_time, id_col_from_code_prefix(get_col(tht_thoigiantacdung, 1)), text)
 
     # Dược động học: thuoctay_duocdonghoc
     if tht_duocdonghoc is not None:
         tht_duocdonghoc.columns = list(range(tht_duocdonghoc.shape[1]))
-        for _, r in tht_duocdonghoc.iterrows():
-            drug_id = _safe_int(safe_get_col(r, 0))
-            if drug_id is None:
-                continue
-            absorption = _str(safe_get_col(r, 1))
-            distribution = _str(safe_get_col(r, 2))
-            metabolism = _str(safe_get_col(r, 3))
-            elimination = _str(safe_get_col(r, 4))
-            text = (
-                f"- Hấp thu: {absorption}\n"
-                f"- Phân bố: {distribution}\n"
-                f"- Chuyển hóa: {metabolism}\n"
-                f"- Thải trừ: {elimination}"
-            )
-            drug_pk.setdefault(drug_id, []).append(text)
+        c = _StrCols(tht_duocdonghoc)
+        text = (
+            "- Hấp thu: " + c[1] + "\n"
+            + "- Phân bố: " + c[2] + "\n"
+            + "- Chuyển hóa: " + c[3] + "\n"
+            + "- Thải trừ: " + c[4]
+        )
+        _group_texts(drug_pk, int_col(get_col(tht_duocdonghoc, 0)), text)
 
     # Đặc điểm hóa học: thuoctay_dacdiemhoahoc
     if tht_dacdiemhoahoc is not None:
         tht_dacdiemhoahoc.columns = list(range(tht_dacdiemhoahoc.shape[1]))
-        for _, r in tht_dacdiemhoahoc.iterrows():
-            drug_id = _safe_int(safe_get_col(r, 0))
-            if drug_id is None:
-                continue
-            text = (
-                f"- Đặc điểm hóa học: {_str(safe_get_col(r, 1))}\n"
-                f"- Độ tan: {_str(safe_get_col(r, 2))}\n"
-                f"- Độ bền/ổn định: {_str(safe_get_col(r, 3))}\n"
-                f"- Ghi chú thêm: {_str(safe_get_col(r, 4))}"
-            )
-            drug_chem.setdefault(drug_id, []).append(text)
+        c = _StrCols(tht_dacdiemhoahoc)
+        text = (
+            "- Đặc điểm hóa học: " + c[1] + "\n"
+            + "- Độ tan: " + c[2] + "\n"
+            + "- Độ bền/ổn định: " + c[3] + "\n"
+            + "- Ghi chú thêm: " + c[4]
+        )
+        _group_texts(drug_chem, int_col(get_col(tht_dacdiemhoahoc, 0)), text)
 
     # Nguồn gốc, bản chất: thuoctay_dacdiemnguongoc
     if tht_dacdiemnguongoc is not None:
         tht_dacdiemnguongoc.columns = list(range(tht_dacdiemnguongoc.shape[1]))
-        for _, r in tht_dacdiemnguongoc.iterrows():
-            drug_id = _safe_int(safe_get_col(r, 0))
-            if drug_id is None:
-                continue
-            text = (
-                f"- Nguồn gốc/hóa dược: {_str(safe_get_col(r, 1))}\n"
-                f"- Quy trình/ứng dụng: {_str(safe_get_col(r, 2))}\n"
-                f"- Dạng dùng điển hình: {_str(safe_get_col(r, 3))}\n"
-                f"- Ghi chú: {_str(safe_get_col(r, 4))}"
-            )
-            drug_origin.setdefault(drug_id, []).append(text)
+        c = _StrCols(tht_dacdiemnguongoc)
+        text = (
+            "- Nguồn gốc/hóa dược: " + c[1] + "\n"
+            + "- Quy trình/ứng dụng: " + c[2] + "\n"
+            + "- Dạng dùng điển hình: " + c[3] + "\n"
+            + "- Ghi chú: " + c[4]
+        )
+        _group_texts(drug_origin, int_col(get_col(tht_dacdiemnguongoc, 0)), text)
 
     # Độc tính & cảnh báo: thuoctay_doctinh
     if tht_doctinh is not None:
         tht_doctinh.columns = list(range(tht_doctinh.shape[1]))
-        for _, r in tht_doctinh.iterrows():
-            drug_id = _safe_int(safe_get_col(r, 0))
-            if drug_id is None:
-                continue
-            text = (
-                f"- Độc tính/biến cố: {_str(safe_get_col(r, 1))}\n"
-                f"- Nhóm đối tượng cần thận trọng: {_str(safe_get_col(r, 2))}\n"
-                f"- Tương tác/ghi chú khác: {_str(safe_get_col(r, 3))}"
-            )
-            drug_toxic.setdefault(drug_id, []).append(text)
+        c = _StrCols(tht_doctinh)
+        text = (
+            "- Độc tính/biến cố: " + c[1] + "\n"
+            + "- Nhóm đối tượng cần thận trọng: " + c[2] + "\n"
+            + "- Tương tác/ghi chú khác: " + c[3]
+        )
+        _group_texts(drug_toxic, int_col(get_col(tht_doctinh, 0)), text)
 
     # Tính chất lý – hóa: thuoctay_tinhchatlyhoa
     if tht_tinhchatlyhoa is not None:
         tht_tinhchatlyhoa.columns = list(range(tht_tinhchatlyhoa.shape[1]))
-        for _, r in tht_tinhchatlyhoa.iterrows():
-            drug_id = _safe_int(safe_get_col(r, 0))
-            if drug_id is None:
-                continue
-            mp_low = _str(safe_get_col(r, 1))
-            mp_high = _str(safe_get_col(r, 2))
-            pka = _str(safe_get_col(r, 3))
-            logp = _str(safe_get_col(r, 4))
-            text = (
-                f"- Nhiệt độ nóng chảy (ước tính): {mp_low}–{mp_high}\n"
-                f"- pKa: {pka}; logP (tính thân dầu/nước): {logp}"
-            )
-            drug_physchem.setdefault(drug_id, []).append(text)
+        c = _StrCols(tht_tinhchatlyhoa)
+        text = (
+            "- Nhiệt độ nóng chảy (ước tính): " + c[1] + "–" + c[2] + "\n"
+            + "- pKa: " + c[3] + "; logP (tính thân dầu/nước): " + c[4]
+        )
+        _group_texts(drug_physchem, int_col(get_col(tht_tinhchatlyhoa, 0)), text)
 
     # --------------------------------------------------------
     # 3.3. THẢO DƯỢC: CORE + DƯỢC LỰC + DƯỢC ĐỘNG + TÍNH CHẤT
     # --------------------------------------------------------
-    dim_thaoduoc = safe_read_sheet(xlsx_path, "dim_thaoduoc", header=None)
-    thd_cochetacdong = safe_read_sheet(xlsx_path, "thaoduoc_cochetacdong", header=None)
-    thd_duocluchoc = safe_read_sheet(xlsx_path, "thaoduoc_duocluchoc", header=None)
-    thd_thoigiantacdung = safe_read_sheet(xlsx_path, "thaoduoc_thoigiantacdung", header=None)
-    thd_duocdonghoc = safe_read_sheet(xlsx_path, "thaoduoc_duocdonghoc", header=None)
-    thd_dacdiemhoahoc = safe_read_sheet(xlsx_path, "thaoduoc_dacdiemhoahoc", header=None)
-    thd_dacdiemnguongoc = safe_read_sheet(xlsx_path, "thaoduoc_dacdiemnguongoc", header=None)
-    thd_doctinh = safe_read_sheet(xlsx_path, "thaoduoc_doctinh", header=None)
-    thd_tinhchatlyhoa = safe_read_sheet(xlsx_path, "thaoduoc_tinhchatlyhoa", header=None)
+    dim_thaoduoc = sheets["dim_thaoduoc"]
+    thd_cochetacdong = sheets["thaoduoc_cochetacdong"]
+    thd_duocluchoc = sheets["thaoduoc_duocluchoc"]
+    thd_thoigiantacdung = sheets["thaoduoc_thoigiantacdung"]
+    thd_duocdonghoc = sheets["thaoduoc_duocdonghoc"]
+    thd_dacdiemhoahoc = sheets["thaoduoc_dacdiemhoahoc"]
+    thd_dacdiemnguongoc = sheets["thaoduoc_dacdiemnguongoc"]
+    thd_doctinh = sheets["thaoduoc_doctinh"]
+    thd_tinhchatlyhoa = sheets["thaoduoc_tinhchatlyhoa"]
 
     herb_core: Dict[int, Dict[str, Any]] = {}
     herb_mech: Dict[int, List[str]] = {}
@@ -268,164 +442,137 @@ def build_kb_from_excel(
     # Core: dim_thaoduoc
     if dim_thaoduoc is not None:
         dim_thaoduoc.columns = list(range(dim_thaoduoc.shape[1]))
-        for _, r in dim_thaoduoc.iterrows():
-            herb_id = _safe_int(safe_get_col(r, 0))
-            if herb_id is None:
-                continue
-
+        c = _StrCols(dim_thaoduoc)
+        ids = int_col(get_col(dim_thaoduoc, 0))
+        keep = ids.notna()
+        # KHÔNG dùng col4 (liều)
+        warning = (c[5] + " " + c[8]).str.strip()
+        for herb_id, name, formula, usage, warn, contra, ref in zip(
+            ids[keep].tolist(),
+            c[1][keep].tolist(),
+            c[2][keep].tolist(),
+            c[3][keep].tolist(),
+            warning[keep].tolist(),
+            c[6][keep].tolist(),
+            c[7][keep].tolist(),
+        ):
             herb_core[herb_id] = {
-                "herb_name": _str(safe_get_col(r, 1)),
-                "formula": _str(safe_get_col(r, 2)),
-                "usage": _str(safe_get_col(r, 3)),
-                # KHÔNG dùng col4 (liều)
-                "warning": (
-                    _str(safe_get_col(r, 5)) + " " + _str(safe_get_col(r, 8))
-                ).strip(),
-                "contra": _str(safe_get_col(r, 6)),
-                "reference": _str(safe_get_col(r, 7)),
+                "herb_name": name,
+                "formula": formula,
+                "usage": usage,
+                "warning": warn,
+                "contra": contra,
+                "reference": ref,
             }
 
     # Cơ chế tác động: thaoduoc_cochetacdong
     if thd_cochetacdong is not None:
         thd_cochetacdong.columns = list(range(thd_cochetacdong.shape[1]))
-        for _, r in thd_cochetacdong.iterrows():
-            herb_id = _safe_int(safe_get_col(r, 1))
-            if herb_id is None:
-                continue
-            mech_code = _str(safe_get_col(r, 2))
-            action = _str(safe_get_col(r, 3))
-            mech = _str(safe_get_col(r, 4))
-            text = f"- Cơ chế {mech_code}: {action}. Giải thích (theo mô tả): {mech}"
-            herb_mech.setdefault(herb_id, []).append(text)
+        c = _StrCols(thd_cochetacdong)
+        text = "- Cơ chế " + c[2] + ": " + c[3] + ". Giải thích (theo mô tả): " + c[4]
+        _group_texts(herb_mech, int_col(get_col(thd_cochetacdong, 1)), text)
 
     # Dược lực học hỗ trợ lâm sàng: thaoduoc_duocluchoc
     if thd_duocluchoc is not None:
         thd_duocluchoc.columns = list(range(thd_duocluchoc.shape[1]))
-        for _, r in thd_duocluchoc.iterrows():
-            code = safe_get_col(r, 1)
-            herb_id = _id_from_code_prefix(code)
-            if herb_id is None:
-                continue
-            eff1 = _str(safe_get_col(r, 2))
-            eff2 = _str(safe_get_col(r, 3))
-            eff3 = _str(safe_get_col(r, 4))
-            joined = "; ".join([x for x in (eff1, eff2, eff3) if x])
-            if joined:
-                text = f"- Tác dụng dược lực hỗ trợ: {joined}"
-                herb_mech.setdefault(herb_id, []).append(text)
+        c = _StrCols(thd_duocluchoc)
+        joined = _join_nonempty([c[2], c[3], c[4]], "; ")
+        has_info = joined != ""
+        text = "- Tác dụng dược lực hỗ trợ: " + joined
+        ids = id_col_from_code_prefix(get_col(thd_duocluchoc, 1))
+        _group_texts(herb_mech, ids[has_info], text[has_info])
 
     # Thời gian tác dụng: thaoduoc_thoigiantacdung
     if thd_thoigiantacdung is not None:
         thd_thoigiantacdung.columns = list(range(thd_thoigiantacdung.shape[1]))
-        for _, r in thd_thoigiantacdung.iterrows():
-            code = safe_get_col(r, 1)
-            herb_id = _id_from_code_prefix(code)
-            if herb_id is None:
-                continue
-            onset = _str(safe_get_col(r, 2))
-            duration = _str(safe_get_col(r, 3))
-            text = f"- Thời gian bắt đầu cảm nhận tác dụng: {onset}. Thời gian duy trì: {duration}"  # noqa: E501
-            herb_time.setdefault(herb_id, []).append(text)
+        c = _StrCols(thd_thoigiantacdung)
+        text = "- Thời gian bắt đầu cảm nhận tác dụng: " + c[2] + ". Thời gian duy trì: " + c[3]  # noqa: E501
+        _group_texts(herb_time, id_col_from_code_prefix(get_col(thd_thoigiantacdung, 1)), text)
 
     # Dược động học: thaoduoc_duocdonghoc
     if thd_duocdonghoc is not None:
         thd_duocdonghoc.columns = list(range(thd_duocdonghoc.shape[1]))
-        for _, r in thd_duocdonghoc.iterrows():
-            herb_id = _safe_int(safe_get_col(r, 0))
-            if herb_id is None:
-                continue
-            abs_ = _str(safe_get_col(r, 1))
-            dist = _str(safe_get_col(r, 2))
-            elim = _str(safe_get_col(r, 3))
-            note = _str(safe_get_col(r, 4))
-            text = (
-                f"- Hấp thu & phân bố: {abs_}\n"
-                f"- Thời gian/tính chất tác dụng: {dist}\n"
-                f"- Đặc điểm thải trừ/tích lũy: {elim}\n"
-                f"- Ghi chú thêm: {note}"
-            )
-            herb_pk.setdefault(herb_id, []).append(text)
+        c = _StrCols(thd_duocdonghoc)
+        text = (
+            "- Hấp thu & phân bố: " + c[1] + "\n"
+            + "- Thời gian/tính chất tác dụng: " + c[2] + "\n"
+            + "- Đặc điểm thải trừ/tích lũy: " + c[3] + "\n"
+            + "- Ghi chú thêm: " + c[4]
+        )
+        _group_texts(herb_pk, int_col(get_col(thd_duocdonghoc, 0)), text)
 
     # Đặc điểm hóa học: thaoduoc_dacdiemhoahoc
     if thd_dacdiemhoahoc is not None:
         thd_dacdiemhoahoc.columns = list(range(thd_dacdiemhoahoc.shape[1]))
-        for _, r in thd_dacdiemhoahoc.iterrows():
-            herb_id = _safe_int(safe_get_col(r, 0))
-            if herb_id is None:
-                continue
-            text = (
-                f"- Thành phần hóa học chính: {_str(safe_get_col(r, 1))}\n"
-                f"- Độ tan: {_str(safe_get_col(r, 2))}\n"
-                f"- Ổn định với nhiệt/điều kiện: {_str(safe_get_col(r, 3))}\n"
-                f"- Cách bảo quản: {_str(safe_get_col(r, 4))}"
-            )
-            herb_chem.setdefault(herb_id, []).append(text)
+        c = _StrCols(thd_dacdiemhoahoc)
+        text = (
+            "- Thành phần hóa học chính: " + c[1] + "\n"
+            + "- Độ tan: " + c[2] + "\n"
+            + "- Ổn định với nhiệt/điều kiện: " + c[3] + "\n"
+            + "- Cách bảo quản: " + c[4]
+        )
+        _group_texts(herb_chem, int_col(get_col(thd_dacdiemhoahoc, 0)), text)
 
     # Đặc điểm nguồn gốc: thaoduoc_dacdiemnguongoc
     if thd_dacdiemnguongoc is not None:
         thd_dacdiemnguongoc.columns = list(range(thd_dacdiemnguongoc.shape[1]))
-        for _, r in thd_dacdiemnguongoc.iterrows():
-            herb_id = _safe_int(safe_get_col(r, 0))
-            if herb_id is None:
-                continue
-            text = (
-                f"- Bộ phận dùng: {_str(safe_get_col(r, 1))}\n"
-                f"- Vùng trồng/điều kiện: {_str(safe_get_col(r, 2))}\n"
-                f"- Thời điểm thu hái: {_str(safe_get_col(r, 3))}\n"
-                f"- Dạng sử dụng: {_str(safe_get_col(r, 4))}"
-            )
-            herb_origin.setdefault(herb_id, []).append(text)
+        c = _StrCols(thd_dacdiemnguongoc)
+        text = (
+            "- Bộ phận dùng: " + c[1] + "\n"
+            + "- Vùng trồng/điều kiện: " + c[2] + "\n"
+            + "- Thời điểm thu hái: " + c[3] + "\n"
+            + "- Dạng sử dụng: " + c[4]
+        )
+        _group_texts(herb_origin, int_col(get_col(thd_dacdiemnguongoc, 0)), text)
 
     # Độc tính, thận trọng: thaoduoc_doctinh
     if thd_doctinh is not None:
         thd_doctinh.columns = list(range(thd_doctinh.shape[1]))
-        for _, r in thd_doctinh.iterrows():
-            herb_id = _safe_int(safe_get_col(r, 0))
-            if herb_id is None:
-                continue
-            text = (
-                f"- Độc tính/triệu chứng không mong muốn: {_str(safe_get_col(r, 1))}\n"  # noqa: E501
-                f"- Nhóm đối tượng cần thận trọng: {_str(safe_get_col(r, 2))}\n"
-                f"- Ghi chú về dữ liệu an toàn: {_str(safe_get_col(r, 3))}"
-            )
-            herb_toxic.setdefault(herb_id, []).append(text)
+        c = _StrCols(thd_doctinh)
+        text = (
+            "- Độc tính/triệu chứng không mong muốn: " + c[1] + "\n"
+            + "- Nhóm đối tượng cần thận trọng: " + c[2] + "\n"
+            + "- Ghi chú về dữ liệu an toàn: " + c[3]
+        )
+        _group_texts(herb_toxic, int_col(get_col(thd_doctinh, 0)), text)
 
     # Tính chất lý – hóa & cảm quan: thaoduoc_tinhchatlyhoa
     if thd_tinhchatlyhoa is not None:
         thd_tinhchatlyhoa.columns = list(range(thd_tinhchatlyhoa.shape[1]))
-        for _, r in thd_tinhchatlyhoa.iterrows():
-            herb_id = _safe_int(safe_get_col(r, 0))
-            if herb_id is None:
-                continue
-            text = (
-                f"- Vị, tính: {_str(safe_get_col(r, 1))}\n"
-                f"- Đặc điểm tinh dầu/kết cấu: {_str(safe_get_col(r, 2))}\n"
-                f"- Màu sắc & cảm quan: {_str(safe_get_col(r, 3))}\n"
-                f"- Độ ổn định/ảnh hưởng môi trường: {_str(safe_get_col(r, 4))}"
-            )
-            herb_physchem.setdefault(herb_id, []).append(text)
+        c = _StrCols(thd_tinhchatlyhoa)
+        text = (
+            "- Vị, tính: " + c[1] + "\n"
+            + "- Đặc điểm tinh dầu/kết cấu: " + c[2] + "\n"
+            + "- Màu sắc & cảm quan: " + c[3] + "\n"
+            + "- Độ ổn định/ảnh hưởng môi trường: " + c[4]
+        )
+        _group_texts(herb_physchem, int_col(get_col(thd_tinhchatlyhoa, 0)), text)
 
     # --------------------------------------------------------
     # 3.4. MAP BỆNH – THUỐC TÂY / THẢO DƯỢC + SURVEY
     # --------------------------------------------------------
-    map_benh_thuoctay = safe_read_sheet(xlsx_path, "map_benh_thuoctay", header=None)
-    map_benh_thaoduoc_survey = safe_read_sheet(xlsx_path, "map_benh_thaoduoc_survey", header=None)
+    map_benh_thuoctay = sheets["map_benh_thuoctay"]
+    map_benh_thaoduoc_survey = sheets["map_benh_thaoduoc_survey"]
 
     disease_to_drugs: Dict[int, List[int]] = {did: [] for did in disease_name.keys()}
     disease_to_herbs: Dict[int, List[int]] = {did: [] for did in disease_name.keys()}
+    # Tài liệu tham khảo từng dòng map, gộp theo tiêu đề/link sau khi đọc xong cả hai sheet
+    literature: List[Dict[str, Any]] = []
 
     # map_benh_thuoctay
     if map_benh_thuoctay is not None:
         map_benh_thuoctay.columns = list(range(map_benh_thuoctay.shape[1]))
-        for _, r in map_benh_thuoctay.iterrows():
-            did = _safe_int(safe_get_col(r, 0))
-            drug_id = _safe_int(safe_get_col(r, 1))
-            if did is None or drug_id is None:
-                continue
-            author = _str(safe_get_col(r, 2))
-            title = _str(safe_get_col(r, 3))
-            url = _str(safe_get_col(r, 4))
-
+        dids = int_col(get_col(map_benh_thuoctay, 0))
+        drug_ids = int_col(get_col(map_benh_thuoctay, 1))
+        keep = dids.notna() & drug_ids.notna()
+        c = _StrCols(map_benh_thuoctay)
+        for did, drug_id, author, title, url in zip(
+            dids[keep].tolist(),
+            drug_ids[keep].tolist(),
+            c[2][keep].tolist(),
+            c[3][keep].tolist(),
+            c[4][keep].tolist(),
+        ):
             if did in disease_to_drugs:
                 disease_to_drugs[did].append(drug_id)
 
@@ -458,40 +605,37 @@ def build_kb_from_excel(
                 f"- Link: {url}\n"
             )
 
-            docs.append({
-                "id": doc_id,
-                "title": f"{dname} - Thuốc tây: {ddrug_name}",
-                "type": "disease_drug",
-                "text": text,
-            })
-            doc_id += 1
-
-            lit_text = (
-                f"Tài liệu tham khảo về thuốc tây trong bối cảnh bệnh {dname}.\n"
-                f"Tác giả/nguồn: {author}\n"
-                f"Tiêu đề: {title}\n"
-                f"Link: {url}\n"
+            _append_doc(
+                docs,
+                key_counts,
+                f"disease_drug:{did}:{drug_id}",
+                f"{dname} - Thuốc tây: {ddrug_name}",
+                "disease_drug",
+                text,
+                disease_id=did,
+                drug_id=drug_id,
             )
-            docs.append({
-                "id": doc_id,
-                "title": f"Tài liệu thuốc tây: {title}",
-                "type": "literature",
-                "text": lit_text,
+
+            literature.append({
+                "author": author, "title": title, "url": url,
+                "disease_id": did, "disease": dname,
+                "drug_id": drug_id, "drug": ddrug_name,
             })
-            doc_id += 1
 
     # map_benh_thaoduoc_survey
     if map_benh_thaoduoc_survey is not None:
         map_benh_thaoduoc_survey.columns = list(range(map_benh_thaoduoc_survey.shape[1]))
-        for _, r in map_benh_thaoduoc_survey.iterrows():
-            did = _safe_int(safe_get_col(r, 0))
-            herb_id = _safe_int(safe_get_col(r, 1))
-            if did is None or herb_id is None:
-                continue
-            author = _str(safe_get_col(r, 3))
-            title = _str(safe_get_col(r, 4))
-            url = _str(safe_get_col(r, 5))
-
+        dids = int_col(get_col(map_benh_thaoduoc_survey, 0))
+        herb_ids = int_col(get_col(map_benh_thaoduoc_survey, 1))
+        keep = dids.notna() & herb_ids.notna()
+        c = _StrCols(map_benh_thaoduoc_survey)
+        for did, herb_id, author, title, url in zip(
+            dids[keep].tolist(),
+            herb_ids[keep].tolist(),
+            c[3][keep].tolist(),
+            c[4][keep].tolist(),
+            c[5][keep].tolist(),
+        ):
             if did in disease_to_herbs:
                 disease_to_herbs[did].append(herb_id)
 
@@ -528,27 +672,27 @@ def build_kb_from_excel(
                 f"- Link: {url}\n"
             )
 
-            docs.append({
-                "id": doc_id,
-                "title": f"{dname} - Thảo dược: {herb_name}",
-                "type": "disease_herb",
-                "text": text,
-            })
-            doc_id += 1
-
-            lit_text = (
-                f"Tài liệu tham khảo về thảo dược trong bối cảnh bệnh {dname}.\n"
-                f"Tác giả/nguồn: {author}\n"
-                f"Tiêu đề: {title}\n"
-                f"Link: {url}\n"
+            _append_doc(
+                docs,
+                key_counts,
+                f"disease_herb:{did}:{herb_id}",
+                f"{dname} - Thảo dược: {herb_name}",
+                "disease_herb",
+                text,
+                disease_id=did,
+                herb_id=herb_id,
             )
-            docs.append({
-                "id": doc_id,
-                "title": f"Tài liệu thảo dược: {title}",
-                "type": "literature",
-                "text": lit_text,
+
+            literature.append({
+                "author": author, "title": title, "url": url,
+                "disease_id": did, "disease": dname,
+                "herb_id": herb_id, "herb": herb_name,
             })
-            doc_id += 1
+
+    # Mỗi bài tài liệu (cùng tiêu đề hoặc cùng link) chỉ thành MỘT document,
+    # liệt kê mọi cặp bệnh – thuốc tây/thảo dược mà nó được dẫn cho
+    for key, title, text, entity_ids in _merge_literature(literature):
+        _append_doc(docs, key_counts, key, title, "literature", text, **entity_ids)
 
     # --------------------------------------------------------
     # 3.5. DOC TỔNG QUAN BỆNH
@@ -575,13 +719,15 @@ def build_kb_from_excel(
             f"Các thảo dược/bài thuốc được liên kết trong CSDL (liệt kê tên): {summary_herbs or 'Chưa có dữ liệu'}\n"  # noqa: E501
         )
 
-        docs.append({
-            "id": doc_id,
-            "title": f"Tổng quan bệnh: {dname}",
-            "type": "disease",
-            "text": text,
-        })
-        doc_id += 1
+        _append_doc(
+            docs,
+            key_counts,
+            f"disease:{did}",
+            f"Tổng quan bệnh: {dname}",
+            "disease",
+            text,
+            disease_id=did,
+        )
 
     # --------------------------------------------------------
     # 3.6. DOC CHI TIẾT TỪNG THUỐC TÂY
@@ -610,13 +756,15 @@ def build_kb_from_excel(
             f"— Tính chất lý – hóa (nhiệt độ nóng chảy, pKa, logP…):\n{physchem_text}\n"
         )
 
-        docs.append({
-            "id": doc_id,
-            "title": f"Thuốc tây: {info['drug_name']}",
-            "type": "drug",
-            "text": text,
-        })
-        doc_id += 1
+        _append_doc(
+            docs,
+            key_counts,
+            f"drug:{drug_id}",
+            f"Thuốc tây: {info['drug_name']}",
+            "drug",
+            text,
+            drug_id=drug_id,
+        )
 
     # --------------------------------------------------------
     # 3.7. DOC CHI TIẾT TỪNG THẢO DƯỢC
@@ -646,13 +794,15 @@ def build_kb_from_excel(
             f"— Tính chất lý – hóa & cảm quan:\n{physchem_text}\n"
         )
 
-        docs.append({
-            "id": doc_id,
-            "title": f"Thảo dược: {info['herb_name']}",
-            "type": "herb",
-            "text": text,
-        })
-        doc_id += 1
+        _append_doc(
+            docs,
+            key_counts,
+            f"herb:{herb_id}",
+            f"Thảo dược: {info['herb_name']}",
+            "herb",
+            text,
+            herb_id=herb_id,
+        )
 
     # --------------------------------------------------------
     # 3.8. DISCLAIMER CHUNG
@@ -664,13 +814,15 @@ def build_kb_from_excel(
         "Người dùng cần tham khảo ý kiến bác sĩ hoặc nhân viên y tế trước khi bắt đầu, thay đổi "  # noqa: E501
         "hoặc ngừng bất kỳ thuốc hay thảo dược nào."
     )
-    docs.append({
-        "id": doc_id,
-        "title": "Disclaimer y khoa chung",
-        "type": "disclaimer",
-        "text": disclaimer_text,
-    })
-    doc_id += 1
+    _append_doc(
+        docs,
+        key_counts,
+        "disclaimer",
+        "Disclaimer y khoa chung",
+        "disclaimer",
+        disclaimer_text,
+    )
 
+    docs = dedupe_docs(docs)
     print(f"✅ Đã build KB từ Excel với tổng cộng {len(docs)} documents.")
     return docs, disease_name, symptom_dict
@@ -0,0 +1,189 @@
+from __future__ import annotations
+from typing import Dict, Any, Tuple, Callable
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from config import KB_SNAPSHOT_DIR, INDEX_BACKEND, CHUNK_SECTIONS
+import metrics
+from chunking import chunk_docs
+from doc_store import DocStore
+from kb_builder import build_kb_from_excel
+from rag_index import build_index, update_index
+from providers import EMBED_MODEL_ID
+from vector_backends import BACKENDS, get_backend, make_backend
+
+SNAPSHOT_VERSION = 5
+
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def source_signature(xlsx_path: str, with_hash: bool = True) -> Dict[str, Any]:
+    """Chữ ký file Excel nguồn: mtime, size (+ sha256 nếu with_hash)."""
+    st = os.stat(xlsx_path)
+    sig: Dict[str, Any] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+    if with_hash:
+        sig["sha256"] = _file_sha256(xlsx_path)
+    return sig
+
+
+def _paths(snapshot_dir: str) -> Tuple[str, str]:
+    return os.path.join(snapshot_dir, "kb.json"), os.path.join(snapshot_dir, "embeddings.npy")
+
+
+def _backend_path(snapshot_dir: str, kind: str) -> str:
+    return os.path.join(snapshot_dir, f"backend_{kind}")
+
+
+def _is_compatible(meta: Dict[str, Any]) -> bool:
+    return (
+        meta.get("version") == SNAPSHOT_VERSION
+        and meta.get("embed_model") == EMBED_MODEL_ID
+        and meta.get("chunk_sections", False) == CHUNK_SECTIONS
+    )
+
+
+def _is_fresh(meta: Dict[str, Any], xlsx_path: str) -> bool:
+    """Snapshot còn hợp lệ? mtime+size khớp là đủ; nếu lệch thì so sha256 (file bị touch)."""
+    if not _is_compatible(meta):
+        return False
+    saved = meta.get("source", {})
+    cur = source_signature(xlsx_path, with_hash=False)
+    if cur["mtime_ns"] == saved.get("mtime_ns") and cur["size"] == saved.get("size"):
+        return True
+    return cur["size"] == saved.get("size") and _file_sha256(xlsx_path) == saved.get("sha256")
+
+
+def save_snapshot(
+    xlsx_path: str,
+    index: Dict[str, Any],
+    disease_name: Dict[int, str],
+    symptom_dict: Dict[int, Dict[str, str]],
+    snapshot_dir: str = KB_SNAPSHOT_DIR,
+) -> None:
+    """Ghi KB đã build (docs, disease_name, symptom_dict, embeddings) ra đĩa.
+
+    Documents lưu dạng DocStore (các file doc_*.npy) để lần sau memory-map lại được.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    meta_path, emb_path = _paths(snapshot_dir)
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "embed_model": EMBED_MODEL_ID,
+        "chunk_sections": CHUNK_SECTIONS,
+        "source": source_signature(xlsx_path),
+        "kb_hash": index.get("kb_hash"),
+        "doc_hashes": index.get("doc_hashes"),
+        # JSON chỉ có key dạng chuỗi -> lưu list cặp để giữ key int
+        "disease_name": list(disease_name.items()),
+        "symptom_dict": list(symptom_dict.items()),
+    }
+    tmp_emb = emb_path + ".tmp.npy"
+    tmp_meta = meta_path + ".tmp"
+    np.save(tmp_emb, np.asarray(index["embeddings"], dtype=np.float32))
+    DocStore.from_docs(index["docs"]).save(snapshot_dir)
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_emb, emb_path)
+    os.replace(tmp_meta, meta_path)
+    # Lưu trạng thái backend ANN (centroid IVF, đồ thị HNSW) để khỏi build lại khi khởi động
+    backend = get_backend(index)
+    backend_path = _backend_path(snapshot_dir, INDEX_BACKEND)
+    backend.save(backend_path)
+    if getattr(backend, "mmap_embeddings", False):
+        # Backend nén: thay embeddings float32 trong RAM bằng memory-map của file vừa ghi,
+        # re-rank đọc dòng ứng viên từ đĩa như khi nạp lại snapshot
+        mat = np.load(emb_path, mmap_mode="r")
+        if backend.load(backend_path, mat):
+            index["embeddings"] = mat
+
+
+def _read_snapshot(
+    snapshot_dir: str,
+    xlsx_path: str,
+    require_fresh: bool,
+) -> Tuple[Dict[str, Any], Dict[int, str], Dict[int, Dict[str, str]]] | None:
+    meta_path, emb_path = _paths(snapshot_dir)
+    if not (os.path.exists(meta_path) and os.path.exists(emb_path)):
+        return None
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if require_fresh and not _is_fresh(meta, xlsx_path):
+            return None
+        if not _is_compatible(meta):
+            return None
+        # Backend nén chỉ đọc dòng float32 khi re-rank -> để embeddings nằm trên đĩa (memory-map)
+        mmap = getattr(BACKENDS.get(INDEX_BACKEND), "mmap_embeddings", False)
+        mat = np.load(emb_path, mmap_mode="r" if mmap else None)
+        docs = DocStore.load(snapshot_dir, mmap=True)
+    except Exception as e:
+        print(f"⚠️ Không đọc được snapshot KB tại '{snapshot_dir}': {e}")
+        return None
+
+    if mat.shape[0] != len(docs):
+        return None
+    disease_name = {int(k): v for k, v in meta["disease_name"]}
+    symptom_dict = {int(k): v for k, v in meta["symptom_dict"]}
+    index = {
+        "docs": docs,
+        "embeddings": mat,
+        "doc_hashes": meta.get("doc_hashes"),
+        "kb_hash": meta.get("kb_hash"),
+    }
+    backend = make_backend(INDEX_BACKEND)
+    if backend.load(_backend_path(snapshot_dir, INDEX_BACKEND), mat):
+        index["backend"] = backend
+    return index, disease_name, symptom_dict
+
+
+@metrics.timed("load_snapshot")
+def load_snapshot(
+    xlsx_path: str,
+    snapshot_dir: str = KB_SNAPSHOT_DIR,
+) -> Tuple[Dict[str, Any], Dict[int, str], Dict[int, Dict[str, str]]] | None:
+    """Đọc snapshot nếu còn khớp với file Excel; trả về None nếu thiếu/cũ/hỏng."""
+    return _read_snapshot(snapshot_dir, xlsx_path, require_fresh=True)
+
+
+def load_or_build_kb(
+    xlsx_path: str,
+    snapshot_dir: str | None = KB_SNAPSHOT_DIR,
+    embed_content: Callable[..., Any] | None = None,
+) -> Tuple[Dict[str, Any], Dict[int, str], Dict[int, Dict[str, str]]]:
+    """Dùng snapshot nếu Excel chưa đổi; ngược lại build lại KB và ghi snapshot mới.
+
+    Khi Excel đã đổi, index cũ trong snapshot được cập nhật tăng dần (update_index):
+    chỉ document thêm mới/thay đổi mới bị embed lại.
+    Trả về (index, disease_name, symptom_dict); index["docs"] là DocStore.
+    """
+    previous = None
+    if snapshot_dir:
+        loaded = load_snapshot(xlsx_path, snapshot_dir)
+        if loaded is not None:
+            print(f"⚡ Dùng snapshot KB ({len(loaded[0]['docs'])} documents) – Excel không đổi.")
+            return loaded
+        previous = _read_snapshot(snapshot_dir, xlsx_path, require_fresh=False)
+
+    docs, disease_name, symptom_dict = build_kb_from_excel(xlsx_path)
+    if CHUNK_SECTIONS:
+        docs = chunk_docs(docs)
+        print(f"✂️ Đã tách thành {len(docs)} documents/chunk theo mục.")
+    if previous is not None:
+        index = update_index(previous[0], docs, embed_content=embed_content)
+    else:
+        index = build_index(docs, embed_content=embed_content)
+    if snapshot_dir:
+        try:
+            save_snapshot(xlsx_path, index, disease_name, symptom_dict, snapshot_dir)
+        except Exception as e:
+            print(f"⚠️ Không ghi được snapshot KB: {e}")
+    return index, disease_name, symptom_dict
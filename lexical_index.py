@@ -0,0 +1,195 @@
+from __future__ import annotations
+from typing import Dict, Any, List, Tuple
+import json
+import math
+import os
+import re
+import unicodedata
+
+import numpy as np
+
+from vector_backends import top_k_indices
+
+# Tiền tố cho token đã bỏ dấu, để "dau" (gõ không dấu) khớp được "đau", "dầu"...
+FOLD_PREFIX = "~"
+_MAX_NAME_TOKENS = 8
+
+
+def fold_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt: 'Đau đầu' -> 'Dau dau'."""
+    text = text.replace("đ", "d").replace("Đ", "D")
+    nfd = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in nfd if unicodedata.category(ch) != "Mn")
+
+
+def tokenize(text: str) -> List[str]:
+    """Tách token giống symptoms._normalize_tokens nhưng giữ thứ tự và số lần xuất hiện."""
+    text = unicodedata.normalize("NFC", text.lower())
+    text = re.sub(r"[^0-9a-zA-ZÀ-ỹà-ỹ\s]", " ", text)
+    return [t for t in text.split() if t]
+
+
+def doc_terms(tokens: List[str]) -> List[str]:
+    """Term để index: token gốc, thêm dạng bỏ dấu (có tiền tố) cho token có dấu."""
+    terms = list(tokens)
+    for t in tokens:
+        folded = fold_diacritics(t)
+        if folded != t:
+            terms.append(FOLD_PREFIX + folded)
+    return terms
+
+
+def query_terms(tokens: List[str]) -> List[str]:
+    """Token có dấu chỉ khớp đúng dấu; token không dấu khớp cả bản có dấu lẫn không dấu."""
+    terms: List[str] = []
+    for t in tokens:
+        terms.append(t)
+        if fold_diacritics(t) == t:
+            terms.append(FOLD_PREFIX + t)
+    return terms
+
+
+def _name_key(text: str) -> str:
+    return " ".join(fold_diacritics(t) for t in tokenize(text))
+
+
+class BM25Index:
+    """Chỉ mục ngược BM25 trên title + text của documents, chạy hoàn toàn local.
+
+    Trọng số BM25 của từng (term, doc) được tính sẵn lúc build, nên chấm điểm một câu hỏi
+    chỉ là cộng dồn các posting list của term trong câu hỏi.
+    Kèm bảng tên (title, phần tên sau dấu ':') để tra cứu chính xác tên thuốc/thảo dược/bệnh.
+    """
+
+    def __init__(
+        self,
+        docs: List[Dict[str, Any]],
+        k1: float = 1.5,
+        b: float = 0.75,
+        title_boost: int = 2,
+    ) -> None:
+        self.n_docs = len(docs)
+        postings: Dict[str, Dict[int, int]] = {}
+        lengths = np.zeros(self.n_docs, dtype=np.float32)
+        self.names: Dict[str, List[int]] = {}
+
+        for i, d in enumerate(docs):
+            title = d.get("title", "")
+            terms = doc_terms(tokenize(title)) * title_boost + doc_terms(tokenize(d.get("text", "")))
+            lengths[i] = len(terms)
+            for t in terms:
+                tf = postings.setdefault(t, {})
+                tf[i] = tf.get(i, 0) + 1
+
+            for name in {title, title.split(":", 1)[-1]}:
+                key = _name_key(name)
+                if key:
+                    self.names.setdefault(key, []).append(i)
+
+        avgdl = float(lengths.mean()) if self.n_docs else 0.0
+        norm = k1 * (1 - b + b * lengths / max(avgdl, 1e-9))
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for t, tf_map in postings.items():
+            rows = np.fromiter(tf_map.keys(), dtype=np.int64, count=len(tf_map))
+            tf = np.fromiter(tf_map.values(), dtype=np.float32, count=len(tf_map))
+            df = len(tf_map)
+            idf = math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+            self.postings[t] = (rows, (idf * tf * (k1 + 1) / (tf + norm[rows])).astype(np.float32))
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for t in set(query_terms(tokenize(query))):
+            posting = self.postings.get(t)
+            if posting is not None:
+                rows, weights = posting
+                scores[rows] += weights
+        return scores
+
+    def search(
+        self,
+        query: str,
+        k: int,
+        rows: np.ndarray | None = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k theo BM25 (chỉ trong rows nếu có); chỉ trả về document có điểm > 0."""
+        scores = self.scores(query)
+        if rows is not None:
+            top = top_k_indices(scores[rows], k)
+            idx = rows[top]
+        else:
+            idx = top_k_indices(scores, k)
+        idx = idx[scores[idx] > 0]
+        return scores[idx], idx
+
+    def lookup_names(self, query: str, rows: np.ndarray | None = None) -> List[int]:
+        """Document có tên xuất hiện nguyên văn (bỏ dấu, không phân biệt hoa thường) trong câu hỏi.
+
+        Tên dài hơn được ưu tiên trước. rows: chỉ giữ các document thuộc tập này.
+        """
+        tokens = [fold_diacritics(t) for t in tokenize(query)]
+        found: List[int] = []
+        seen = set()
+        for n in range(min(_MAX_NAME_TOKENS, len(tokens)), 0, -1):
+            for start in range(len(tokens) - n + 1):
+                matched = self.names.get(" ".join(tokens[start:start + n]))
+                if not matched:
+                    continue
+                for r in matched:
+                    if r not in seen:
+                        seen.add(r)
+                        found.append(r)
+        if rows is not None:
+            allowed = set(rows.tolist())
+            found = [r for r in found if r in allowed]
+        return found
+
+    def save(self, directory: str) -> None:
+        """Ghi posting list dạng phẳng (terms + offsets + rows + weights) để memory-map lại được."""
+        os.makedirs(directory, exist_ok=True)
+        terms = list(self.postings)
+        lengths = [self.postings[t][0].shape[0] for t in terms]
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        rows = np.concatenate([self.postings[t][0] for t in terms]) if terms else np.empty(0, np.int64)
+        weights = np.concatenate([self.postings[t][1] for t in terms]) if terms else np.empty(0, np.float32)
+        np.save(os.path.join(directory, "bm25_offsets.npy"), offsets)
+        np.save(os.path.join(directory, "bm25_rows.npy"), rows.astype(np.int32))
+        np.save(os.path.join(directory, "bm25_weights.npy"), weights.astype(np.float32))
+        with open(os.path.join(directory, "bm25.json"), "w", encoding="utf-8") as f:
+            json.dump({"n_docs": self.n_docs, "terms": terms, "names": self.names}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "BM25Index":
+        """Đọc BM25Index đã save; posting list là view trên mảng memory-map (không copy)."""
+        mode = "r" if mmap else None
+        with open(os.path.join(directory, "bm25.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        offsets = np.load(os.path.join(directory, "bm25_offsets.npy"))
+        rows = np.load(os.path.join(directory, "bm25_rows.npy"), mmap_mode=mode)
+        weights = np.load(os.path.join(directory, "bm25_weights.npy"), mmap_mode=mode)
+        self = cls.__new__(cls)
+        self.n_docs = meta["n_docs"]
+        self.names = meta["names"]
+        self.postings = {
+            t: (rows[offsets[i]:offsets[i + 1]], weights[offsets[i]:offsets[i + 1]])
+            for i, t in enumerate(meta["terms"])
+        }
+        return self
+
+
+def get_lexical_index(index: Dict[str, Any]) -> BM25Index:
+    """BM25Index của index, build lần đầu khi cần rồi giữ trong index["lexical"]."""
+    lexical = index.get("lexical")
+    if lexical is None:
+        lexical = BM25Index(index["docs"])
+        index["lexical"] = lexical
+    return lexical
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """Gộp nhiều danh sách xếp hạng bằng RRF: điểm = tổng 1 / (k + hạng)."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
@@ -1,9 +1,8 @@
 import sys
 
 from config import EXCEL_PATH, init_genai
-from kb_builder import build_kb_from_excel
-from rag_index import build_index
-from chat_rag import answer_with_rag
+from kb_snapshot import load_or_build_kb
+from chat_rag import get_chat_engine
 from prompts import EXAMPLE_QUESTIONS
 
 
@@ -18,15 +17,14 @@ def main() -> None:
         print("❌ Lỗi cấu hình GenAI:", e)
         sys.exit(1)
 
-    # 2) Build KB từ Excel
+    # 2) + 3) Build KB từ Excel và index (hoặc nạp snapshot nếu Excel không đổi)
     try:
-        kb_docs, disease_name, symptom_dict = build_kb_from_excel(EXCEL_PATH)
+        index, disease_name, symptom_dict = load_or_build_kb(EXCEL_PATH)
     except Exception as e:
         print("❌ Lỗi build KB:", e)
         sys.exit(1)
 
-    # 3) Build index
-    index = build_index(kb_docs)
+    engine = get_chat_engine()
 
     # 4) Demo câu hỏi mẫu
     print("🧪 Một vài câu hỏi mẫu (prompt) bạn có thể thử:")
@@ -49,13 +47,16 @@ def main() -> None:
             break
 
         print("🤖 AI đang suy nghĩ...\n")
+        print("AI: ", end="", flush=True)
         try:
-            ans = answer_with_rag(q, index, disease_name, symptom_dict)
+            # In từng đoạn ngay khi model trả về
+            for chunk in engine.answer_stream(q, index, disease_name, symptom_dict):
+                print(chunk, end="", flush=True)
         except Exception as e:
-            print("❌ Lỗi khi gọi API:", repr(e))
+            print("\n❌ Lỗi khi gọi API:", repr(e))
             continue
 
-        print("AI:", ans)
+        print()
         print("-" * 60)
 
 
@@ -0,0 +1,279 @@
+"""Đo thời gian từng giai đoạn của pipeline + counter/histogram, chạy hoàn toàn trong process.
+
+    with metrics.stage("retrieve"):       # timer -> histogram stage_seconds{stage="retrieve"}
+        ...
+    metrics.incr("answer_cache_hits")     # counter
+    metrics.observe("prompt_tokens", n)   # histogram tùy ý
+
+    with metrics.trace("ask", query=q):   # trace theo request: thời gian từng stage + các field
+        ...
+
+Khi tắt (mặc định, config.METRICS_ENABLED = False) mọi hàm trả về ngay: stage() trả về
+một context manager rỗng dùng chung, không gọi đồng hồ, không lấy lock.
+"""
+from __future__ import annotations
+from typing import Dict, Any, List, Tuple, Iterator, Callable
+from collections import deque
+from contextlib import contextmanager, nullcontext
+import bisect
+import contextvars
+import functools
+import json
+import threading
+import time
+
+from config import METRICS_ENABLED, METRICS_TRACE_FILE
+
+# Bucket (giây) cho histogram thời gian; histogram khác có thể truyền bucket riêng
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 100000)
+_RESERVOIR = 1024  # số giá trị gần nhất giữ lại để tính p50/p95/p99
+_RECENT_TRACES = 100
+
+_enabled = METRICS_ENABLED
+_NULL = nullcontext()
+_lock = threading.Lock()
+_current_trace: contextvars.ContextVar[Dict[str, Any] | None] = contextvars.ContextVar(
+    "rag_trace", default=None
+)
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # phần tử cuối: +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.recent: deque = deque(maxlen=_RESERVOIR)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def summary(self) -> Dict[str, float]:
+        values = sorted(self.recent)
+        out = {"count": self.count, "sum": self.sum}
+        for q in (50, 95, 99):
+            out[f"p{q}"] = values[min(len(values) - 1, len(values) * q // 100)] if values else 0.0
+        return out
+
+
+_counters: Dict[str, float] = {}
+_histograms: Dict[Tuple[str, str], _Histogram] = {}  # (tên, label stage hoặc "")
+_traces: deque = deque(maxlen=_RECENT_TRACES)
+
+
+def enable(on: bool = True) -> None:
+    global _enabled
+    _enabled = on
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _traces.clear()
+
+
+def incr(name: str, value: float = 1) -> None:
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+    tr = _current_trace.get()
+    if tr is not None:
+        tr["counters"][name] = tr["counters"].get(name, 0) + value
+
+
+def observe(
+    name: str,
+    value: float,
+    buckets: Tuple[float, ...] = SIZE_BUCKETS,
+    label: str = "",
+) -> None:
+    if not _enabled:
+        return
+    with _lock:
+        hist = _histograms.get((name, label))
+        if hist is None:
+            hist = _histograms[(name, label)] = _Histogram(buckets)
+        hist.observe(value)
+
+
+def record_stage(name: str, elapsed: float, tr: Dict[str, Any] | None = None) -> None:
+    """Ghi thời gian một stage đã đo sẵn (vào trace tr, hoặc trace hiện tại nếu tr là None)."""
+    if not _enabled:
+        return
+    observe("stage_seconds", elapsed, TIME_BUCKETS, label=name)
+    if tr is None:
+        tr = _current_trace.get()
+    if tr is not None:
+        tr["stages"][name] = tr["stages"].get(name, 0.0) + elapsed
+
+
+@contextmanager
+def _timed(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def stage(name: str) -> Any:
+    """Context manager đo thời gian một giai đoạn; khi tắt trả về context rỗng dùng chung."""
+    if not _enabled:
+        return _NULL
+    return _timed(name)
+
+
+def timed(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator: đo cả hàm như một stage (kiểm tra bật/tắt lúc gọi, không phải lúc import)."""
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _timed(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def annotate(**fields: Any) -> None:
+    """Gắn thêm field vào trace của request hiện tại (nếu có)."""
+    if not _enabled:
+        return
+    tr = _current_trace.get()
+    if tr is not None:
+        tr.update(fields)
+
+
+def start_trace(name: str, **fields: Any) -> Dict[str, Any] | None:
+    """Mở trace mà không gắn vào context hiện tại (None khi tắt); đóng bằng finish_trace.
+
+    Dành cho generator: chỉ gắn trace bằng activate() quanh các đoạn không yield, để contextvar
+    không bị giữ qua yield (lọt sang context của caller, không được reset khi caller dừng sớm).
+    """
+    if not _enabled:
+        return None
+    return {
+        "trace": name, "ts": time.time(), **fields, "stages": {}, "counters": {},
+        "_start": time.perf_counter(),
+    }
+
+
+def finish_trace(tr: Dict[str, Any] | None, error: BaseException | None = None) -> None:
+    if tr is None:
+        return
+    if error is not None:
+        tr["error"] = repr(error)
+    tr["total_seconds"] = time.perf_counter() - tr.pop("_start")
+    observe("request_seconds", tr["total_seconds"], TIME_BUCKETS, label=tr["trace"])
+    _emit_trace(tr)
+
+
+@contextmanager
+def _activated(tr: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    token = _current_trace.set(tr)
+    try:
+        yield tr
+    finally:
+        _current_trace.reset(token)
+
+
+def activate(tr: Dict[str, Any] | None) -> Any:
+    """Gắn trace của start_trace vào context trong khối with (không yield bên trong khối)."""
+    if tr is None:
+        return _NULL
+    return _activated(tr)
+
+
+@contextmanager
+def _traced(name: str, fields: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    tr = start_trace(name, **fields)
+    error: BaseException | None = None
+    try:
+        with _activated(tr):
+            yield tr
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        finish_trace(tr, error)
+
+
+def trace(name: str, **fields: Any) -> Any:
+    """Trace một request: gom thời gian các stage + counter phát sinh bên trong thành một bản ghi JSON."""  # noqa: E501
+    if not _enabled:
+        return _NULL
+    return _traced(name, fields)
+
+
+def _emit_trace(tr: Dict[str, Any]) -> None:
+    with _lock:
+        _traces.append(tr)
+        if METRICS_TRACE_FILE:
+            try:
+                with open(METRICS_TRACE_FILE, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(tr, ensure_ascii=False, default=str) + "\n")
+            except OSError as e:
+                print(f"⚠️ Không ghi được trace log: {e}")
+
+
+def stats() -> Dict[str, Any]:
+    """Ảnh chụp hiện tại: counters, histogram (count/sum/p50/p95/p99) theo stage, trace gần nhất."""
+    with _lock:
+        histograms: Dict[str, Any] = {}
+        for (name, label), hist in _histograms.items():
+            if label:
+                histograms.setdefault(name, {})[label] = hist.summary()
+            else:
+                histograms[name] = hist.summary()
+        return {
+            "enabled": _enabled,
+            "counters": dict(_counters),
+            "histograms": histograms,
+            "recent_traces": list(_traces)[-10:],
+        }
+
+
+def recent_traces() -> List[Dict[str, Any]]:
+    with _lock:
+        return list(_traces)
+
+
+def _prom_name(name: str) -> str:
+    return "rag_" + "".join(ch if ch.isalnum() else "_" for ch in name)
+
+
+def prometheus_text() -> str:
+    """Xuất counters + histograms theo định dạng text của Prometheus (GET /metrics)."""
+    lines: List[str] = []
+    with _lock:
+        for name, value in sorted(_counters.items()):
+            metric = _prom_name(name) + "_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        by_name: Dict[str, List[Tuple[str, _Histogram]]] = {}
+        for (name, label), hist in _histograms.items():
+            by_name.setdefault(name, []).append((label, hist))
+        for name in sorted(by_name):
+            metric = _prom_name(name)
+            lines.append(f"# TYPE {metric} histogram")
+            for label, hist in sorted(by_name[name], key=lambda x: x[0]):
+                base = f'stage="{label}",' if label else ""
+                cumulative = 0
+                for bound, count in zip(list(hist.buckets) + ["+Inf"], hist.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{base}le="{bound}"}} {cumulative}')
+                tags = f"{{{base.rstrip(',')}}}" if base else ""
+                lines.append(f"{metric}_sum{tags} {hist.sum}")
+                lines.append(f"{metric}_count{tags} {hist.count}")
+    return "\n".join(lines) + "\n"
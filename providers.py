@@ -0,0 +1,148 @@
+"""Chọn nơi tạo embedding và sinh câu trả lời (config.EMBED_PROVIDER / config.CHAT_PROVIDER).
+
+- "gemini": gọi google-generativeai như trước (cần API key, mạng)
+- "hashing": embedder local, tất định: hash token + bigram vào vector HASH_EMBED_DIM chiều
+- "echo": generator local trả lại một phần prompt sau độ trễ giả lập (ECHO_DELAY ± ECHO_JITTER)
+
+Hai stand-in local giữ đúng giao diện của genai (embed_content(model=, content=) -> {"embedding": ...};
+model.generate_content(contents, stream=) -> response có candidates/content/parts), nên phần còn lại
+của pipeline (batch, cache, retry, stream) chạy y nguyên khi benchmark/load test không có mạng.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterator, List
+from functools import lru_cache
+from types import SimpleNamespace
+import hashlib
+import math
+import random
+import time
+
+import numpy as np
+
+from config import (
+    EMBED_PROVIDER,
+    CHAT_PROVIDER,
+    EMBED_MODEL_NAME,
+    HASH_EMBED_DIM,
+    ECHO_DELAY,
+    ECHO_JITTER,
+    ECHO_CHUNK_DELAY,
+    ECHO_STREAM_CHUNKS,
+    ECHO_MAX_CHARS,
+)
+from lexical_index import tokenize, fold_diacritics
+
+EMBED_PROVIDERS = ("gemini", "hashing")
+CHAT_PROVIDERS = ("gemini", "echo")
+
+# Tên model dùng làm namespace cho cache embedding / snapshot: vector của embedder local
+# không được lẫn với vector Gemini trong cùng cache
+EMBED_MODEL_ID = EMBED_MODEL_NAME if EMBED_PROVIDER == "gemini" else f"hashing-{HASH_EMBED_DIM}"
+
+
+@lru_cache(maxsize=200_000)
+def _feature_slot(feature: str, dim: int) -> tuple:
+    # blake2b thay cho hash(): ổn định giữa các process/lần chạy (hash() bị random hóa)
+    h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    return h % dim, 1.0 if (h >> 63) & 1 else -1.0
+
+
+def hashing_embed(text: str, dim: int = HASH_EMBED_DIM) -> np.ndarray:
+    """Vector tất định cho text: token (đã bỏ dấu) + bigram, trọng số 1 + log(tf), chuẩn hóa L2."""
+    tokens = [fold_diacritics(t) for t in tokenize(text)]
+    counts: Dict[str, int] = {}
+    for feature in tokens + [a + " " + b for a, b in zip(tokens, tokens[1:])]:
+        counts[feature] = counts.get(feature, 0) + 1
+    vec = np.zeros(dim, dtype=np.float32)
+    for feature, tf in counts.items():
+        slot, sign = _feature_slot(feature, dim)
+        vec[slot] += sign * (1.0 + math.log(tf))
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm > 0 else vec
+
+
+def hashing_embed_content(model: str, content: Any, **kwargs: Any) -> Dict[str, Any]:
+    """Thay cho genai.embed_content: content là một chuỗi hoặc list chuỗi (batch)."""
+    if isinstance(content, str):
+        return {"embedding": hashing_embed(content).tolist()}
+    return {"embedding": [hashing_embed(t).tolist() for t in content]}
+
+
+def get_embed_content(provider: str = EMBED_PROVIDER) -> Callable[..., Any]:
+    """Hàm embed_content theo provider (cùng chữ ký với genai.embed_content)."""
+    if provider == "hashing":
+        return hashing_embed_content
+    if provider == "gemini":
+        import google.generativeai as genai
+
+        return genai.embed_content
+    raise ValueError(f"EMBED_PROVIDER không hợp lệ: '{provider}'. Chọn một trong: {list(EMBED_PROVIDERS)}")  # noqa: E501
+
+
+def _response(text: str) -> Any:
+    # Cùng cấu trúc response của genai mà chat_rag._response_text đọc
+    part = SimpleNamespace(text=text)
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+
+class EchoModel:
+    """Generator giả lập: không gọi mạng, trả lại đoạn cuối của prompt sau độ trễ cấu hình được.
+
+    - delay ± jitter (giây, phân phối đều): thời gian tới chunk đầu tiên
+    - chunk_delay: thêm cho mỗi chunk sau (stream=True chia câu trả lời thành stream_chunks đoạn)
+    """
+
+    def __init__(
+        self,
+        model_name: str = "echo",
+        delay: float = ECHO_DELAY,
+        jitter: float = ECHO_JITTER,
+        chunk_delay: float = ECHO_CHUNK_DELAY,
+        stream_chunks: int = ECHO_STREAM_CHUNKS,
+        max_chars: int = ECHO_MAX_CHARS,
+        seed: int | None = None,
+    ) -> None:
+        self.model_name = model_name
+        self.delay = delay
+        self.jitter = jitter
+        self.chunk_delay = chunk_delay
+        self.stream_chunks = max(1, stream_chunks)
+        self.max_chars = max_chars
+        self._rng = random.Random(seed)
+
+    def _first_delay(self) -> float:
+        return max(0.0, self.delay + self._rng.uniform(-self.jitter, self.jitter))
+
+    def _answer_text(self, contents: Any) -> str:
+        prompt = contents[-1] if isinstance(contents, (list, tuple)) else contents
+        prompt = str(prompt)
+        return f"[echo {len(prompt)} ký tự] " + prompt[-self.max_chars:]
+
+    def _pieces(self, text: str) -> List[str]:
+        size = max(1, math.ceil(len(text) / self.stream_chunks))
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def generate_content(self, contents: Any, stream: bool = False, **kwargs: Any) -> Any:
+        text = self._answer_text(contents)
+        if stream:
+            return self._stream(text)
+        time.sleep(self._first_delay() + self.chunk_delay * (len(self._pieces(text)) - 1))
+        return _response(text)
+
+    def _stream(self, text: str) -> Iterator[Any]:
+        time.sleep(self._first_delay())
+        for i, piece in enumerate(self._pieces(text)):
+            if i:
+                time.sleep(self.chunk_delay)
+            yield _response(piece)
+
+
+def make_chat_model(model_name: str, provider: str = CHAT_PROVIDER) -> Any:
+    """Model có generate_content(contents, stream=...) theo provider."""
+    if provider == "echo":
+        return EchoModel(model_name)
+    if provider == "gemini":
+        import google.generativeai as genai
+
+        return genai.GenerativeModel(model_name)
+    raise ValueError(f"CHAT_PROVIDER không hợp lệ: '{provider}'. Chọn một trong: {list(CHAT_PROVIDERS)}")  # noqa: E501
@@ -1,48 +1,569 @@
 from __future__ import annotations
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Callable
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import random
+import threading
+import time
 
 import numpy as np
-import google.generativeai as genai
 
-from config import EMBED_MODEL_NAME
+from config import (
+    EMBED_MODEL_NAME,
+    EMBED_CACHE_DIR,
+    EMBED_BATCH_SIZE,
+    EMBED_MAX_WORKERS,
+    EMBED_MAX_RETRIES,
+    QUERY_CACHE_SIZE,
+    QUERY_CACHE_DB,
+    RETRIEVAL_MODE,
+    HYBRID_CANDIDATES,
+    RRF_K,
+    QUERY_EMBED_TIMEOUT,
+    QUERY_EMBED_MAX_PENDING,
+    RETRIEVAL_TYPE_QUOTAS,
+)
+import metrics
+from doc_store import DocStore, DocView
+from providers import EMBED_MODEL_ID, get_embed_content
+from embed_cache import EmbeddingCache, QueryEmbeddingCache, text_hash
+from vector_backends import normalize_rows, get_backend, search_rows
+from lexical_index import get_lexical_index, reciprocal_rank_fusion
+from chunking import collapse_to_parents
 
+# Khi gộp chunk về document cha, lấy dư ứng viên để sau khi gộp vẫn đủ k
+COLLAPSE_OVERFETCH = 4
 
-def embed_text(text: str) -> np.ndarray:
-    out = genai.embed_content(model=EMBED_MODEL_NAME, content=text)
+
+def embed_text(text: str, embed_content: Callable[..., Any] | None = None) -> np.ndarray:
+    """Embed một đoạn text. `embed_content` mặc định theo config.EMBED_PROVIDER (có thể thay bằng hàm giả để test)."""  # noqa: E501
+    embed_content = embed_content or get_embed_content()
+    out = embed_content(model=EMBED_MODEL_NAME, content=text)
     emb = out["embedding"]
     return np.array(emb, dtype=np.float32)
 
 
-def build_index(docs: List[Dict[str, Any]]) -> Dict[str, Any]:
+# Cache embedding câu hỏi dùng chung trong process (None nếu QUERY_CACHE_SIZE = 0)
+QUERY_EMBED_CACHE: QueryEmbeddingCache | None = (
+    QueryEmbeddingCache(EMBED_MODEL_ID, QUERY_CACHE_SIZE, QUERY_CACHE_DB)
+    if QUERY_CACHE_SIZE > 0
+    else None
+)
+
+
+def embed_query(query: str, embed_content: Callable[..., Any] | None = None) -> np.ndarray:
+    """Embed câu hỏi, dùng QUERY_EMBED_CACHE để khỏi gọi API lại cho câu đã gặp."""
+    cache = QUERY_EMBED_CACHE
+    if cache is not None:
+        vec = cache.get(query)
+        if vec is not None:
+            metrics.incr("query_embed_cache_hits")
+            return vec
+    metrics.incr("query_embed_api_calls")
+    with metrics.stage("query_embed"):
+        vec = embed_text(query, embed_content=embed_content)
+    if cache is not None:
+        cache.put(query, vec)
+    return vec
+
+
+# Thread riêng để embed câu hỏi có timeout (không chặn retrieval khi API chậm/lỗi)
+_QUERY_EMBED_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="embed-query")
+# Giới hạn số lời gọi đang chờ/chạy trong pool: API chậm thì không để hàng đợi dồn lên vô hạn
+_QUERY_EMBED_SLOTS = threading.BoundedSemaphore(QUERY_EMBED_MAX_PENDING)
+
+
+def embed_query_with_timeout(
+    query: str,
+    timeout: float | None = QUERY_EMBED_TIMEOUT,
+) -> np.ndarray | None:
+    """Như embed_query nhưng trả về None nếu API lỗi hoặc chậm quá timeout giây."""
+    cache = QUERY_EMBED_CACHE
+    if cache is not None:
+        vec = cache.get(query)
+        if vec is not None:
+            metrics.incr("query_embed_cache_hits")
+            return vec
+    if not _QUERY_EMBED_SLOTS.acquire(blocking=False):
+        metrics.incr("query_embed_rejected")
+        print("⚠️ Quá nhiều lời gọi embedding câu hỏi đang chờ, chỉ dùng tìm kiếm từ khóa.")
+        return None
+    # Gọi thẳng embed_text (không qua embed_query) để không tra cache lần hai
+    metrics.incr("query_embed_api_calls")
+    future = _QUERY_EMBED_POOL.submit(embed_text, query)
+
+    def _done(f: Any) -> None:
+        _QUERY_EMBED_SLOTS.release()
+        # Lưu cache khi embed xong, kể cả khi đã quá timeout (lần hỏi sau dùng được ngay)
+        if cache is not None and not f.cancelled() and f.exception() is None:
+            cache.put(query, f.result())
+
+    future.add_done_callback(_done)
+    try:
+        with metrics.stage("query_embed_wait"):
+            return future.result(timeout=timeout)
+    except FutureTimeout:
+        # Chưa chạy thì hủy luôn; đang chạy thì để xong (kết quả vẫn vào cache)
+        future.cancel()
+        metrics.incr("query_embed_timeouts")
+        print(f"⚠️ Embedding câu hỏi quá {timeout}s, chỉ dùng tìm kiếm từ khóa.")
+    except Exception as e:
+        metrics.incr("query_embed_errors")
+        print(f"⚠️ Lỗi embedding câu hỏi ({e!r}), chỉ dùng tìm kiếm từ khóa.")
+    return None
+
+
+def _is_rate_limit_error(e: Exception) -> bool:
+    """Lỗi quota/rate-limit (HTTP 429) hoặc quá tải tạm thời thì nên thử lại."""
+    try:
+        from google.api_core import exceptions as gexc
+
+        if isinstance(e, (gexc.ResourceExhausted, gexc.TooManyRequests, gexc.ServiceUnavailable)):
+            return True
+    except ImportError:
+        pass
+    msg = str(e).lower()
+    return "429" in msg or "rate limit" in msg or "quota" in msg
+
+
+def _embed_batch(
+    texts: List[str],
+    embed_content: Callable[..., Any],
+    max_retries: int,
+    base_delay: float,
+) -> List[np.ndarray]:
+    """Embed một batch trong MỘT request, retry với exponential backoff khi bị rate-limit."""
+    attempt = 0
+    while True:
+        try:
+            out = embed_content(model=EMBED_MODEL_NAME, content=texts)
+            break
+        except Exception as e:
+            if attempt >= max_retries or not _is_rate_limit_error(e):
+                raise
+            delay = base_delay * (2 ** attempt) * (1 + random.random())
+            metrics.incr("embed_retries")
+            print(f"⏳ Bị giới hạn tốc độ embedding, thử lại sau {delay:.1f}s ({attempt + 1}/{max_retries})...")  # noqa: E501
+            time.sleep(delay)
+            attempt += 1
+
+    metrics.incr("embed_api_calls")
+    embs = out["embedding"]
+    if len(embs) != len(texts):
+        raise RuntimeError(f"API trả về {len(embs)} embedding cho {len(texts)} văn bản.")
+    return [np.array(e, dtype=np.float32) for e in embs]
+
+
+def embed_texts(
+    texts: List[str],
+    batch_size: int = EMBED_BATCH_SIZE,
+    max_workers: int = EMBED_MAX_WORKERS,
+    embed_content: Callable[..., Any] | None = None,
+    max_retries: int = EMBED_MAX_RETRIES,
+    base_delay: float = 1.0,
+) -> List[np.ndarray]:
+    """Embed nhiều văn bản: chia batch, gửi song song (giới hạn max_workers), giữ nguyên thứ tự."""  # noqa: E501
+    if not texts:
+        return []
+    embed_content = embed_content or get_embed_content()
+    batch_size = max(1, batch_size)
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+
+    def run(batch: List[str]) -> List[np.ndarray]:
+        return _embed_batch(batch, embed_content, max_retries, base_delay)
+
+    if max_workers <= 1 or len(batches) == 1:
+        results = [run(b) for b in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as pool:
+            # pool.map trả kết quả theo đúng thứ tự batch đầu vào
+            results = list(pool.map(run, batches))
+
+    return [v for batch_vecs in results for v in batch_vecs]
+
+
+def _embed_with_cache(
+    texts: List[str],
+    hashes: List[str],
+    cache_dir: str | None,
+    embed_content: Callable[..., Any] | None,
+) -> List[np.ndarray]:
+    """Embed texts, lấy từ cache trên đĩa những text đã có (theo hash) và lưu phần mới."""
+    cache = EmbeddingCache(cache_dir, EMBED_MODEL_ID) if cache_dir else None
+
+    if cache is not None:
+        vecs, missing = cache.lookup(hashes)
+    else:
+        vecs, missing = [None] * len(texts), list(range(len(texts)))
+
+    if missing:
+        print(f"ℹ️ Cần embed {len(missing)}/{len(texts)} documents (còn lại lấy từ cache).")
+    metrics.incr("embed_docs_cached", len(texts) - len(missing))
+    metrics.incr("embed_docs_new", len(missing))
+    with metrics.stage("embed_docs"):
+        new_vecs = embed_texts([texts[i] for i in missing], embed_content=embed_content)
+    for i, v in zip(missing, new_vecs):
+        vecs[i] = v
+
+    if cache is not None and missing:
+        cache.add([hashes[i] for i in missing], [vecs[i] for i in missing])
+        cache.save()
+    return vecs
+
+
+def embed_input(d: Dict[str, Any]) -> str:
+    """Text đưa đi embed: chunk (xem chunking.py) được thêm title để có tên thuốc/thảo dược + tên mục."""  # noqa: E501
+    if d.get("parent"):
+        return f"{d['title']}\n{d['text']}"
+    return d["text"]
+
+
+@metrics.timed("build_index")
+def build_index(
+    docs: List[Dict[str, Any]],
+    cache_dir: str | None = EMBED_CACHE_DIR,
+    embed_content: Callable[..., Any] | None = None,
+) -> Dict[str, Any]:
+    """Tạo index embedding; chỉ embed các document chưa có trong cache trên đĩa.
+
+    cache_dir=None để tắt cache (embed lại toàn bộ).
+    """
     print("\n🔧 Đang tạo vector index (embedding)...")
-    vecs = [embed_text(d["text"]) for d in docs]
-    mat = np.vstack(vecs)
+    docs = DocStore.from_docs(docs)
+    texts = [embed_input(d) for d in docs]
+    hashes = [text_hash(t) for t in texts]
+    vecs = _embed_with_cache(texts, hashes, cache_dir, embed_content)
+
+    mat = normalize_rows(np.vstack(vecs))
+    print(f"✅ Đã index {len(docs)} documents.\n")
+    # embeddings đã được chuẩn hóa L2 -> cosine = tích vô hướng
+    return {
+        "docs": docs,
+        "embeddings": mat,
+        "doc_hashes": hashes,
+        "kb_hash": kb_content_hash(hashes),
+    }
+
+
+def _doc_key(d: Dict[str, Any]) -> Any:
+    return d.get("key", d.get("id"))
+
+
+@metrics.timed("update_index")
+def update_index(
+    index: Dict[str, Any],
+    docs: List[Dict[str, Any]],
+    cache_dir: str | None = EMBED_CACHE_DIR,
+    embed_content: Callable[..., Any] | None = None,
+) -> Dict[str, Any]:
+    """Cập nhật index cũ theo danh sách docs mới, chỉ embed document thêm mới/thay đổi.
+
+    Document được so theo key thực thể (doc["key"]) và hash nội dung; vector của
+    document không đổi được lấy lại từ index cũ, document đã bị xóa thì bỏ đi.
+    """
+    old_docs = index["docs"]
+    old_mat = index["embeddings"]
+    old_hashes = index.get("doc_hashes") or [text_hash(embed_input(d)) for d in old_docs]
+    old_rows = {_doc_key(d): (i, h) for i, (d, h) in enumerate(zip(old_docs, old_hashes))}
+
+    docs = DocStore.from_docs(docs)
+    texts = [embed_input(d) for d in docs]
+    hashes = [text_hash(t) for t in texts]
+    keep_new: List[int] = []
+    keep_old: List[int] = []
+    changed: List[int] = []
+    added = 0
+    for i, (d, h) in enumerate(zip(docs, hashes)):
+        old = old_rows.get(_doc_key(d))
+        if old is not None and old[1] == h:
+            keep_new.append(i)
+            keep_old.append(old[0])
+        else:
+            changed.append(i)
+            added += old is None
+    removed = len(set(old_rows) - {_doc_key(d) for d in docs})
+    print(
+        f"\n🔧 Cập nhật index: {added} thêm mới, {len(changed) - added} thay đổi, "
+        f"{removed} bị xóa, {len(keep_new)} giữ nguyên."
+    )
+
+    if not docs:
+        raise ValueError("Danh sách documents rỗng, không thể tạo index.")
+    if changed:
+        new_vecs = normalize_rows(np.vstack(_embed_with_cache(
+            [texts[i] for i in changed],
+            [hashes[i] for i in changed],
+            cache_dir,
+            embed_content,
+        )))
+        dim = new_vecs.shape[1]
+    else:
+        dim = old_mat.shape[1]
+
+    mat = np.empty((len(docs), dim), dtype=np.float32)
+    if keep_new:
+        mat[keep_new] = old_mat[keep_old]
+    if changed:
+        mat[changed] = new_vecs
     print(f"✅ Đã index {len(docs)} documents.\n")
-    return {"docs": docs, "embeddings": mat}
+    return {
+        "docs": docs,
+        "embeddings": mat,
+        "doc_hashes": hashes,
+        "kb_hash": kb_content_hash(hashes),
+    }
+
+
+def kb_content_hash(doc_hashes: List[str]) -> str:
+    """Hash toàn bộ nội dung KB (từ hash từng document), đổi khi bất kỳ doc nào đổi."""
+    return text_hash("\n".join(doc_hashes))
 
 
 def cosine_sim(a: np.ndarray, b: np.ndarray) -> float:
     return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-9))
 
 
-def retrieve_top_k(query: str, index: Dict[str, Any], k: int = 4) -> List[Dict[str, Any]]:
-    q_vec = embed_text(query)
-    sims: List[Tuple[float, int]] = []
-    for i, emb in enumerate(index["embeddings"]):
-        sims.append((cosine_sim(q_vec, emb), i))
-    sims.sort(key=lambda x: x[0], reverse=True)
-    top = sims[:k]
-    results: List[Dict[str, Any]] = []
-    for score, idx in top:
-        d = index["docs"][idx]
-        results.append({
-            "score": score,
-            "id": d.get("id"),
-            "title": d.get("title", ""),
-            "type": d.get("type", ""),
-            "text": d.get("text", ""),
-        })
-    return results
+def search_vectors(
+    q_vecs: np.ndarray,
+    index: Dict[str, Any],
+    k: int = 4,
+    rows: np.ndarray | None = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Chấm điểm một (dim,) hoặc một batch (n_query, dim) vector qua backend của index.
+
+    Backend chọn theo config.INDEX_BACKEND ('exact' = một phép nhân ma trận, 'ivf'/'hnsw' = ANN).
+    rows: chỉ chấm điểm tập dòng này (đã lọc theo metadata), quét chính xác trên tập con.
+    Trả về (scores, indices) cùng shape (..., k).
+    """
+    q = normalize_rows(q_vecs)
+    single = q.ndim == 1
+    q2d = q[None, :] if single else q
+    with metrics.stage("vector_search"):
+        if rows is not None:
+            scores, idx = search_rows(index["embeddings"], q2d, rows, k)
+        else:
+            scores, idx = get_backend(index).search(q2d, k)
+    n_scored = len(rows) if rows is not None else index["embeddings"].shape[0]
+    metrics.incr("docs_scored", n_scored * q2d.shape[0])
+    return (scores[0], idx[0]) if single else (scores, idx)
+
+
+def filter_rows(index: Dict[str, Any], filters: Dict[str, Any] | None) -> np.ndarray | None:
+    """Tập dòng thỏa filters {"types": [...], "disease_id", "drug_id", "herb_id"}; None = không lọc."""
+    if not filters:
+        return None
+    return DocStore.from_docs(index["docs"]).filter_rows(**filters)
+
+
+def _apply_quotas(
+    index: Dict[str, Any],
+    scores: np.ndarray,
+    idxs: np.ndarray,
+    k: int,
+    quotas: Dict[str, int] | None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Giữ thứ tự xếp hạng nhưng bỏ document vượt quota của type nó, lấy đủ k."""
+    if not quotas:
+        return scores[:k], idxs[:k]
+    store = DocStore.from_docs(index["docs"])
+    # Quota theo mã type để khỏi decode chuỗi
+    limits = {c: quotas[t] for c, t in enumerate(store.type_names) if t in quotas}
+    used: Dict[int, int] = {}
+    keep: List[int] = []
+    for pos, row in enumerate(idxs.tolist()):
+        code = int(store.type_codes[row])
+        if code in limits:
+            if used.get(code, 0) >= limits[code]:
+                continue
+            used[code] = used.get(code, 0) + 1
+        keep.append(pos)
+        if len(keep) == k:
+            break
+    return scores[keep], idxs[keep]
+
+
+def _results_from_hits(
+    index: Dict[str, Any],
+    scores: np.ndarray,
+    idxs: np.ndarray,
+) -> List[DocView]:
+    """Kết quả là DocView (đọc như dict có thêm "score"), không copy nội dung document."""
+    store = DocStore.from_docs(index["docs"])
+    return [store.view(i, score) for score, i in zip(scores.tolist(), idxs.tolist())]
+
+
+def _bm25_rankings(query: str, index: Dict[str, Any], rows: np.ndarray | None) -> List[List[int]]:
+    """Xếp hạng theo tên khớp chính xác (nếu có) và BM25, dùng chung cho hybrid/lexical."""
+    lexical = get_lexical_index(index)
+    rankings: List[List[int]] = []
+    with metrics.stage("bm25"):
+        name_rows = lexical.lookup_names(query, rows=rows)
+        if name_rows:
+            rankings.append(name_rows)
+        _, bm25_idx = lexical.search(query, HYBRID_CANDIDATES, rows=rows)
+        rankings.append(bm25_idx.tolist())
+    return rankings
+
+
+def _fuse(
+    index: Dict[str, Any],
+    rankings: List[List[int]],
+    k: int,
+    quotas: Dict[str, int] | None,
+) -> List[Dict[str, Any]]:
+    fused = reciprocal_rank_fusion(rankings, k=RRF_K)
+    scores = np.array([s for _, s in fused], dtype=np.float32)
+    idxs = np.array([r for r, _ in fused], dtype=np.int64)
+    return _results_from_hits(index, *_apply_quotas(index, scores, idxs, k, quotas))
+
+
+def retrieve_top_k(
+    query: str,
+    index: Dict[str, Any],
+    k: int = 4,
+    q_vec: np.ndarray | None = None,
+    filters: Dict[str, Any] | None = None,
+    quotas: Dict[str, int] | None = None,
+) -> List[Dict[str, Any]]:
+    """Top-k document cho câu hỏi; truyền q_vec nếu đã có embedding của câu hỏi.
+
+    filters: chỉ chấm điểm các document thỏa điều kiện (xem filter_rows).
+    quotas: {type: số tối đa} trong top-k, vd {"literature": 1}.
+    """
+    if q_vec is None:
+        q_vec = embed_query(query)
+    rows = filter_rows(index, filters)
+    n_cand = max(k, HYBRID_CANDIDATES) if quotas else k
+    scores, idxs = search_vectors(q_vec, index, n_cand, rows=rows)
+    return _results_from_hits(index, *_apply_quotas(index, scores, idxs, k, quotas))
+
+
+def retrieve_lexical(
+    query: str,
+    index: Dict[str, Any],
+    k: int = 4,
+    filters: Dict[str, Any] | None = None,
+    quotas: Dict[str, int] | None = None,
+) -> List[Dict[str, Any]]:
+    """Chỉ dùng BM25 + tra tên chính xác, không gọi API."""
+    return retrieve_hybrid(query, index, k=k, use_vector=False, filters=filters, quotas=quotas)
+
+
+def retrieve_hybrid(
+    query: str,
+    index: Dict[str, Any],
+    k: int = 4,
+    q_vec: np.ndarray | None = None,
+    use_vector: bool = True,
+    filters: Dict[str, Any] | None = None,
+    quotas: Dict[str, int] | None = None,
+    embed_attempted: bool = False,
+) -> List[Dict[str, Any]]:
+    """Gộp xếp hạng vector + BM25 (+ tên khớp chính xác) bằng Reciprocal Rank Fusion.
+
+    Nếu không lấy được embedding câu hỏi (API lỗi/chậm) thì tự rơi về chỉ BM25.
+    embed_attempted=True: caller đã thử embed (q_vec None = thất bại), không gọi API lần nữa.
+    Điểm "score" trả về là điểm RRF.
+    """
+    rows = filter_rows(index, filters)
+    rankings = _bm25_rankings(query, index, rows)
+
+    if use_vector:
+        if q_vec is None and not embed_attempted:
+            q_vec = embed_query_with_timeout(query)
+        if q_vec is not None:
+            _, vec_idx = search_vectors(q_vec, index, HYBRID_CANDIDATES, rows=rows)
+            rankings.append(vec_idx.tolist())
+    return _fuse(index, rankings, k, quotas)
+
+
+def retrieve(
+    query: str,
+    index: Dict[str, Any],
+    k: int = 4,
+    q_vec: np.ndarray | None = None,
+    filters: Dict[str, Any] | None = None,
+    quotas: Dict[str, int] | None = RETRIEVAL_TYPE_QUOTAS,
+    collapse: bool = False,
+    mode: str = RETRIEVAL_MODE,
+    embed_attempted: bool = False,
+) -> List[Dict[str, Any]]:
+    """Retrieve theo mode (mặc định config.RETRIEVAL_MODE): "vector", "lexical" hoặc "hybrid".
+
+    Mặc định áp quota theo config.RETRIEVAL_TYPE_QUOTAS (truyền quotas=None để tắt).
+    collapse=True: gộp các chunk (mục) cùng document cha thành document đầy đủ.
+    embed_attempted=True và q_vec None: embedding câu hỏi đã lỗi/quá timeout ở bước trước,
+    chỉ dùng BM25 thay vì gọi API lần nữa.
+    """
+    n = k * COLLAPSE_OVERFETCH if collapse else k
+    if embed_attempted and q_vec is None and mode != "lexical":
+        mode = "lexical"
+    if mode == "vector":
+        results = retrieve_top_k(query, index, k=n, q_vec=q_vec, filters=filters, quotas=quotas)
+    elif mode == "lexical":
+        results = retrieve_lexical(query, index, k=n, filters=filters, quotas=quotas)
+    else:
+        results = retrieve_hybrid(query, index, k=n, q_vec=q_vec, filters=filters, quotas=quotas)
+    return collapse_to_parents(results, index, k) if collapse else results
+
+
+def embed_queries(
+    queries: List[str],
+    embed_content: Callable[..., Any] | None = None,
+) -> np.ndarray:
+    """Embed nhiều câu hỏi theo batch (qua embed_texts), dùng QUERY_EMBED_CACHE cho câu đã gặp.
+
+    Trả về ma trận (n_query, dim) theo đúng thứ tự queries.
+    """
+    cache = QUERY_EMBED_CACHE
+    q_vecs: List[np.ndarray | None] = [
+        cache.get(q) if cache is not None else None for q in queries
+    ]
+    missing = [i for i, v in enumerate(q_vecs) if v is None]
+    metrics.incr("query_embed_cache_hits", len(queries) - len(missing))
+    with metrics.stage("query_embed"):
+        new_vecs = embed_texts([queries[i] for i in missing], embed_content=embed_content)
+    for i, v in zip(missing, new_vecs):
+        q_vecs[i] = v
+        if cache is not None:
+            cache.put(queries[i], v)
+    return np.vstack(q_vecs)
+
+
+def retrieve_batch(
+    queries: List[str],
+    index: Dict[str, Any],
+    k: int = 4,
+    q_mat: np.ndarray | None = None,
+    quotas: Dict[str, int] | None = RETRIEVAL_TYPE_QUOTAS,
+    mode: str = RETRIEVAL_MODE,
+) -> List[List[Dict[str, Any]]]:
+    """Như retrieve() cho nhiều câu hỏi: phần vector của cả batch chấm điểm bằng một lần search_vectors.
+
+    q_mat: embedding (n_query, dim) của queries (xem embed_queries); None = chỉ BM25.
+    BM25 / RRF / quota vẫn chạy theo từng câu như retrieve().
+    """
+    if not queries:
+        return []
+    use_vector = mode != "lexical" and q_mat is not None
+    vec_idxs = None
+    if use_vector:
+        # Cùng số ứng viên vector như retrieve_hybrid / retrieve_top_k
+        n_cand = HYBRID_CANDIDATES
+        if mode == "vector" and not quotas:
+            n_cand = k
+        vec_scores, vec_idxs = search_vectors(q_mat, index, max(k, n_cand))
+
+    out: List[List[Dict[str, Any]]] = []
+    for i, query in enumerate(queries):
+        if mode == "vector" and use_vector:
+            hits = _apply_quotas(index, vec_scores[i], vec_idxs[i], k, quotas)
+            out.append(_results_from_hits(index, *hits))
+            continue
+        rankings = _bm25_rankings(query, index, None)
+        if use_vector:
+            rankings.append(vec_idxs[i].tolist())
+        out.append(_fuse(index, rankings, k, quotas))
+    return out
 
 
 def build_context_snippet(docs: List[Dict[str, Any]]) -> str:
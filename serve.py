@@ -0,0 +1,271 @@
+"""HTTP server asyncio (chỉ dùng thư viện chuẩn) cho chatbot RAG.
+
+Nạp KB + index MỘT lần, phục vụ nhiều request đồng thời:
+    POST /ask     body JSON {"question": "..."} -> {"answer": "..."}
+    GET  /health  -> {"status": "ok", "docs": N}
+    GET  /stats   -> thời gian từng stage, counter, trace gần nhất (JSON; cần --metrics)
+    GET  /metrics -> như /stats, định dạng text của Prometheus
+
+Phần việc blocking (retrieve + gọi LLM) chạy trong thread pool có giới hạn;
+quá SERVER_MAX_PENDING request đang chờ thì trả 503 ngay, quá thời gian thì trả 504.
+
+Với --processes N (> 1): process cha build/nạp KB một lần, export ra SHARED_INDEX_DIR
+(embeddings .npy, DocStore, BM25 dạng memory-map), rồi N process con gắn vào read-only
+và cùng lắng nghe một cổng (SO_REUSEPORT). RAM cho index không tăng theo số process.
+"""
+from __future__ import annotations
+from typing import Dict, Any, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import asyncio
+import json
+import multiprocessing
+import sys
+
+import metrics
+from config import (
+    EXCEL_PATH,
+    SERVER_HOST,
+    SERVER_PORT,
+    SERVER_WORKERS,
+    SERVER_MAX_PENDING,
+    SERVER_REQUEST_TIMEOUT,
+    SERVER_MAX_BODY,
+    SERVER_PROCESSES,
+    SHARED_INDEX_DIR,
+    init_genai,
+)
+from kb_snapshot import load_or_build_kb
+from chat_rag import get_chat_engine
+from context_builder import get_section_index
+from lexical_index import get_lexical_index
+from shared_index import export_shared_index, attach_shared_index
+from symptoms import get_symptom_index
+from vector_backends import get_backend
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+
+class ChatServer:
+    """Giữ KB/index dùng chung và xử lý các request /ask."""
+
+    def __init__(
+        self,
+        index: Dict[str, Any],
+        disease_name: Dict[int, str],
+        symptom_dict: Dict[int, Dict[str, str]],
+        workers: int = SERVER_WORKERS,
+        max_pending: int = SERVER_MAX_PENDING,
+        request_timeout: float = SERVER_REQUEST_TIMEOUT,
+    ) -> None:
+        self.index = index
+        self.disease_name = disease_name
+        self.symptom_dict = symptom_dict
+        self.engine = get_chat_engine()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ask")
+        self.max_pending = max_pending
+        self.request_timeout = request_timeout
+        self.pending = 0
+
+        # Build sẵn các index phụ để các thread không build trùng ở request đầu tiên
+        get_backend(index)
+        get_lexical_index(index)
+        get_section_index(index)
+        get_symptom_index(symptom_dict)
+
+    def _answer(self, question: str) -> str:
+        return self.engine.answer(question, self.index, self.disease_name, self.symptom_dict)
+
+    async def ask(self, question: str) -> Tuple[int, Dict[str, Any]]:
+        # pending đếm cả việc đã quá timeout nhưng thread vẫn đang chạy
+        if self.pending >= self.max_pending:
+            return 503, {"error": "Máy chủ đang quá tải, vui lòng thử lại sau."}
+        self.pending += 1
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(self.executor, self._answer, question)
+        fut.add_done_callback(self._release)
+        try:
+            answer = await asyncio.wait_for(asyncio.shield(fut), timeout=self.request_timeout)
+            return 200, {"answer": answer}
+        except asyncio.TimeoutError:
+            return 504, {"error": f"Quá thời gian xử lý ({self.request_timeout}s)."}
+        except Exception as e:
+            return 500, {"error": repr(e)}
+
+    def _release(self, fut: "asyncio.Future[str]") -> None:
+        self.pending -= 1
+        if not fut.cancelled():
+            # Đọc exception để asyncio không cảnh báo "exception was never retrieved"
+            fut.exception()
+
+    async def route(self, method: str, path: str, body: bytes) -> Tuple[int, Union[Dict[str, Any], str]]:  # noqa: E501
+        if path == "/health":
+            return 200, {"status": "ok", "docs": len(self.index["docs"]), "pending": self.pending}
+        if path == "/stats":
+            return 200, metrics.stats()
+        if path == "/metrics":
+            # str -> trả về dạng text/plain
+            return 200, metrics.prometheus_text()
+        if path != "/ask":
+            return 404, {"error": "Không tìm thấy endpoint."}
+        if method != "POST":
+            return 405, {"error": "Dùng POST /ask."}
+        try:
+            payload = json.loads(body.decode("utf-8") or "{}")
+            question = str(payload.get("question", "")).strip()
+        except (ValueError, AttributeError):
+            return 400, {"error": "Body phải là JSON dạng {\"question\": \"...\"}."}
+        if not question:
+            return 400, {"error": "Thiếu trường 'question'."}
+        return await self.ask(question)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            status, payload = await self._read_and_route(reader)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        except ValueError:
+            status, payload = 400, {"error": "Header Content-Length không hợp lệ."}
+        if isinstance(payload, str):
+            body = payload.encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode("ascii")
+        try:
+            writer.write(head + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _read_and_route(self, reader: asyncio.StreamReader) -> Tuple[int, Union[Dict[str, Any], str]]:  # noqa: E501
+        request_line = await asyncio.wait_for(reader.readline(), timeout=30)
+        parts = request_line.decode("latin-1").split()
+        if len(parts) < 2:
+            return 400, {"error": "Request không hợp lệ."}
+        method, path = parts[0].upper(), parts[1].split("?", 1)[0]
+
+        headers: Dict[str, str] = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=30)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", "0") or 0)
+        if length > SERVER_MAX_BODY:
+            return 413, {"error": "Body quá lớn."}
+        body = await asyncio.wait_for(reader.readexactly(length), timeout=30) if length else b""
+        return await self.route(method, path, body)
+
+
+async def run_server(server: ChatServer, host: str, port: int, reuse_port: bool = False) -> None:
+    srv = await asyncio.start_server(server.handle, host, port, reuse_port=reuse_port or None)
+    print(f"🌐 Đang phục vụ tại http://{host}:{port} (POST /ask, GET /health)")
+    async with srv:
+        await srv.serve_forever()
+
+
+def _worker_main(shared_dir: str, host: str, port: int, with_metrics: bool = False) -> None:
+    """Process con: gắn vào index dùng chung (không build lại) rồi phục vụ trên cổng chung."""
+    metrics.enable(with_metrics)
+    try:
+        init_genai()
+        index, disease_name, symptom_dict = attach_shared_index(shared_dir)
+    except Exception as e:
+        print("❌ Process con không khởi động được:", e)
+        sys.exit(1)
+    server = ChatServer(index, disease_name, symptom_dict)
+    try:
+        asyncio.run(run_server(server, host, port, reuse_port=True))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_multiprocess(
+    index: Dict[str, Any],
+    disease_name: Dict[int, str],
+    symptom_dict: Dict[int, Dict[str, str]],
+    host: str,
+    port: int,
+    processes: int,
+    shared_dir: str = SHARED_INDEX_DIR,
+) -> None:
+    """Mỗi process con có metrics riêng: /stats, /metrics phản ánh process nhận request đó."""
+    export_shared_index(index, disease_name, symptom_dict, shared_dir)
+    print(f"📦 Đã export index dùng chung vào '{shared_dir}', khởi động {processes} process...")
+    # spawn: process con không thừa hưởng heap của cha, chỉ map file index read-only
+    ctx = multiprocessing.get_context("spawn")
+    workers = [
+        ctx.Process(
+            target=_worker_main,
+            args=(shared_dir, host, port, metrics.enabled()),
+            daemon=True,
+        )
+        for _ in range(processes)
+    ]
+    for w in workers:
+        w.start()
+    try:
+        for w in workers:
+            w.join()
+    except KeyboardInterrupt:
+        for w in workers:
+            w.terminate()
+        print("\nThoát.")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="HTTP server cho chatbot RAG.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--processes", type=int, default=SERVER_PROCESSES)
+    parser.add_argument("--metrics", action="store_true", help="Bật đo thời gian/counter (GET /stats, /metrics)")  # noqa: E501
+    args = parser.parse_args()
+    if args.metrics:
+        metrics.enable()
+
+    try:
+        init_genai()
+    except Exception as e:
+        print("❌ Lỗi cấu hình GenAI:", e)
+        sys.exit(1)
+
+    try:
+        index, disease_name, symptom_dict = load_or_build_kb(EXCEL_PATH)
+    except Exception as e:
+        print("❌ Lỗi build KB:", e)
+        sys.exit(1)
+
+    if args.processes > 1:
+        run_multiprocess(index, disease_name, symptom_dict, args.host, args.port, args.processes)
+        return
+
+    server = ChatServer(index, disease_name, symptom_dict)
+    try:
+        asyncio.run(run_server(server, args.host, args.port))
+    except KeyboardInterrupt:
+        print("\nThoát.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+from __future__ import annotations
+from typing import Dict, Any, Tuple
+import json
+import os
+import shutil
+
+import numpy as np
+
+from config import INDEX_BACKEND, SHARED_INDEX_DIR
+from doc_store import DocStore
+from lexical_index import BM25Index, get_lexical_index
+from vector_backends import get_backend, make_backend
+
+# Tăng khi đổi định dạng thư mục dùng chung
+SHARED_VERSION = 3
+
+
+def export_shared_index(
+    index: Dict[str, Any],
+    disease_name: Dict[int, str],
+    symptom_dict: Dict[int, Dict[str, str]],
+    shared_dir: str = SHARED_INDEX_DIR,
+) -> None:
+    """Ghi index ra thư mục dạng memory-map được để nhiều process gắn vào read-only.
+
+    Gồm: ma trận embeddings đã chuẩn hóa (.npy), DocStore, BM25 dạng phẳng,
+    trạng thái backend ANN và disease_name/symptom_dict (JSON).
+    Ghi vào thư mục tạm rồi đổi tên, nên process khác không bao giờ thấy bản ghi dở.
+    """
+    tmp_dir = shared_dir.rstrip("/\\") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    np.save(os.path.join(tmp_dir, "embeddings.npy"), np.asarray(index["embeddings"], dtype=np.float32))
+    DocStore.from_docs(index["docs"]).save(tmp_dir)
+    get_lexical_index(index).save(tmp_dir)
+    get_backend(index).save(os.path.join(tmp_dir, f"backend_{INDEX_BACKEND}"))
+    meta = {
+        "version": SHARED_VERSION,
+        "kb_hash": index.get("kb_hash"),
+        "doc_hashes": index.get("doc_hashes"),
+        # JSON chỉ có key dạng chuỗi -> lưu list cặp để giữ key int
+        "disease_name": list(disease_name.items()),
+        "symptom_dict": list(symptom_dict.items()),
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    shutil.rmtree(shared_dir, ignore_errors=True)
+    os.replace(tmp_dir, shared_dir)
+
+
+def attach_shared_index(
+    shared_dir: str = SHARED_INDEX_DIR,
+) -> Tuple[Dict[str, Any], Dict[int, str], Dict[int, Dict[str, str]]]:
+    """Gắn read-only vào index đã export: chỉ mở file và memory-map, không build lại gì.
+
+    Các process cùng map một file dùng chung page cache của OS, nên RAM cho
+    embeddings/docs/BM25 không tăng theo số process.
+    """
+    with open(os.path.join(shared_dir, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("version") != SHARED_VERSION:
+        raise RuntimeError(f"Thư mục index dùng chung '{shared_dir}' khác phiên bản, hãy export lại.")
+
+    mat = np.load(os.path.join(shared_dir, "embeddings.npy"), mmap_mode="r")
+    docs = DocStore.load(shared_dir, mmap=True)
+    if mat.shape[0] != len(docs):
+        raise RuntimeError(f"Index dùng chung '{shared_dir}' không nhất quán (embeddings/docs).")
+
+    index: Dict[str, Any] = {
+        "docs": docs,
+        "embeddings": mat,
+        "doc_hashes": meta.get("doc_hashes"),
+        "kb_hash": meta.get("kb_hash"),
+        "lexical": BM25Index.load(shared_dir, mmap=True),
+    }
+    backend = make_backend(INDEX_BACKEND)
+    if backend.load(os.path.join(shared_dir, f"backend_{INDEX_BACKEND}"), mat):
+        index["backend"] = backend
+    disease_name = {int(k): v for k, v in meta["disease_name"]}
+    symptom_dict = {int(k): v for k, v in meta["symptom_dict"]}
+    return index, disease_name, symptom_dict
@@ -1,7 +1,9 @@
 from __future__ import annotations
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
 import re
 
+import numpy as np
+
 
 def _normalize_tokens(text: str) -> set[str]:
     text = text.lower()
@@ -10,34 +12,138 @@ def _normalize_tokens(text: str) -> set[str]:
     return set(tokens)
 
 
+class SymptomIndex:
+    """Chỉ mục ngược triệu chứng, build một lần từ symptom_dict.
+
+    - token_ids: token -> id
+    - sizes[d]: số token (khác nhau) trong mô tả triệu chứng của bệnh thứ d
+    - postings[token_id]: danh sách vị trí bệnh có chứa token đó
+    """
+
+    def __init__(self, symptom_dict: Dict[int, Dict[str, str]]) -> None:
+        self.token_ids: Dict[str, int] = {}
+        self.disease_ids: List[int] = []
+        self.sizes: List[int] = []
+        self.postings: List[List[int]] = []
+        self._flat: Tuple[np.ndarray, np.ndarray] | None = None
+
+        for did, info in symptom_dict.items():
+            sym_text = info.get("symptoms", "")
+            if not sym_text.strip():
+                continue
+            sym_tokens = _normalize_tokens(sym_text)
+            if not sym_tokens:
+                continue
+            pos = len(self.disease_ids)
+            self.disease_ids.append(did)
+            self.sizes.append(len(sym_tokens))
+            for t in sym_tokens:
+                tid = self.token_ids.get(t)
+                if tid is None:
+                    tid = len(self.postings)
+                    self.token_ids[t] = tid
+                    self.postings.append([])
+                self.postings[tid].append(pos)
+
+    def overlap_counts(self, user_tokens: set[str]) -> Dict[int, int]:
+        """Đếm số token trùng cho các bệnh có ít nhất một token chung (vị trí -> số token)."""
+        counts: Dict[int, int] = {}
+        for t in user_tokens:
+            tid = self.token_ids.get(t)
+            if tid is None:
+                continue
+            for pos in self.postings[tid]:
+                counts[pos] = counts.get(pos, 0) + 1
+        return counts
+
+    def _flat_postings(self) -> Tuple[np.ndarray, np.ndarray]:
+        """postings dạng phẳng (offsets, vị trí bệnh) cho overlap_matrix, tính một lần."""
+        flat = self._flat
+        if flat is None:
+            offsets = np.zeros(len(self.postings) + 1, dtype=np.int64)
+            np.cumsum([len(p) for p in self.postings], out=offsets[1:])
+            positions = np.fromiter(
+                (pos for p in self.postings for pos in p), dtype=np.int64, count=int(offsets[-1])
+            )
+            flat = self._flat = (offsets, positions)
+        return flat
+
+    def overlap_matrix(self, token_sets: List[set[str]]) -> np.ndarray:
+        """Số token trùng của nhiều câu hỏi cùng lúc: ma trận (số câu hỏi, số bệnh).
+
+        Gom postings của mọi token rồi đếm một lần bằng np.bincount trên (câu hỏi, bệnh).
+        """
+        offsets, positions = self._flat_postings()
+        n_d = len(self.disease_ids)
+        q_rows: List[np.ndarray] = []
+        hits: List[np.ndarray] = []
+        for qi, tokens in enumerate(token_sets):
+            tids = [self.token_ids[t] for t in tokens if t in self.token_ids]
+            if not tids:
+                continue
+            pos = np.concatenate([positions[offsets[t]:offsets[t + 1]] for t in tids])
+            hits.append(pos)
+            q_rows.append(np.full(pos.shape[0], qi, dtype=np.int64))
+        if not hits:
+            return np.zeros((len(token_sets), n_d), dtype=np.int64)
+        flat = np.concatenate(q_rows) * n_d + np.concatenate(hits)
+        return np.bincount(flat, minlength=len(token_sets) * n_d).reshape(len(token_sets), n_d)
+
+
+# Index của symptom_dict dùng gần nhất, để caller cũ không cần tự build
+_LAST_INDEX: Tuple[Dict[int, Dict[str, str]] | None, SymptomIndex | None] = (None, None)
+
+
+def get_symptom_index(symptom_dict: Dict[int, Dict[str, str]]) -> SymptomIndex:
+    """Lấy (hoặc build) SymptomIndex cho symptom_dict; build lại khi đổi sang dict khác."""
+    global _LAST_INDEX
+    cached_dict, cached_index = _LAST_INDEX
+    if cached_dict is symptom_dict and cached_index is not None:
+        return cached_index
+    sym_index = SymptomIndex(symptom_dict)
+    _LAST_INDEX = (symptom_dict, sym_index)
+    return sym_index
+
+
 def find_symptom_matches(
     user_text: str,
     disease_name: Dict[int, str],
     symptom_dict: Dict[int, Dict[str, str]],
     min_score: float = 0.9,
     max_results: int = 5,
+    sym_index: SymptomIndex | None = None,
 ) -> List[Dict[str, Any]]:
-    """So khớp triệu chứng đơn giản dựa trên trùng lặp token."""
+    """So khớp triệu chứng đơn giản dựa trên trùng lặp token.
+
+    score = số token trùng / số token triệu chứng của bệnh. Chỉ các bệnh có chung
+    ít nhất một token với câu hỏi mới được chấm điểm (qua chỉ mục ngược).
+    """
     user_tokens = _normalize_tokens(user_text)
     if not user_tokens:
         return []
+    if sym_index is None:
+        sym_index = get_symptom_index(symptom_dict)
+
+    counts = sym_index.overlap_counts(user_tokens)
+    if min_score <= 0:
+        # Ngưỡng 0 thì cả bệnh không trùng token nào cũng đạt
+        candidates = range(len(sym_index.disease_ids))
+    else:
+        # Duyệt theo thứ tự gốc của symptom_dict để thứ tự khi bằng điểm không đổi
+        candidates = sorted(counts)
 
     matches: List[Dict[str, Any]] = []
-    for did, info in symptom_dict.items():
-        sym_text = info.get("symptoms", "")
-        if not sym_text.strip():
-            continue
-        sym_tokens = _normalize_tokens(sym_text)
-        if not sym_tokens:
-            continue
-        inter = user_tokens.intersection(sym_tokens)
-        score = len(inter) / max(1, len(sym_tokens))
+    for pos in candidates:
+        inter = counts.get(pos, 0)
+        score = inter / max(1, sym_index.sizes[pos])
         if score >= min_score:
+            did = sym_index.disease_ids[pos]
+            info = symptom_dict.get(did, {})
             matches.append({
                 "disease_id": did,
                 "disease_name": disease_name.get(did, f"Bệnh ID {did}"),
                 "score": score,
-                "symptoms": sym_text,
+                "symptoms": info.get("symptoms", ""),
                 "link": info.get("link", ""),
             })
 
@@ -45,6 +151,44 @@ def find_symptom_matches(
     return matches[:max_results]
 
 
+def find_symptom_matches_batch(
+    user_texts: List[str],
+    disease_name: Dict[int, str],
+    symptom_dict: Dict[int, Dict[str, str]],
+    min_score: float = 0.9,
+    max_results: int = 5,
+    sym_index: SymptomIndex | None = None,
+) -> List[List[Dict[str, Any]]]:
+    """find_symptom_matches cho nhiều câu hỏi: điểm của cả batch tính bằng ma trận (cùng kết quả)."""
+    if sym_index is None:
+        sym_index = get_symptom_index(symptom_dict)
+    token_sets = [_normalize_tokens(t) for t in user_texts]
+    sizes = np.maximum(np.asarray(sym_index.sizes, dtype=np.float64), 1.0)
+    scores = sym_index.overlap_matrix(token_sets) / sizes
+
+    out: List[List[Dict[str, Any]]] = []
+    for tokens, row in zip(token_sets, scores):
+        if not tokens:
+            out.append([])
+            continue
+        cand = np.flatnonzero(row >= min_score)
+        # Sắp giảm dần theo điểm, bằng điểm giữ thứ tự gốc (như bản từng câu)
+        cand = cand[np.argsort(-row[cand], kind="stable")][:max_results]
+        matches: List[Dict[str, Any]] = []
+        for pos in cand.tolist():
+            did = sym_index.disease_ids[pos]
+            info = symptom_dict.get(did, {})
+            matches.append({
+                "disease_id": did,
+                "disease_name": disease_name.get(did, f"Bệnh ID {did}"),
+                "score": float(row[pos]),
+                "symptoms": info.get("symptoms", ""),
+                "link": info.get("link", ""),
+            })
+        out.append(matches)
+    return out
+
+
 def build_symptom_match_block(matches: List[Dict[str, Any]]) -> str:
     if not matches:
         return ""
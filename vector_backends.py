@@ -0,0 +1,378 @@
+from __future__ import annotations
+from typing import Any, Dict, Tuple
+import json
+import math
+import os
+
+import numpy as np
+
+from config import (
+    INDEX_BACKEND,
+    IVF_NLIST,
+    IVF_NPROBE,
+    HNSW_M,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_EF_SEARCH,
+    QUANT_RERANK,
+)
+
+
+def normalize_rows(mat: np.ndarray) -> np.ndarray:
+    """Chuẩn hóa L2 từng dòng (float32); dòng toàn 0 giữ nguyên."""
+    mat = np.asarray(mat, dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=-1, keepdims=True)
+    return mat / np.maximum(norms, 1e-9)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Chỉ số top-k theo trục cuối (giảm dần), dùng argpartition thay vì sort toàn bộ."""
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    if k < n:
+        part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        part = np.broadcast_to(np.arange(n), scores.shape).copy()
+    part_scores = np.take_along_axis(scores, part, axis=-1)
+    order = np.argsort(-part_scores, axis=-1, kind="stable")
+    return np.take_along_axis(part, order, axis=-1)
+
+
+def search_rows(mat: np.ndarray, q: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Tìm chính xác chỉ trong tập dòng rows (đã lọc theo metadata); trả về chỉ số dòng gốc."""
+    sims = q @ np.asarray(mat[rows]).T
+    top = top_k_indices(sims, k)
+    return np.take_along_axis(sims, top, axis=-1), rows[top]
+
+
+class ExactBackend:
+    """Tìm kiếm chính xác: một phép nhân ma trận trên toàn bộ embeddings."""
+
+    name = "exact"
+
+    def __init__(self) -> None:
+        self.mat: np.ndarray | None = None
+
+    def build(self, mat: np.ndarray) -> None:
+        self.mat = mat
+
+    def search(self, q: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """q: (n_query, dim) đã chuẩn hóa. Trả về (scores, indices) shape (n_query, k)."""
+        sims = q @ self.mat.T
+        idx = top_k_indices(sims, k)
+        return np.take_along_axis(sims, idx, axis=-1), idx
+
+    def save(self, path: str) -> None:
+        # Không có trạng thái riêng ngoài ma trận embeddings
+        pass
+
+    def load(self, path: str, mat: np.ndarray) -> bool:
+        self.mat = mat
+        return True
+
+
+class IVFBackend:
+    """ANN dạng IVF: k-means (cosine) chia embeddings thành nlist cụm, chỉ quét nprobe cụm gần nhất.
+
+    nlist lớn + nprobe nhỏ -> nhanh hơn nhưng recall thấp hơn; nprobe = nlist tương đương exact.
+    """
+
+    name = "ivf"
+
+    def __init__(
+        self,
+        nlist: int | None = IVF_NLIST,
+        nprobe: int = IVF_NPROBE,
+        n_iter: int = 10,
+        seed: int = 0,
+    ) -> None:
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.seed = seed
+        self.mat: np.ndarray | None = None
+        self.centroids: np.ndarray | None = None
+        self.order: np.ndarray | None = None  # chỉ số dòng, xếp theo cụm
+        self.offsets: np.ndarray | None = None  # cụm c = order[offsets[c]:offsets[c + 1]]
+
+    def _kmeans(self, mat: np.ndarray, nlist: int) -> np.ndarray:
+        rng = np.random.default_rng(self.seed)
+        # Train trên mẫu tối đa 64 điểm/cụm cho nhanh
+        n_train = min(mat.shape[0], 64 * nlist)
+        train = mat[rng.choice(mat.shape[0], n_train, replace=False)]
+        centroids = train[rng.choice(n_train, nlist, replace=False)].copy()
+        for _ in range(self.n_iter):
+            assign = np.argmax(train @ centroids.T, axis=1)
+            counts = np.bincount(assign, minlength=nlist)
+            order = np.argsort(assign, kind="stable")
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            nonempty = counts > 0
+            # Tổng từng cụm bằng reduceat trên dữ liệu đã xếp theo cụm; cụm rỗng giữ centroid cũ
+            sums = centroids.copy()
+            sums[nonempty] = np.add.reduceat(train[order], starts[nonempty], axis=0)
+            centroids = normalize_rows(sums)
+        return centroids
+
+    def build(self, mat: np.ndarray) -> None:
+        n = mat.shape[0]
+        nlist = self.nlist or max(1, int(4 * math.sqrt(n)))
+        nlist = max(1, min(nlist, n))
+        self.mat = mat
+        self.centroids = self._kmeans(np.asarray(mat, dtype=np.float32), nlist)
+        self._assign()
+
+    def _assign(self) -> None:
+        nlist = self.centroids.shape[0]
+        assign = np.empty(self.mat.shape[0], dtype=np.int64)
+        step = 65536
+        for start in range(0, self.mat.shape[0], step):
+            block = np.asarray(self.mat[start:start + step])
+            assign[start:start + step] = np.argmax(block @ self.centroids.T, axis=1)
+        self.order = np.argsort(assign, kind="stable")
+        self.offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(assign, minlength=nlist))]
+        ).astype(np.int64)
+
+    def search(self, q: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        nlist = self.centroids.shape[0]
+        nprobe = max(1, min(self.nprobe, nlist))
+        k = min(k, self.mat.shape[0])
+        probes = top_k_indices(q @ self.centroids.T, nprobe)
+
+        out_scores = np.full((q.shape[0], k), -np.inf, dtype=np.float32)
+        out_idx = np.full((q.shape[0], k), -1, dtype=np.int64)
+        for qi in range(q.shape[0]):
+            cand = np.concatenate(
+                [self.order[self.offsets[c]:self.offsets[c + 1]] for c in probes[qi]]
+            )
+            if cand.shape[0] < k:
+                # Quá ít ứng viên trong các cụm đã quét -> quét toàn bộ
+                cand = np.arange(self.mat.shape[0])
+            sims = np.asarray(self.mat[cand]) @ q[qi]
+            top = top_k_indices(sims, k)
+            out_scores[qi] = sims[top]
+            out_idx[qi] = cand[top]
+        return out_scores, out_idx
+
+    def save(self, path: str) -> None:
+        np.savez(
+            path,
+            centroids=self.centroids,
+            order=self.order,
+            offsets=self.offsets,
+            params=json.dumps({"nlist": self.nlist, "n_iter": self.n_iter, "seed": self.seed}),
+        )
+
+    def load(self, path: str, mat: np.ndarray) -> bool:
+        try:
+            data = np.load(path + ".npz")
+        except OSError:
+            return False
+        if int(data["offsets"][-1]) != mat.shape[0]:
+            return False
+        self.mat = mat
+        self.centroids = data["centroids"]
+        self.order = data["order"]
+        self.offsets = data["offsets"]
+        return True
+
+
+class HNSWBackend:
+    """ANN dạng đồ thị HNSW qua thư viện tùy chọn hnswlib (pip install hnswlib).
+
+    M / ef_construction: chất lượng đồ thị khi build; ef_search: đánh đổi recall/độ trễ khi truy vấn.
+    """
+
+    name = "hnsw"
+
+    def __init__(
+        self,
+        m: int = HNSW_M,
+        ef_construction: int = HNSW_EF_CONSTRUCTION,
+        ef_search: int = HNSW_EF_SEARCH,
+    ) -> None:
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.graph: Any = None
+        self.n = 0
+
+    @staticmethod
+    def _hnswlib() -> Any:
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise RuntimeError(
+                "INDEX_BACKEND = 'hnsw' cần thư viện hnswlib: pip install hnswlib"
+            ) from e
+        return hnswlib
+
+    def build(self, mat: np.ndarray) -> None:
+        hnswlib = self._hnswlib()
+        self.n, dim = mat.shape
+        self.graph = hnswlib.Index(space="ip", dim=dim)
+        self.graph.init_index(max_elements=self.n, ef_construction=self.ef_construction, M=self.m)
+        self.graph.add_items(np.asarray(mat, dtype=np.float32), np.arange(self.n))
+        self.graph.set_ef(self.ef_search)
+
+    def search(self, q: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(k, self.n)
+        self.graph.set_ef(max(self.ef_search, k))
+        labels, dists = self.graph.knn_query(q, k=k)
+        # space="ip": khoảng cách = 1 - tích vô hướng
+        return (1.0 - dists).astype(np.float32), labels.astype(np.int64)
+
+    def save(self, path: str) -> None:
+        self.graph.save_index(path + ".hnsw")
+
+    def load(self, path: str, mat: np.ndarray) -> bool:
+        hnswlib = self._hnswlib()
+        graph = hnswlib.Index(space="ip", dim=mat.shape[1])
+        try:
+            graph.load_index(path + ".hnsw", max_elements=mat.shape[0])
+        except RuntimeError:
+            return False
+        if graph.get_current_count() != mat.shape[0]:
+            return False
+        graph.set_ef(self.ef_search)
+        self.graph = graph
+        self.n = mat.shape[0]
+        return True
+
+
+class QuantizedBackend:
+    """Chấm điểm trên bản nén của embeddings (int8 hoặc float16) rồi re-rank chính xác bằng float32.
+
+    - int8: lượng tử hóa đối xứng theo từng chiều, x[:, j] ~ codes[:, j] * scale[j]
+      -> q . x ~ (q * scale) . codes, nhỏ hơn float32 4 lần
+    - fp16: ép kiểu float16, nhỏ hơn 2 lần
+    rerank ứng viên tốt nhất được chấm lại trên ma trận float32 gốc (0 = tắt), chỉ khi ma trận gốc
+    là memory-map: khi đó chỉ các dòng ứng viên được đọc từ đĩa, phần thường trực trong RAM là bản
+    nén. Ma trận float32 nằm trong RAM không được giữ lại (build từ mảng thường thì chỉ có điểm
+    xấp xỉ cho tới khi save_snapshot gắn lại bản memory-map).
+
+    Lợi ích là bộ nhớ, không phải tốc độ: chấm điểm phải giải nén từng khối sang float32 nên với
+    NumPy thường chậm hơn ExactBackend.
+    """
+
+    name = "int8"
+    dtype: Any = np.int8
+    mmap_embeddings = True  # snapshot mở embeddings float32 dạng memory-map khi dùng backend này
+    _BLOCK = 8192  # số dòng giải nén mỗi lần khi chấm điểm
+
+    def __init__(self, rerank: int = QUANT_RERANK) -> None:
+        self.rerank = rerank
+        self.mat: np.ndarray | None = None
+        self.codes: np.ndarray | None = None
+        self.scale: np.ndarray | None = None
+
+    def _encode(self, mat: np.ndarray) -> None:
+        if self.dtype == np.float16:
+            self.codes = np.asarray(mat, dtype=np.float16)
+            self.scale = None
+            return
+        dim = mat.shape[1]
+        max_abs = np.zeros(dim, dtype=np.float32)
+        for start in range(0, mat.shape[0], self._BLOCK):
+            block = np.abs(np.asarray(mat[start:start + self._BLOCK], dtype=np.float32))
+            np.maximum(max_abs, block.max(axis=0, initial=0.0), out=max_abs)
+        self.scale = np.maximum(max_abs, 1e-12) / 127.0
+        codes = np.empty(mat.shape, dtype=np.int8)
+        for start in range(0, mat.shape[0], self._BLOCK):
+            block = np.asarray(mat[start:start + self._BLOCK], dtype=np.float32) / self.scale
+            codes[start:start + self._BLOCK] = np.clip(np.rint(block), -127, 127)
+        self.codes = codes
+
+    def build(self, mat: np.ndarray) -> None:
+        self._encode(mat)
+        # Chỉ giữ tham chiếu tới bản memory-map; mảng float32 trong RAM để caller giải phóng
+        self.mat = mat if isinstance(mat, np.memmap) else None
+
+    def _approx_scores(self, q: np.ndarray) -> np.ndarray:
+        qs = q * self.scale if self.scale is not None else q
+        qs = np.asarray(qs, dtype=np.float32)
+        n = self.codes.shape[0]
+        sims = np.empty((q.shape[0], n), dtype=np.float32)
+        for start in range(0, n, self._BLOCK):
+            block = np.asarray(self.codes[start:start + self._BLOCK], dtype=np.float32)
+            sims[:, start:start + self._BLOCK] = qs @ block.T
+        return sims
+
+    def search(self, q: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        sims = self._approx_scores(q)
+        n_cand = max(k, self.rerank) if self.rerank > 0 and self.mat is not None else k
+        cand = top_k_indices(sims, n_cand)
+        if self.rerank <= 0 or self.mat is None:
+            return np.take_along_axis(sims, cand, axis=-1), cand
+        k = min(k, cand.shape[1])
+        out_scores = np.empty((q.shape[0], k), dtype=np.float32)
+        out_idx = np.empty((q.shape[0], k), dtype=np.int64)
+        for qi in range(q.shape[0]):
+            # Đọc dòng memory-map theo thứ tự tăng dần cho thân thiện với page cache
+            rows = np.sort(cand[qi])
+            exact = np.asarray(self.mat[rows], dtype=np.float32) @ q[qi]
+            top = top_k_indices(exact, k)
+            out_scores[qi] = exact[top]
+            out_idx[qi] = rows[top]
+        return out_scores, out_idx
+
+    def save(self, path: str) -> None:
+        # Ghi file tạm rồi đổi tên: process khác có thể đang memory-map bản codes cũ
+        arrays = {"_codes.npy": self.codes}
+        if self.scale is not None:
+            arrays["_scale.npy"] = self.scale
+        for suffix, arr in arrays.items():
+            np.save(path + suffix + ".tmp.npy", arr)
+            os.replace(path + suffix + ".tmp.npy", path + suffix)
+
+    def load(self, path: str, mat: np.ndarray) -> bool:
+        try:
+            codes = np.load(path + "_codes.npy", mmap_mode="r")
+            scale = np.load(path + "_scale.npy") if self.dtype == np.int8 else None
+        except OSError:
+            return False
+        if codes.dtype != self.dtype or codes.shape != mat.shape:
+            return False
+        self.mat = mat
+        self.codes = codes
+        self.scale = scale
+        return True
+
+
+class Float16Backend(QuantizedBackend):
+    name = "fp16"
+    dtype = np.float16
+
+
+BACKENDS: Dict[str, Any] = {
+    ExactBackend.name: ExactBackend,
+    IVFBackend.name: IVFBackend,
+    HNSWBackend.name: HNSWBackend,
+    QuantizedBackend.name: QuantizedBackend,
+    Float16Backend.name: Float16Backend,
+}
+
+
+def make_backend(kind: str = INDEX_BACKEND) -> Any:
+    try:
+        return BACKENDS[kind]()
+    except KeyError:
+        raise ValueError(
+            f"INDEX_BACKEND không hợp lệ: '{kind}'. Chọn một trong: {sorted(BACKENDS)}"
+        ) from None
+
+
+def get_backend(index: Dict[str, Any], kind: str | None = None) -> Any:
+    """Backend tìm kiếm của index, build lần đầu khi cần rồi giữ trong index["backend"].
+
+    kind=None: dùng backend đã gắn trong index (vd bench gắn sẵn), chưa có thì config.INDEX_BACKEND.
+    """
+    backend = index.get("backend")
+    if kind is None:
+        kind = backend.name if backend is not None else INDEX_BACKEND
+    if backend is None or backend.name != kind:
+        backend = make_backend(kind)
+        backend.build(index["embeddings"])
+        index["backend"] = backend
+    return backend